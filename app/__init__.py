@@ -12,10 +12,14 @@ from flask import current_app, jsonify
 # Note here we try to keep a bijective ORM - Schema - REST resource relationship, to keep app structure simple
 
 from .schemas import models, ma
-from .animals import animals, animal_read, animal_edit, animal_add, animal_delete
-from .species import species, species_read, species_edit, species_add, species_delete
+from .animals import animals, animals_top, animals_stream, animal_read, animal_edit, animals_edit, animal_add, \
+    animal_delete, animal_feed, animal_play
+from .species import species, species_read, species_edit, species_add, species_delete, species_cache_stats, \
+    species_stats, species_stats_read
 from .owners import owners, owner_read, owner_edit, owner_add, owner_delete
 from .users import users, user_read, user_edit, user_add, user_delete
+from .batch import batch
+from . import negotiation, simulation
 
 # local import
 from instance.config import app_config
@@ -43,6 +47,9 @@ def create_app(config_name):
     # https://stackoverflow.com/questions/33738467/how-do-i-know-if-i-can-disable-sqlalchemy-track-modifications
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+    # renderers and parsers, by content negotiation
+    negotiation.register(app)
+
     models.db.init_app(app)
     models.admin.init_app(app)
     ma.init_app(app)
@@ -51,6 +58,7 @@ def create_app(config_name):
     # TODO : api in blue print... ( check with flask api )
 
     app.add_url_rule('/api/', view_func=api_details)
+    app.add_url_rule('/api/batch', view_func=batch, methods=["POST"])
     app.add_url_rule('/api/users/', view_func=users)
     app.add_url_rule('/api/users/<id>', view_func=user_read, methods=["GET"])
     app.add_url_rule('/api/users/<id>', view_func=user_edit, methods=["PUT"])
@@ -64,15 +72,23 @@ def create_app(config_name):
     app.add_url_rule('/api/owners/<id>', view_func=owner_delete, methods=["DELETE"])
 
     app.add_url_rule('/api/species/', view_func=species)
+    app.add_url_rule('/api/species/cache', view_func=species_cache_stats, methods=["GET"])
+    app.add_url_rule('/api/species/stats', view_func=species_stats, methods=["GET"])
+    app.add_url_rule('/api/species/<id>/stats', view_func=species_stats_read, methods=["GET"])
     app.add_url_rule('/api/species/<id>', view_func=species_read, methods=["GET"])
     app.add_url_rule('/api/species/<id>', view_func=species_edit, methods=["PUT"])
     app.add_url_rule('/api/species/', view_func=species_add, methods=["POST"])
     app.add_url_rule('/api/species/<id>', view_func=species_delete, methods=["DELETE"])
 
     app.add_url_rule('/api/animals/', view_func=animals)
+    app.add_url_rule('/api/animals/top', view_func=animals_top, methods=["GET"])
+    app.add_url_rule('/api/animals/stream', view_func=animals_stream, methods=["GET"])
     app.add_url_rule('/api/animals/<id>', view_func=animal_read, methods=["GET"])
     app.add_url_rule('/api/animals/<id>', view_func=animal_edit, methods=["PUT"])
     app.add_url_rule('/api/animals/', view_func=animal_add, methods=["POST"])
+    app.add_url_rule('/api/animals/', view_func=animals_edit, methods=["PATCH"])
     app.add_url_rule('/api/animals/<id>', view_func=animal_delete, methods=["DELETE"])
+    app.add_url_rule('/api/animals/<id>/feed', view_func=animal_feed, methods=["POST"])
+    app.add_url_rule('/api/animals/<id>/play', view_func=animal_play, methods=["POST"])
 
     return app
@@ -0,0 +1,241 @@
+"""
+Actions on animals, changing their stats relatively : feeding (hungry decreases) and playing (happy increases).
+
+POST /api/animals/<id>/feed or /api/animals/<id>/play, with an optional {"amount": n} body (ACTION_AMOUNT by default) :
+ - the stat is changed in one atomic UPDATE (SET hungry = hungry - :amount), without any read-modify-write :
+   concurrent actions on the same animal all count
+ - the response holds the animal, with its new stats.
+With ACTIONS_FLUSH_WINDOW set (seconds), actions are buffered instead (write-behind) : the deltas are summed per
+animal in memory, and written once the window is over, all animals in one executemany UPDATE and one transaction.
+The response is then 202 Accepted, before the write. The buffer is flushed when the process exits normally.
+Actions are journaled (see models.journal) : with ACTIONS_JOURNAL set, they are only recorded, 202 Accepted,
+and folded into the animals by the journal compaction (the write-behind buffer is not used).
+
+Stats are kept in the SQL INTEGER range. The deltas leave the stats clock (stats_updated_at) as it is : the
+simulation, or the lazy derived stats, keep decaying the stats from it (see models.stats).
+"""
+
+import atexit
+import http
+import logging
+import threading
+import weakref
+
+import sqlalchemy
+from flask import current_app, has_app_context
+
+try:
+    from .schemas import models, apply_loading_plan
+    from .schemas.models import journal, versions
+    from . import fieldsets, negotiation
+except SystemError:  # in case we call this module directly (doctest)
+    from schemas import models, apply_loading_plan
+    from schemas.models import journal, versions
+    import fieldsets
+    import negotiation
+
+# stat changed by each action, and direction
+ACTIONS = {
+    'feed': ('hungry', -1),
+    'play': ('happy', 1),
+}
+STAT_ACTIONS = {stat: action for action, (stat, _) in ACTIONS.items()}  # for coalesced deltas
+
+logger = logging.getLogger(__name__)
+
+
+class ActionError(ValueError):
+    """Invalid action parameters. args[0] is a marshmallow-like errors dict"""
+    pass
+
+
+def amount_args(data):
+    """
+    Parses the action body.
+    :param data: the posted JSON, None or {"amount": n}
+    :return: the amount
+    """
+    config = current_app.config
+    if data is None:
+        return config['ACTION_AMOUNT']
+    if not isinstance(data, dict):
+        raise ActionError({'_schema': ['Invalid input type.']})
+    amount = data.get('amount', config['ACTION_AMOUNT'])
+    if not isinstance(amount, int) or isinstance(amount, bool) or not 0 < amount <= config['ACTION_AMOUNT_MAX']:
+        raise ActionError({'amount': ['Must be between 1 and {}.'.format(config['ACTION_AMOUNT_MAX'])]})
+    return amount
+
+
+def apply(deltas, session=None):
+    """
+    Adds deltas to the animals stats, in one executemany UPDATE, journals them, and commits.
+    :param deltas: a dict {animal id: {stat: delta}}
+    :param session: optional in case flask has not been initialized
+    """
+    if session is None:
+        session = models.db.session
+    written = set(journal.TABLES)
+    try:
+        written.update(journal.add_to_stats(session, deltas))
+        journal.record(session, [(id, STAT_ACTIONS[stat], {stat: delta})
+                                 for id in sorted(deltas) for stat, delta in sorted(deltas[id].items())])
+        session.commit()
+    except:
+        session.rollback()
+        raise
+    finally:  # core updates skip the ORM events
+        versions.bump(*written)
+
+
+class WriteBehindBuffer(object):
+    """
+    Sums the actions deltas per animal, and applies them once the flush window is over.
+
+    >>> applied = []
+    >>> buffer = WriteBehindBuffer(window=60, apply=applied.append)
+    >>> buffer.add(1, 'hungry', -10)
+    >>> buffer.add(1, 'hungry', -10)
+    >>> buffer.add(2, 'happy', 5)
+    >>> len(buffer)
+    2
+    >>> buffer.flush()
+    >>> applied
+    [{1: {'hungry': -20}, 2: {'happy': 5}}]
+    >>> buffer.flush()  # nothing more to write
+    >>> len(applied)
+    1
+    """
+
+    def __init__(self, window, apply):
+        """
+        :param window: seconds the deltas are kept before being applied
+        :param apply: the function applying a dict {animal id: {stat: delta}}
+        """
+        self.window = window
+        self._apply = apply
+        self._deltas = {}
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._deltas)
+
+    def add(self, id, stat, delta):
+        """
+        Buffers a delta, the flush is scheduled at the end of the window.
+        :param id: the animal id
+        :param stat: the stat column
+        :param delta: the change
+        """
+        with self._lock:
+            self._merge({id: {stat: delta}})
+
+    def _merge(self, deltas):
+        """Adds deltas, and schedules the flush (with the lock held)"""
+        for id, stat_deltas in deltas.items():
+            buffered = self._deltas.setdefault(id, {})
+            for stat, delta in stat_deltas.items():
+                buffered[stat] = buffered.get(stat, 0) + delta
+        if self._timer is None:
+            self._timer = threading.Timer(self.window, self.flush, kwargs={'raise_errors': False})
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self, raise_errors=True):
+        """
+        Applies the buffered deltas now. On failure, they are buffered again, for the next window.
+        :param raise_errors: whether the failure is raised, after being logged (False for the timer and the exit)
+        """
+        with self._lock:
+            deltas, self._deltas = self._deltas, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not deltas:
+            return
+        try:
+            self._apply(deltas)
+        except Exception:
+            logger.exception("Actions of %s animals could not be written, retrying with the next flush", len(deltas))
+            with self._lock:
+                self._merge(deltas)
+            if raise_errors:
+                raise
+
+
+# buffers of the apps, flushed when the process exits
+_buffers = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_buffers():
+    for buffer in list(_buffers):
+        buffer.flush(raise_errors=False)
+
+
+def action_buffer():
+    """
+    The write-behind buffer of the current app
+    :return: the WriteBehindBuffer, None outside of an app context, or when disabled (ACTIONS_FLUSH_WINDOW = 0)
+    """
+    if not has_app_context() or not current_app.config.get('ACTIONS_FLUSH_WINDOW'):
+        return None
+    buffer = current_app.extensions.get('actions_buffer')
+    if buffer is None:
+        app = current_app._get_current_object()
+
+        def apply_in_app(deltas):
+            if has_app_context() and current_app._get_current_object() is app:
+                apply(deltas)
+            else:  # timer thread, or exit : the teardown of a nested context would remove the current session
+                with app.app_context():
+                    apply(deltas)
+
+        buffer = current_app.extensions.setdefault('actions_buffer', WriteBehindBuffer(
+            window=current_app.config['ACTIONS_FLUSH_WINDOW'], apply=apply_in_app))
+        _buffers.add(buffer)
+    return buffer
+
+
+def act(action, id, schema, dumper):
+    """
+    Action view implementation.
+    :param action: the action name, feed or play
+    :param id: the animal id
+    :param schema: the animal schema
+    :param dumper: the animal schema (or compiled dumper) to dump the animal with
+    :return: a view return value
+    """
+    try:
+        amount = amount_args(negotiation.request_data())
+        schema, dumper = fieldsets.sparse(schema, dumper)
+    except (ActionError, fieldsets.FieldsError) as e:
+        return e.args[0], http.HTTPStatus.BAD_REQUEST
+    animals = models.Animal.__table__
+    row = models.db.session.execute(sqlalchemy.select([animals.c.id]).where(animals.c.id == id)).first()
+    if row is None:
+        return '', http.HTTPStatus.NOT_FOUND
+    id = row[0]
+    stat, sign = ACTIONS[action]
+
+    if current_app.config.get('ACTIONS_JOURNAL'):  # folded later (see models.journal)
+        try:
+            journal.record(models.db.session, [(id, action, {stat: sign * amount})], applied=False)
+            models.db.session.commit()
+        except:
+            models.db.session.rollback()
+            raise
+        return {'id': id, stat: sign * amount}, http.HTTPStatus.ACCEPTED
+
+    buffer = action_buffer()
+    if buffer is not None:
+        buffer.add(id, stat, sign * amount)
+        return {'id': id, stat: sign * amount}, http.HTTPStatus.ACCEPTED
+
+    apply({id: {stat: sign * amount}})
+    animal = apply_loading_plan(models.Animal.query, schema).get(id)
+    animal_dict, errors = dumper.dump(animal)
+    if not errors:
+        return animal_dict
+    else:  # break properly
+        return '', http.HTTPStatus.INTERNAL_SERVER_ERROR
@@ -1,39 +1,134 @@
 import http
 
 try:
-    from .schemas import models, animal_schema
+    from .schemas import models, animal_schema, animal_dumper, apply_loading_plan
+    from .schemas.models import stats
+    from . import actions, bulk, caching, conditional, fieldsets, filters, leaderboard, multiget, negotiation, \
+        pagination, sse, streaming, sync
 except SystemError:  # in case we call this module directly (doctest)
-    from schemas import models, animal_schema
+    from schemas import models, animal_schema, animal_dumper, apply_loading_plan
+    from schemas.models import stats
+    import actions
+    import bulk
+    import caching
+    import conditional
+    import fieldsets
+    import filters
+    import leaderboard
+    import multiget
+    import negotiation
+    import pagination
+    import sse
+    import streaming
+    import sync
+
+from flask import jsonify
+
+# fields /api/animals/ can be filtered on (see filters module)
+FILTERABLE = ('name', 'owner_id', 'species_id', 'happy', 'hungry')
+# stored stats are only a baseline in lazy stats mode
+LAZY_STATS_FILTERABLE = ('name', 'owner_id', 'species_id')
+
+
+@caching.cached_response('animals', 'species', 'owners', 'users', bypass=stats.lazy_stats_enabled)
+def animals():
+    """
+    Retrieves a page of animals
+    (see pagination module for limit and after parameters, streaming module for full dumps, multiget module for ids,
+    sync module for modified_since, fieldsets module for sparse dumps and embedded relationships,
+    filters module for filters on FILTERABLE fields)
+    :return:
+    """
+    try:
+        schema, dumper = fieldsets.sparse(animal_schema, animal_dumper)
+        query = filters.apply_filters(apply_loading_plan(models.Animal.query, schema), models.Animal, animal_schema,
+                                      LAZY_STATS_FILTERABLE if stats.lazy_stats_enabled() else FILTERABLE)
+        ids = multiget.ids_args()
+        if ids is not None:
+            return multiget.multi_get(query, models.Animal.id, dumper, ids)
+        since = sync.since_args()
+        fmt = streaming.stream_format()
+        if since is not None:
+            return sync.changes(query, models.Animal, dumper, since, fmt)
+        if fmt:
+            return streaming.stream_collection(query, dumper, models.Animal.id, fmt)
+        page = pagination.keyset_page(query, models.Animal.id)
+    except (fieldsets.FieldsError, filters.FilterError, multiget.MultiGetError, pagination.PaginationError,
+            streaming.StreamingError, sync.SyncError) as e:
+        return e.args[0], http.HTTPStatus.BAD_REQUEST
+    animal_dict, errors = dumper.dump(page.items, many=True)
+    if not errors:
+        return animal_dict, http.HTTPStatus.OK, pagination.page_headers(page)
+    else:  # break properly
+        return '', http.HTTPStatus.INTERNAL_SERVER_ERROR
 
-from flask import jsonify, request
 
+def animals_stream():
+    """
+    Streams the animals changes, as server-sent events
+    (see sse module for owner_id and species_id filters, and the events format)
+    :return:
+    """
+    return sse.stream(animal_schema)
 
 
-def animals():
+@caching.cached_response('animals', 'species', 'owners', 'users', bypass=stats.lazy_stats_enabled)
+def animals_top():
     """
-    Retrieves all animals
+    Retrieves the hungriest, or unhappiest, animals
+    (see leaderboard module for by and k parameters, and owner_id, species_id filters)
     :return:
     """
-    all_animals = models.Animal.all()
-    animal_dict, errors = animal_schema.dump(all_animals, many=True)
+    try:
+        schema, dumper = fieldsets.sparse(animal_schema, animal_dumper)
+        query = filters.apply_filters(models.Animal.query, models.Animal, animal_schema, ('owner_id', 'species_id'))
+        by, k = leaderboard.top_args()
+    except (fieldsets.FieldsError, filters.FilterError, leaderboard.LeaderboardError) as e:
+        return e.args[0], http.HTTPStatus.BAD_REQUEST
+    animal_dict, errors = dumper.dump(leaderboard.top(query, schema, by, k), many=True)
     if not errors:
         return animal_dict
     else:  # break properly
         return '', http.HTTPStatus.INTERNAL_SERVER_ERROR
 
 
+def _animal_validators(id):
+    """The conditional GET validators of an animal (see conditional module), None if not found"""
+    row = models.db.session.query(
+        models.Animal.id, models.Animal.date_modified, models.Species.date_modified,
+        models.Owner.date_modified, models.User.date_modified,
+    ).select_from(models.Animal).join(models.Species).outerjoin(models.Owner).outerjoin(models.User) \
+        .filter(models.Animal.id == id).first()
+    if row is None:
+        return None
+    derived = None
+    if stats.lazy_stats_enabled():  # current stats change without any write
+        derived = models.Animal.derived_stats(models.Animal.id == row[0])
+    return conditional.make_validators(row[0], row[1:], derived, variant=fieldsets.variant_key())
+
+
 def animal_read(id):
     """
     Retrieve an animal
+    (answers 304 Not Modified to If-None-Match and If-Modified-Since, see conditional module)
     :param id:
     :return:
     """
-    animal = models.Animal.query.get(id)
+    try:
+        schema, dumper = fieldsets.sparse(animal_schema, animal_dumper)
+    except fieldsets.FieldsError as e:
+        return e.args[0], http.HTTPStatus.BAD_REQUEST
+    validators = _animal_validators(id)
+    if validators is None:
+        return '', http.HTTPStatus.NOT_FOUND
+    if conditional.not_modified(validators):
+        return '', http.HTTPStatus.NOT_MODIFIED, conditional.headers(validators)
+    animal = apply_loading_plan(models.Animal.query, schema).get(id)
     if not animal:
         return '', http.HTTPStatus.NOT_FOUND
-    animal_dict, errors = animal_schema.dump(animal)
+    animal_dict, errors = dumper.dump(animal)
     if not errors:
-        return animal_dict
+        return animal_dict, http.HTTPStatus.OK, conditional.headers(validators)
     else:  # break properly
         return '', http.HTTPStatus.INTERNAL_SERVER_ERROR
 
@@ -44,7 +139,11 @@ def animal_edit(id):
     :param id: the animal id
     :return:
     """
-    data = request.get_json()
+    data = negotiation.request_data()
+    try:
+        dumper = fieldsets.sparse(animal_schema, animal_dumper)[1]
+    except fieldsets.FieldsError as e:
+        return e.args[0], http.HTTPStatus.BAD_REQUEST
     animal = models.Animal.query.get(id)
 
     if not animal:
@@ -53,30 +152,67 @@ def animal_edit(id):
     for k, v in data.items():
         setattr(animal, k, v)
 
-    user_dict, errors = animal_schema.dump(animal)
+    user_dict, errors = dumper.dump(animal)
     if not errors:
         return user_dict
     else:  # break properly
         return '', http.HTTPStatus.INTERNAL_SERVER_ERROR
 
 
+def animal_feed(id):
+    """
+    Feeds an animal : its hungry stat decreases, atomically
+    (see actions module for the amount, and the write-behind buffer)
+    :param id: the animal id
+    :return:
+    """
+    return actions.act('feed', id, animal_schema, animal_dumper)
+
+
+def animal_play(id):
+    """
+    Plays with an animal : its happy stat increases, atomically
+    (see actions module for the amount, and the write-behind buffer)
+    :param id: the animal id
+    :return:
+    """
+    return actions.act('play', id, animal_schema, animal_dumper)
+
+
 def animal_add():
     """
     Adds an animal
+    (or many at once from a JSON array, see bulk module)
     :return:
     """
-    data = request.get_json()
+    data = negotiation.request_data()
+    try:
+        dumper = fieldsets.sparse(animal_schema, animal_dumper)[1]
+    except fieldsets.FieldsError as e:
+        return e.args[0], http.HTTPStatus.BAD_REQUEST
+    if isinstance(data, list):
+        return bulk.bulk_add(animal_schema)
+
     animal, errors = animal_schema.load(data, )
     if not errors:
         animal.save()
 
-    animal_dict, errors = animal_schema.dump(animal)
+    animal_dict, errors = dumper.dump(animal)
     if not errors:
         return animal_dict, http.HTTPStatus.CREATED
     else:  # break properly
         return '', http.HTTPStatus.INTERNAL_SERVER_ERROR
 
 
+def animals_edit():
+    """
+    Edit many animals at once, from a JSON array of {id, changes}
+    (see bulk module)
+    :return:
+    """
+    return bulk.bulk_edit(animal_schema)
+
+
 def animal_delete(id):
     """
     Deletes an owner
@@ -0,0 +1,157 @@
+"""
+Batch of API calls, in one request and one transaction.
+
+POST a JSON array of {"method": "GET", "path": "/api/owners/1", "body": ..., "headers": {...}} to /api/batch
+(body and headers are optional) :
+ - the sub-requests are dispatched in order to the API views, in the same worker, without any network round trip
+ - they share one database session, joined to one transaction : the views commits only end their subtransactions,
+   everything is committed once, at the end (and published to the change feed then, see models.changes)
+ - the response holds the {"status": ..., "headers": {...}, "body": ...} results, in request order
+ - a sub-request answering an error stops the batch, and rolls everything back : the batch answers with its status,
+   and the results up to that one.
+Batches can not be nested, nor hold streams, and hold at most BATCH_MAX sub-requests.
+"""
+
+import http
+import json
+
+from flask import current_app, request
+
+try:
+    from .schemas import models, cache
+    from .schemas.models import changes, versions
+    from . import negotiation
+except SystemError:  # in case we call this module directly (doctest)
+    from schemas import models, cache
+    from schemas.models import changes, versions
+    import negotiation
+
+METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
+PATH = '/api/batch'
+UNBATCHABLE = (PATH, '/api/animals/stream')  # nested batches, endless streams
+
+
+class BatchError(ValueError):
+    """Invalid batch. args[0] is a marshmallow-like errors dict"""
+    pass
+
+
+def batch_load(data):
+    """
+    Validates a list of sub-requests.
+    :param data: the posted JSON
+    :return: the list of sub-requests, as dicts with method, path, body and headers
+    """
+    if not isinstance(data, list):
+        raise BatchError({'_schema': ['Invalid input type.']})
+    maximum = current_app.config['BATCH_MAX']
+    if len(data) > maximum:
+        raise BatchError({'_schema': ['Too many sub-requests, at most {}.'.format(maximum)]})
+
+    subrequests, errors = [], {}
+    for index, item in enumerate(data):
+        if not isinstance(item, dict):
+            errors[index] = {'_schema': ['Invalid input type.']}
+            continue
+        item_errors = {}
+        method = item.get('method', 'GET')
+        if not isinstance(method, str) or method.upper() not in METHODS:
+            item_errors['method'] = ['Must be one of: {}.'.format(', '.join(METHODS))]
+        path = item.get('path')
+        if not isinstance(path, str) or not path.startswith('/api/') \
+                or path.split('?')[0].rstrip('/') in UNBATCHABLE:
+            item_errors['path'] = ['Not a valid API path.']
+        headers = item.get('headers', {})
+        if not isinstance(headers, dict):
+            item_errors['headers'] = ['Not a valid mapping type.']
+        if item_errors:
+            errors[index] = item_errors
+        else:
+            subrequests.append({'method': method.upper(), 'path': path, 'body': item.get('body'),
+                                'headers': headers})
+    if errors:
+        raise BatchError(errors)
+    return subrequests
+
+
+def dispatch(subrequest):
+    """
+    Runs one sub-request through the app, in the current app context.
+    :param subrequest: a dict with method, path, body and headers (see batch_load)
+    :return: the result dict, with status, headers and body
+    """
+    headers = dict(subrequest['headers'], Accept='application/json')
+    body = subrequest['body']
+    with current_app.test_request_context(subrequest['path'], base_url=request.host_url, method=subrequest['method'],
+                                          headers=headers, content_type='application/json',
+                                          data=json.dumps(body) if body is not None else None):
+        response = current_app.full_dispatch_request()
+        data = response.get_data(as_text=True)
+    if response.mimetype == 'application/json' and data:
+        data = json.loads(data)
+    return {
+        'status': response.status_code,
+        'headers': {k: v for k, v in response.headers.items() if k not in ('Content-Type', 'Content-Length')},
+        'body': data,
+    }
+
+
+def execute(subrequests):
+    """
+    Dispatches sub-requests, sharing one session and one transaction.
+    :param subrequests: the list of sub-requests (see batch_load)
+    :return: a tuple (results, failed status or None if everything was committed)
+    """
+    connection = models.db.engine.connect()
+    transaction = connection.begin()
+    registry = models.db.session.registry
+    previous = registry() if registry.has() else None
+    session = models.db.create_session({'bind': connection, 'binds': {}})()  # every table on the connection
+    session.info['hold_changes'] = True  # the change feed waits for the actual commit
+    registry.set(session)
+    tables = sorted(models.db.metadata.tables)
+    before = versions.versions(tables)
+
+    results, failed, committed = [], None, False
+    try:
+        for subrequest in subrequests:
+            results.append(dispatch(subrequest))
+            if results[-1]['status'] >= 400 or not transaction.is_active:
+                failed = results[-1]['status'] if results[-1]['status'] >= 400 else http.HTTPStatus.CONFLICT
+                break
+        if failed is None:
+            transaction.commit()
+            committed = True
+            changes.publish_pending(session)
+        else:
+            transaction.rollback()
+    except:
+        transaction.rollback()
+        raise
+    finally:
+        session.close()
+        connection.close()
+        if previous is None:
+            registry.clear()
+        else:
+            registry.set(previous)
+        # caches computed before the actual commit, or from rolled back writes, are not valid anymore
+        changed = [t for t, b, a in zip(tables, before, versions.versions(tables)) if a != b]
+        versions.bump(*changed)
+        if not committed and models.Species.__tablename__ in changed:  # it may hold rolled back species
+            cache.species_cache().clear()
+    return results, failed
+
+
+def batch():
+    """
+    Dispatches a list of API calls, in one transaction
+    (see batch module)
+    :return:
+    """
+    try:
+        subrequests = batch_load(negotiation.request_data())
+    except BatchError as e:
+        return e.args[0], http.HTTPStatus.BAD_REQUEST
+    results, failed = execute(subrequests)
+    return results, failed or http.HTTPStatus.OK
@@ -0,0 +1,306 @@
+"""
+Bulk operations on collections, in one request and one transaction.
+
+POST a JSON array to a collection endpoint to create many rows at once :
+ - the whole array is validated in one pass through the schema
+ - valid rows are inserted with one executemany INSERT per set of columns given, and committed once
+   (PostgreSQL and SQLite : elsewhere, one INSERT per row gets the new ids right under concurrent writers)
+ - the response holds the created ids, in request order
+ - by default any invalid item rejects the whole batch.
+   With ?partial=true the valid items are still created, and the errors are reported by index.
+
+PATCH a JSON array of {"id": id, "changes": {field: value}} to a collection endpoint to update many rows at once :
+ - no instance is loaded, updates changing the same fields are grouped in one executemany UPDATE
+ - everything is committed once
+ - the response holds the updated and not found ids.
+ - invalid items are handled like for creation (see ?partial=true)
+"""
+
+import http
+import itertools
+
+import sqlalchemy
+from marshmallow import ValidationError, fields
+
+try:
+    from .schemas import models
+    from .schemas.models import changes, journal, rollups, versions
+    from . import negotiation
+except SystemError:  # in case we call this module directly (doctest)
+    from schemas import models
+    from schemas.models import changes, journal, rollups, versions
+    import negotiation
+
+from flask import request
+
+REQUIRED_MESSAGE = fields.Field.default_error_messages['required']
+
+# ids per IN (...) clause, safely under SQLite host parameters limit (999)
+CHUNK_SIZE = 500
+
+
+def _chunks(items, size):
+    iterator = iter(items)
+    chunk = list(itertools.islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(iterator, size))
+
+
+def _required_columns(model):
+    return [c for c in sqlalchemy.inspect(model).columns
+            if not c.nullable and not c.primary_key and c.default is None and c.server_default is None]
+
+
+def _check_required(instance, columns):
+    """Finds missing values the database would refuse, for one row"""
+    return {c.key: [REQUIRED_MESSAGE] for c in columns if getattr(instance, c.key) is None}
+
+
+def _has_related(instance):
+    """Whether some related objects have been loaded with the instance (bulk insert ignores them)"""
+    state = sqlalchemy.inspect(instance)
+    return any(state.attrs[r.key].history.added for r in state.mapper.relationships)
+
+
+def _partial_requested():
+    return request.args.get('partial', 'false').lower() in ('true', '1', 'yes')
+
+
+def bulk_load(schema, data):
+    """
+    Validates and loads a list of items in one pass.
+    :param schema: the model schema to load with
+    :param data: the list of items
+    :return: a tuple (instances, errors) where instances has None for invalid items,
+             and errors is a dict {index: messages}
+    """
+    if not isinstance(data, list):
+        return [], {'_schema': ['Invalid input type.']}
+
+    loaded, errors = schema.load(data, many=True)
+    errors = dict(errors)
+    if '_schema' in errors:
+        return [], errors
+
+    columns = _required_columns(schema.opts.model)
+    instances = []
+    for index, item in enumerate(loaded):
+        if index in errors:
+            instances.append(None)
+            continue
+        # when some item is invalid, marshmallow does not build any instance
+        instance = item if isinstance(item, schema.opts.model) else schema.make_instance(item)
+        missing = _check_required(instance, columns)
+        if missing:
+            errors[index] = missing
+            instances.append(None)
+        else:
+            instances.append(instance)
+    return instances, errors
+
+
+def _row(instance):
+    """The column values given to a new instance (the database defaults the others)"""
+    state = sqlalchemy.inspect(instance)
+    return {p.columns[0].key: state.dict[p.key] for p in state.mapper.column_attrs if p.key in state.dict}
+
+
+def insert_many(session, table, rows):
+    """
+    Inserts rows with one executemany INSERT, and fetches their ids in one more query (PostgreSQL and SQLite),
+    or with one INSERT per row on the other databases.
+    :param session: the session
+    :param table: the table, with an integer id primary key
+    :param rows: a list of {column: value}, with the same columns
+    :return: the new ids, in rows order
+    """
+    if not rows:
+        return []
+    dialect = session.get_bind().dialect.name
+    if dialect == 'postgresql':  # ids taken from the sequence first
+        sequence = sqlalchemy.func.pg_get_serial_sequence(table.name, table.c.id.name)
+        ids = [id for id, in session.execute(sqlalchemy.select([sqlalchemy.func.nextval(sequence)])
+                                             .select_from(sqlalchemy.func.generate_series(1, len(rows))))]
+        session.execute(table.insert(), [dict(row, id=id) for row, id in zip(rows, ids)])
+        return ids
+    if dialect == 'sqlite':
+        session.execute(table.insert(), rows)
+        # the transaction holds the database write lock since the insert : the new rows have the last ids
+        return [id for id, in session.execute(
+            sqlalchemy.select([table.c.id]).order_by(table.c.id.desc()).limit(len(rows)))][::-1]
+    # concurrent inserts interleave (MySQL...) : each row gets its own id back
+    return [session.execute(table.insert().values(row)).inserted_primary_key[0] for row in rows]
+
+
+def bulk_create(instances, session=None):
+    """
+    Inserts instances in bulk, in one transaction.
+    :param instances: the new model instances
+    :param session: optional in case flask has not been initialized
+    :return: the list of the new ids
+    """
+    if session is None:
+        session = models.db.session
+    journaled = set()
+    try:
+        # related objects need the unit of work, everything else can skip it
+        plain = [i for i in instances if not _has_related(i)]
+        session.add_all([i for i in instances if _has_related(i)])
+        session.flush()
+        groups = {}
+        for instance in plain:
+            row = _row(instance)
+            groups.setdefault((type(instance), tuple(sorted(row))), []).append((instance, row))
+        for (model, _), group in groups.items():
+            for (instance, _), id in zip(group, insert_many(session, model.__table__, [row for _, row in group])):
+                instance.id = id
+        journaled = journal.record_created(session, plain)  # bulk inserts skip the ORM events journaling them
+        for model in {type(i) for i in plain}:  # bulk inserts skip the ORM events maintaining the rollups
+            rollups.apply(session, added=rollups.snapshot(session, model, [i.id for i in plain if type(i) is model]))
+            changes.collect(session, model, 'create', [i.id for i in plain if type(i) is model])
+        session.commit()
+    except:
+        session.rollback()
+        raise
+    finally:  # bulk inserts skip the ORM events
+        tables = {type(i).__table__.name for i in instances}
+        tables.update(t for model in {type(i) for i in instances} for r in rollups.tracked(model) for t in r.TABLES)
+        versions.bump(*(tables | journaled))
+    return [i.id for i in instances]
+
+
+def bulk_add(schema):
+    """
+    Bulk creation view implementation, for a JSON array posted to a collection.
+    :param schema: the model schema of the collection
+    :return: a view return value
+    """
+    data = negotiation.request_data()
+    partial = _partial_requested()
+
+    instances, errors = bulk_load(schema, data)
+    if errors and (not partial or '_schema' in errors):
+        return {'ids': [], 'errors': errors}, http.HTTPStatus.BAD_REQUEST
+
+    valid = [i for i in instances if i is not None]
+    if not valid:
+        return {'ids': [None] * len(instances), 'errors': errors}, http.HTTPStatus.BAD_REQUEST
+
+    bulk_create(valid)
+    return {'ids': [i.id if i is not None else None for i in instances], 'errors': errors}, http.HTTPStatus.CREATED
+
+
+def _updatable_fields(schema):
+    """The loadable schema fields that are plain columns of the model"""
+    columns = sqlalchemy.inspect(schema.opts.model).columns
+    return {name: field for name, field in schema.fields.items()
+            if not field.dump_only and (field.attribute or name) in columns
+            and not columns[field.attribute or name].primary_key}
+
+
+def bulk_load_changes(schema, data):
+    """
+    Validates a list of partial updates in one pass.
+    :param schema: the model schema to validate with
+    :param data: the list of {id, changes}
+    :return: a tuple (updates, errors) where updates is a list of (id, {column: value}), None for invalid items,
+             and errors is a dict {index: messages}
+    """
+    if not isinstance(data, list):
+        return [], {'_schema': ['Invalid input type.']}
+
+    updatable = _updatable_fields(schema)
+    updates = []
+    errors = {}
+    for index, item in enumerate(data):
+        if not isinstance(item, dict) or not isinstance(item.get('changes'), dict):
+            errors[index] = {'changes': ['Invalid input type.']}
+        elif not isinstance(item.get('id'), int):
+            errors[index] = {'id': ['Not a valid integer.']}
+        else:
+            item_errors = {k: ['Unknown field.'] for k in item['changes'] if k not in updatable}
+            values = {}
+            for k, v in item['changes'].items():
+                if k in updatable:
+                    try:
+                        values[updatable[k].attribute or k] = updatable[k].deserialize(v)
+                    except ValidationError as e:
+                        item_errors[k] = e.messages
+            if item_errors:
+                errors[index] = item_errors
+            elif values:
+                updates.append((item['id'], values))
+                continue
+        updates.append(None)
+    return updates, errors
+
+
+def bulk_update(model, updates, session=None):
+    """
+    Applies many partial updates, without loading any instance.
+    Updates changing the same set of columns are grouped in one executemany UPDATE.
+    :param model: the model class
+    :param updates: a list of (id, {column: value})
+    :param session: optional in case flask has not been initialized
+    :return: the set of ids that were found and updated
+    """
+    if session is None:
+        session = models.db.session
+    table = model.__table__
+    ids = {id for id, _ in updates}
+
+    groups = {}
+    rebase_updates = getattr(model, 'rebase_updates', None)  # columns derived from others (lazy stats)
+    if rebase_updates is not None:
+        updates = rebase_updates(updates, session=session)
+    for id, values in updates:
+        groups.setdefault(tuple(sorted(values)), []).append(
+            dict({'b_' + k: v for k, v in values.items()}, b_id=id))
+
+    # core updates skip the ORM events maintaining the rollups
+    changed_rollups = rollups.tracked(model, changed={c for columns in groups for c in columns})
+
+    journaled = set()
+    try:
+        found = set()
+        for chunk in _chunks(sorted(ids), CHUNK_SIZE):
+            found.update(id for id, in session.execute(
+                sqlalchemy.select([table.c.id]).where(table.c.id.in_(chunk))))
+        journaled = journal.record_updates(session, model, updates)  # before the stored stats are overwritten
+        removed = rollups.snapshot(session, model, found, changed_rollups)
+        for columns, rows in groups.items():
+            statement = table.update().where(table.c.id == sqlalchemy.bindparam('b_id')).values(
+                {c: sqlalchemy.bindparam('b_' + c) for c in columns})
+            session.execute(statement, rows)
+        rollups.apply(session, removed, rollups.snapshot(session, model, found, changed_rollups))
+        changes.collect(session, model, 'update', found)
+        session.commit()
+    except:
+        session.rollback()
+        raise
+    finally:  # core updates skip the ORM events
+        versions.bump(table.name, *(t for r in changed_rollups for t in r.TABLES), *journaled)
+    return found
+
+
+def bulk_edit(schema):
+    """
+    Bulk edition view implementation, for a JSON array of {id, changes} patched to a collection.
+    :param schema: the model schema of the collection
+    :return: a view return value
+    """
+    data = negotiation.request_data()
+    partial = _partial_requested()
+
+    updates, errors = bulk_load_changes(schema, data)
+    if errors and (not partial or '_schema' in errors):
+        return {'updated': [], 'not_found': [], 'errors': errors}, http.HTTPStatus.BAD_REQUEST
+
+    valid = [u for u in updates if u is not None]
+    found = bulk_update(schema.opts.model, valid) if valid else set()
+    return {
+        'updated': sorted(found),
+        'not_found': sorted({id for id, _ in valid} - found),
+        'errors': errors,
+    }, http.HTTPStatus.OK
@@ -0,0 +1,75 @@
+"""
+Versioned response cache for collections.
+
+Collections are read far more often than they change. Each app (so each worker) keeps the rendered
+responses of its collection views in a LRU cache, bounded by RESPONSE_CACHE_BYTES of response bodies.
+Entries are keyed by endpoint, query parameters, negotiated content type, and the versions of
+the tables the response depends on (see models.versions) : any write to one of these tables makes
+the entries computed before unreachable, and they are evicted in time.
+
+The tables versions only see the writes of the current process, so entries also expire
+after RESPONSE_CACHE_TTL seconds.
+"""
+
+import functools
+
+from flask import Response, current_app, has_app_context, request
+
+try:
+    from .schemas.cache import LRUCache
+    from .schemas.models import versions
+except SystemError:  # in case we call this module directly (doctest)
+    from schemas.cache import LRUCache
+    from schemas.models import versions
+
+
+def response_cache():
+    """
+    The response cache of the current app
+    :return: the LRUCache, None outside of an app context, or when disabled (RESPONSE_CACHE_BYTES = 0)
+    """
+    if not has_app_context() or not current_app.config.get('RESPONSE_CACHE_BYTES'):
+        return None
+    cache = current_app.extensions.get('response_cache')
+    if cache is None:
+        cache = current_app.extensions.setdefault('response_cache', LRUCache(
+            maxsize=current_app.config['RESPONSE_CACHE_BYTES'],
+            ttl=current_app.config.get('RESPONSE_CACHE_TTL', 60),
+            sizeof=lambda entry: len(entry[0])))
+    return cache
+
+
+def cached_response(*tables, bypass=None):
+    """
+    Decorates a collection view, to cache its successful responses.
+    Streamed responses are never cached.
+    :param tables: the names of the tables the response depends on
+    :param bypass: optional function, returning True when the response should not be cached
+    :return: the view decorator
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def cached_view(*args, **kwargs):
+            cache = response_cache()
+            if cache is None or 'stream' in request.args or (bypass is not None and bypass()):
+                return view(*args, **kwargs)
+
+            # versions read before the view runs : a write in between makes this entry unreachable
+            key = (request.endpoint, request.host_url, tuple(sorted(request.args.items(multi=True))),
+                   request.headers.get('Accept'), versions.versions(tables))
+            entry = cache.get(key)
+            if entry is not None:
+                body, status, headers = entry
+                return Response(body, status=status, headers=headers)
+
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                cache.put(key, (response.get_data(), response.status_code, list(response.headers)))
+            return response
+        return cached_view
+    return decorator
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
@@ -0,0 +1,74 @@
+"""
+Conditional GET for single resources.
+
+A resource dump changes only when the resource, or one of the resources nested in its dump, changes,
+and each of them keeps its date_modified. Reading these dates is a column-only query, without loading
+and dumping the object graph. From them we send :
+ - a weak ETag, for If-None-Match
+ - a Last-Modified date, for If-Modified-Since
+and answer 304 Not Modified, without any body, when the client copy is still current.
+
+Dates have a one second precision in some databases (SQLite current_timestamp), so a client could
+miss a second change in the same second. Values derived at read time (lazy stats) are part of the ETag,
+and there is no Last-Modified then.
+
+Usage :
+>>> import datetime
+>>> validators = make_validators(1, [datetime.datetime(2018, 3, 8, 18, 53, 52), None])
+>>> headers(validators)['Last-Modified']
+'Thu, 08 Mar 2018 18:53:52 GMT'
+>>> headers(validators)['ETag'] == headers(make_validators(1, [datetime.datetime(2018, 3, 8, 18, 53, 52), None]))['ETag']
+True
+>>> headers(validators)['ETag'] == headers(make_validators(2, [datetime.datetime(2018, 3, 8, 18, 53, 52), None]))['ETag']
+False
+"""
+
+import collections
+import hashlib
+
+from flask import request
+from werkzeug.http import http_date, quote_etag
+
+Validators = collections.namedtuple('Validators', ['etag', 'last_modified'])
+
+
+def make_validators(id, dates, derived=None, variant=None):
+    """
+    Computes the validators of a resource dump.
+    :param id: the resource id
+    :param dates: the date_modified of the resource, and of the resources nested in its dump (None if absent)
+    :param derived: the dumped values that change without any date_modified
+    :param variant: what distinguishes the representation (the requested fields and embedded relationships, see fieldsets module)
+    :return: the Validators
+    """
+    version = repr((id, [d.isoformat() if d is not None else None for d in dates], derived, variant))
+    etag = hashlib.sha1(version.encode('utf-8')).hexdigest()[:20]
+    present = [d for d in dates if d is not None]
+    last_modified = max(present).replace(microsecond=0) if present and derived is None else None
+    return Validators(etag, last_modified)
+
+
+def headers(validators):
+    """The response headers for the validators"""
+    headers = {'ETag': quote_etag(validators.etag, weak=True)}
+    if validators.last_modified is not None:
+        headers['Last-Modified'] = http_date(validators.last_modified)
+    return headers
+
+
+def not_modified(validators):
+    """
+    Whether the client copy, according to the request conditional headers, is still current.
+    If-None-Match takes precedence over If-Modified-Since (RFC 7232).
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(validators.etag)
+    since = request.if_modified_since
+    if since is not None and validators.last_modified is not None:
+        return validators.last_modified <= since.replace(tzinfo=None)
+    return False
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
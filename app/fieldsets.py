@@ -0,0 +1,172 @@
+"""
+Sparse fieldsets and embedded relationships for all endpoints.
+
+Query parameters :
+ - embed : comma separated list of the relationships to nest in the dump, nested ones with a dotted path.
+   Relationships are not nested by default : the dump only holds their foreign key ids (species_id, owner_id...).
+   ``?embed=species,owner.user`` nests the species, and the owner with its user.
+ - fields : comma separated list of the fields to dump, nested ones with a dotted path.
+   ``?fields=id,name,species.name`` dumps the id, the name, and only the name of the species.
+   A nested field without path (``?fields=species``) is dumped with all its fields (and its embedded relationships).
+   Requesting a nested field embeds it.
+
+Only the fields the schema (Meta.fields) already dumps can be requested.
+The dump is done with a variant of the schema restricted to these fields and relationships, and its loading plan
+only joins the embedded relationships (or selects them in one more query for collections), and only loads
+the columns the dump needs (see loading module).
+Variants, their compiled dumpers and their loading plans are built once per schema, fields and embed combination.
+"""
+
+import copy
+import functools
+
+from flask import request
+from marshmallow import fields
+
+try:
+    from .schemas import compile_schema
+except SystemError:  # in case we call this module directly (doctest)
+    from schemas import compile_schema
+
+
+class FieldsError(ValueError):
+    """Invalid fields parameter. args[0] is a marshmallow-like errors dict"""
+    pass
+
+
+def parse_fields(value):
+    """
+    Parses a fields parameter into a tree of requested fields.
+    >>> parse_fields('id,name,species.name') == (('id', ()), ('name', ()), ('species', (('name', ()),)))
+    True
+    >>> parse_fields('species,species.name') == (('species', ()),)
+    True
+
+    :param value: the fields parameter
+    :return: a tuple of (name, nested tree) pairs, sorted by name (an empty tree requests everything)
+    """
+    tree = {}
+    for path in value.split(','):
+        path = path.strip()
+        if not path:
+            continue
+        names = path.split('.')
+        node = tree
+        for name in names[:-1]:
+            if name in node and node[name] is None:
+                break  # the whole field is already requested
+            node = node.setdefault(name, {})
+        else:
+            node[names[-1]] = None  # everything
+
+    def freeze(node):
+        return tuple(sorted((name, freeze(sub) if sub else ()) for name, sub in node.items()))
+    return freeze(tree)
+
+
+def parse_embed(value):
+    """
+    Parses an embed parameter into a tree of embedded relationships.
+    >>> parse_embed('owner,species,owner.user') == (('owner', (('user', ()),)), ('species', ()))
+    True
+
+    :param value: the embed parameter
+    :return: a tuple of (name, nested tree) pairs, sorted by name
+    """
+    tree = {}
+    for path in value.split(','):
+        path = path.strip()
+        if not path:
+            continue
+        node = tree
+        for name in path.split('.'):
+            node = node.setdefault(name, {})
+
+    def freeze(node):
+        return tuple(sorted((name, freeze(sub)) for name, sub in node.items()))
+    return freeze(tree)
+
+
+def _nested(field):
+    """The nested field of a field, if any"""
+    return field.container if isinstance(field, fields.List) else field
+
+
+def _embeddable(schema):
+    """The names of the nested fields a schema dumps"""
+    return [name for name, field in schema.fields.items()
+            if not field.load_only and isinstance(_nested(field), fields.Nested)]
+
+
+def _variant(schema, tree, embed, path=''):
+    dumped = [name for name, field in schema.fields.items() if not field.load_only]
+    unknown = [name for name, _ in tree if name not in dumped]
+    if unknown:
+        raise FieldsError({'fields': ['Unknown field: {}.'.format(path + name) for name in unknown]})
+    embeddable = _embeddable(schema)
+    unknown = [name for name, _ in embed if name not in embeddable]
+    if unknown:
+        raise FieldsError({'embed': ['Unknown relationship: {}.'.format(path + name) for name in unknown]})
+
+    embed = dict(embed)
+    tree = dict(tree) if tree else {name: () for name in dumped if name not in embeddable or name in embed}
+    variant = type(schema)(only=tuple(tree), exclude=schema.exclude, many=schema.many,
+                           context=schema.context, load_only=schema.load_only, dump_only=schema.dump_only)
+    # same keys order as the full dump
+    variant.fields = variant.dict_class((name, variant.fields[name]) for name in dumped if name in variant.fields)
+
+    for name, subtree in tree.items():
+        field = variant.fields[name]
+        nested = _nested(field)
+        if not isinstance(nested, fields.Nested):
+            if subtree:
+                raise FieldsError({'fields': ['Unknown field: {}.{}.'.format(path + name, subtree[0][0])]})
+            continue
+        restricted = copy.copy(nested)
+        restricted.nested = _variant(nested.schema, subtree, embed.get(name, ()), path + name + '.')
+        restricted.only = None
+        restricted.exclude = ()
+        restricted._Nested__schema = None
+        if nested is not field:
+            restricted, field = copy.copy(field), restricted
+            restricted.container = field
+        # marshmallow rebuilds the fields from the declared ones on its first dump
+        variant.fields[name] = variant.declared_fields[name] = restricted
+    return variant
+
+
+@functools.lru_cache(maxsize=256)
+def _sparse(schema, tree, embed):
+    variant = _variant(schema, tree, embed)
+    return variant, compile_schema(variant)
+
+
+def sparse(schema, dumper, args=None):
+    """
+    The schema and dumper to use for the requested fields and embedded relationships.
+    :param schema: the full schema
+    :param dumper: the full schema compiled dumper
+    :param args: the request args (defaults to flask request.args)
+    :return: a tuple (schema, dumper), the full ones if they dump the same
+    """
+    args = request.args if args is None else args
+    tree = parse_fields(args.get('fields') or '')
+    embed = parse_embed(args.get('embed') or '')
+    if not tree and not embed and not _embeddable(schema):
+        return schema, dumper
+    return _sparse(schema, tree, embed)
+
+
+def variant_key(args=None):
+    """
+    What distinguishes the representations of a resource (see conditional module).
+    :param args: the request args (defaults to flask request.args)
+    :return: a hashable key
+    """
+    args = request.args if args is None else args
+    return parse_fields(args.get('fields') or ''), parse_embed(args.get('embed') or '')
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
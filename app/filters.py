@@ -0,0 +1,97 @@
+"""
+Filters for collection endpoints, compiled to SQL WHERE clauses.
+
+Query parameters, for each filterable field :
+ - field=value : equal
+ - field__ne=value : not equal
+ - field__gt=value, field__gte=value, field__lt=value, field__lte=value : comparisons
+ - field__in=value,value,... : one of the values
+Values are validated by the schema field, or by the column type for untyped fields (model schemas foreign keys) :
+?owner_id=abc is a 400, not a database error. Several filters are combined with AND.
+Other query parameters (pagination, fields...) are left alone.
+
+For instance /api/animals/?species_id=3&hungry__gt=80 for the hungry animals of species 3.
+(animals have indexes on owner_id, species_id and (species_id, hungry) to answer these)
+"""
+
+from flask import request
+from marshmallow import ValidationError, fields
+
+OPERATORS = {
+    'eq': lambda c, v: c == v,
+    'ne': lambda c, v: c != v,
+    'gt': lambda c, v: c > v,
+    'gte': lambda c, v: c >= v,
+    'lt': lambda c, v: c < v,
+    'lte': lambda c, v: c <= v,
+    'in': lambda c, v: c.in_(v),
+}
+
+
+class FilterError(ValueError):
+    """Invalid filter parameters. args[0] is a marshmallow-like errors dict"""
+    pass
+
+
+def _field(schema, name):
+    """The field validating the values of a filter : an Integer for the untyped fields of integer columns"""
+    field = schema.fields[name]
+    model = getattr(schema.opts, 'model', None)
+    if type(field) is not fields.Field or model is None:
+        return field
+    try:
+        python_type = getattr(model, field.attribute or name).type.python_type
+    except (AttributeError, NotImplementedError):
+        return field
+    return fields.Integer() if python_type is int else field
+
+
+def parse_filters(schema, filterable, args=None):
+    """
+    Parses filter parameters.
+    :param schema: the schema validating the values
+    :param filterable: the names of the fields that can be filtered
+    :param args: the request args (defaults to flask request.args)
+    :return: a list of (field name, operator, value)
+    """
+    args = request.args if args is None else args
+    filters = []
+    errors = {}
+    for param, value in args.items(multi=True):
+        name, _, operator = param.partition('__')
+        if name not in filterable:
+            if operator:
+                errors[param] = ['Unknown filter.']
+            continue  # not a filter
+        operator = operator or 'eq'
+        if operator not in OPERATORS:
+            errors[param] = ['Unknown filter operator.']
+            continue
+        field = _field(schema, name)
+        try:
+            if operator == 'in':
+                value = [field.deserialize(v) for v in value.split(',')]
+            else:
+                value = field.deserialize(value)
+        except ValidationError as e:
+            errors[param] = e.messages
+            continue
+        filters.append((schema.fields[name].attribute or name, operator, value))
+    if errors:
+        raise FilterError(errors)
+    return filters
+
+
+def apply_filters(query, model, schema, filterable, args=None):
+    """
+    Applies the filter parameters to a query.
+    :param query: the query retrieving the collection
+    :param model: the model class
+    :param schema: the schema validating the values
+    :param filterable: the names of the fields that can be filtered
+    :param args: the request args (defaults to flask request.args)
+    :return: the filtered query
+    """
+    for attribute, operator, value in parse_filters(schema, filterable, args):
+        query = query.filter(OPERATORS[operator](getattr(model, attribute), value))
+    return query
@@ -0,0 +1,151 @@
+"""
+Top-K animals by stat : the hungriest, or the unhappiest.
+
+Query parameters :
+ - by : hungry (highest hungry first, default) or happy (lowest happy first)
+ - k : number of animals (defaults to TOP_K, capped by TOP_K_MAX)
+ - owner_id, species_id : only the animals of an owner, or of a species (see filters module)
+Ties are broken by id.
+
+Stored stats are read in index order (ix_animals_hungry_desc, ix_animals_happy) : the database reads
+k index entries, whatever the number of animals.
+In lazy stats mode, stored stats are only a baseline : every matching animal stats are derived, chunk by chunk,
+with numpy, keeping only the best k candidates (O(N) time, O(k + chunk) memory).
+"""
+
+import datetime
+
+import numpy as np
+import sqlalchemy
+from flask import current_app, request
+
+try:
+    from .schemas import models, apply_loading_plan
+    from .schemas.models import stats
+except SystemError:  # in case we call this module directly (doctest)
+    from schemas import models, apply_loading_plan
+    from schemas.models import stats
+
+# stat: descending order
+ORDERS = {'hungry': True, 'happy': False}
+
+
+class LeaderboardError(ValueError):
+    """Invalid leaderboard parameters. args[0] is a marshmallow-like errors dict"""
+    pass
+
+
+def top_args(args=None):
+    """
+    Parses leaderboard parameters.
+    :param args: the request args (defaults to flask request.args)
+    :return: a tuple (by, k)
+    """
+    args = request.args if args is None else args
+    config = current_app.config
+    errors = {}
+
+    by = args.get('by', 'hungry')
+    if by not in ORDERS:
+        errors['by'] = ['Must be one of: {}.'.format(', '.join(sorted(ORDERS)))]
+
+    k = args.get('k')
+    if k is None:
+        k = config['TOP_K']
+    else:
+        try:
+            k = int(k)
+            if k < 1:
+                raise ValueError
+            k = min(k, config['TOP_K_MAX'])
+        except ValueError:
+            errors['k'] = ['Not a valid number of animals.']
+
+    if errors:
+        raise LeaderboardError(errors)
+    return by, k
+
+
+def top_stored(query, by, k):
+    """
+    The top k animals, by stored stat.
+    :param query: the animals query (filtered)
+    :param by: the stat
+    :param k: the number of animals
+    :return: the list of animals
+    """
+    column = getattr(models.Animal, by)
+    order = column.desc() if ORDERS[by] else column.asc()
+    return query.filter(column.isnot(None)).order_by(order, models.Animal.id).limit(k).all()
+
+
+def _top_chunk(ids, values, descending, k):
+    """Indexes of the best k (value, id) of a chunk, best first"""
+    keys = -values if descending else values
+    if len(keys) > k:
+        candidates = np.argpartition(keys, k - 1)[:k]
+        # values equal to the k-th one may have been cut arbitrarily, keep them all to break ties by id
+        candidates = np.flatnonzero(keys <= keys[candidates].max())
+    else:
+        candidates = np.arange(len(keys))
+    return candidates[np.lexsort((ids[candidates], keys[candidates]))][:k]
+
+
+def top_ids_derived(query, by, k, chunk_size=10000, now=None, period=None):
+    """
+    The ids of the top k animals, by derived stat (lazy stats mode).
+    :param query: the animals query (filtered)
+    :param by: the stat
+    :param k: the number of animals
+    :param chunk_size: number of animals computed at once
+    :param now: the current (UTC) time, defaults to now
+    :param period: the species rates period, in seconds
+    :return: the list of ids, best first
+    """
+    now = now or datetime.datetime.utcnow()
+    period = period or stats.rate_period()
+    descending = ORDERS[by]
+    columns = query.join(models.Species).with_entities(
+        models.Animal.id,
+        sqlalchemy.func.coalesce(models.Animal.happy, 0), sqlalchemy.func.coalesce(models.Animal.hungry, 0),
+        sqlalchemy.type_coerce(models.Animal.stats_updated_at, sqlalchemy.String),  # parsed with numpy (see stats)
+        sqlalchemy.func.coalesce(models.Species.happy_rate, 0), sqlalchemy.func.coalesce(models.Species.hunger_rate, 0),
+    ).order_by(None)
+
+    best_ids = np.zeros(0, dtype=np.int64)
+    best_values = np.zeros(0, dtype=np.int64)
+    result = query.session.execute(columns.statement)  # plain rows, no ORM overhead
+    while True:
+        chunk = result.fetchmany(chunk_size)
+        if not chunk:
+            break
+        ids, happy, hungry, dates, happy_rates, hunger_rates = zip(*chunk)
+        new_happy, new_hungry = stats.advance(np.array(happy, dtype=np.int64), np.array(hungry, dtype=np.int64),
+                                              np.array(happy_rates), np.array(hunger_rates),
+                                              stats.elapsed_seconds(now, dates), period)
+        ids = np.concatenate((best_ids, np.array(ids, dtype=np.int64)))
+        values = np.concatenate((best_values, new_hungry if by == 'hungry' else new_happy))
+        best = _top_chunk(ids, values, descending, k)
+        best_ids, best_values = ids[best], values[best]
+    return best_ids.tolist()
+
+
+def top(query, schema, by, k):
+    """
+    The top k animals.
+    :param query: the animals query (filtered)
+    :param schema: the schema that will be used to dump the animals (see loading module)
+    :param by: the stat
+    :param k: the number of animals
+    :return: the list of animals, best first
+    """
+    if not stats.lazy_stats_enabled():
+        return top_stored(apply_loading_plan(query, schema), by, k)
+    ids = top_ids_derived(query, by, k, chunk_size=current_app.config['STREAM_CHUNK_SIZE'])
+    animals = {a.id: a for a in apply_loading_plan(query, schema).filter(models.Animal.id.in_(ids))} if ids else {}
+    return [animals[i] for i in ids if i in animals]
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
@@ -0,0 +1,83 @@
+"""
+Multi-get by id list, for collection endpoints.
+
+Query parameter :
+ - ids : comma separated list of ids, ``?ids=3,1,2`` (at most MULTIGET_MAX ids)
+
+The rows are fetched with ``WHERE id IN (...)`` queries, by chunks of CHUNK_SIZE ids, safely under the
+SQLite host parameters limit (999). The response lists the items in request order, duplicates included,
+and marks the ids without any row with {"id": id, "not_found": true}.
+Other parameters (fields, embed, filters) still apply, pagination and streaming do not.
+"""
+
+import http
+
+from flask import current_app, request
+
+# ids per IN (...) clause, safely under SQLite host parameters limit (999)
+CHUNK_SIZE = 500
+
+
+class MultiGetError(ValueError):
+    """Invalid ids parameter. args[0] is a marshmallow-like errors dict"""
+    pass
+
+
+def ids_args(args=None):
+    """
+    Parses the ids parameter.
+    :param args: the request args (defaults to flask request.args)
+    :return: the list of ids, None if no ids were requested
+    """
+    args = request.args if args is None else args
+    value = args.get('ids')
+    if value is None:
+        return None
+    ids, invalid = [], []
+    for id in value.split(','):
+        id = id.strip()
+        if not id:
+            continue
+        try:
+            ids.append(int(id))
+        except ValueError:
+            invalid.append(id)
+    if invalid:
+        raise MultiGetError({'ids': ['Not a valid id: {}.'.format(id) for id in invalid]})
+    maximum = current_app.config['MULTIGET_MAX']
+    if len(ids) > maximum:
+        raise MultiGetError({'ids': ['Too many ids, at most {}.'.format(maximum)]})
+    return ids
+
+
+def fetch(query, key, ids, chunk_size=CHUNK_SIZE):
+    """
+    Retrieves the rows of some ids.
+    :param query: the sqlalchemy query retrieving the collection
+    :param key: the id column
+    :param ids: the ids
+    :param chunk_size: number of ids per query
+    :return: a dict {id: row} of the rows found
+    """
+    ids = sorted(set(ids))
+    rows = {}
+    for start in range(0, len(ids), chunk_size):
+        rows.update((getattr(row, key.key), row) for row in query.filter(key.in_(ids[start:start + chunk_size])))
+    return rows
+
+
+def multi_get(query, key, dumper, ids):
+    """
+    Multi-get view implementation.
+    :param query: the sqlalchemy query retrieving the collection (with its loading plan)
+    :param key: the id column
+    :param dumper: the schema (or compiled dumper) to dump the rows with
+    :param ids: the requested ids (see ids_args)
+    :return: a view return value
+    """
+    rows = fetch(query, key, ids)
+    dumped, errors = dumper.dump(list(rows.values()), many=True)
+    if errors:  # break properly
+        return '', http.HTTPStatus.INTERNAL_SERVER_ERROR
+    items = dict(zip(rows, dumped))
+    return [items[id] if id in items else {'id': id, 'not_found': True} for id in ids], http.HTTPStatus.OK
@@ -0,0 +1,220 @@
+"""
+Content negotiation : the renderers of the responses, selected by the Accept header, and the parsers of the
+request bodies, selected by the Content-Type header (Flask-API negotiation).
+
+RENDERERS and PARSERS name them, in preference order, and create_app registers them (register) :
+ - json : application/json, encoded by orjson when it is installed (several times faster than the json module),
+   the json module still renders the indented responses (browsable API)
+ - msgpack : application/msgpack (msgpack library)
+ - cbor : application/cbor (cbor2 library)
+ - browsable : text/html, the Flask-API browsable API
+ - urlencoded, multipart : form bodies
+The libraries are optional : the renderers and parsers whose library is missing are left out, with a warning.
+Values the codecs do not know (dates, uuids...) are encoded as the app JSON encoder does.
+
+Views read the bodies with request_data, instead of request.get_json, whatever their media type.
+Chunked bodies (Transfer-Encoding, without Content-Length), that Flask-API would take for empty ones, are read
+too (APIRequest) : the server has to mark the end of the body (wsgi.input_terminated, gunicorn 19.8 onwards).
+"""
+
+import collections
+import io
+import json
+import logging
+
+from flask import current_app, request
+from flask_api import exceptions, parsers, renderers
+from flask_api.request import APIRequest as BaseAPIRequest
+
+try:
+    import orjson
+except ImportError:  # optional, the json module is used instead
+    orjson = None
+try:
+    import msgpack
+except ImportError:  # optional
+    msgpack = None
+try:
+    import cbor2
+except ImportError:  # optional
+    cbor2 = None
+
+logger = logging.getLogger(__name__)
+
+# values orjson does not encode exactly like the app JSON encoder are left to it
+ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME) if orjson is not None else 0
+
+
+def json_dumps(data, default=None):
+    if orjson is None:
+        return json.dumps(data, default=default, ensure_ascii=False).encode('utf-8')
+    return orjson.dumps(data, default=default, option=ORJSON_OPTIONS)
+
+
+def json_loads(body):
+    return orjson.loads(body) if orjson is not None else json.loads(body.decode('utf-8'))
+
+
+def msgpack_dumps(data, default=None):
+    return msgpack.packb(data, default=default, use_bin_type=True)
+
+
+def msgpack_loads(body):
+    return msgpack.unpackb(body, raw=False)
+
+
+def cbor_dumps(data, default=None):
+    return cbor2.dumps(data, default=(lambda encoder, value: encoder.encode(default(value))) if default else None)
+
+
+def cbor_loads(body):
+    return cbor2.loads(body)
+
+
+# a binary encoding : media type, dumps(data, default), loads(body) and whether its library is installed
+Codec = collections.namedtuple('Codec', ['media_type', 'dumps', 'loads', 'available'])
+
+CODECS = {
+    'json': Codec('application/json', json_dumps, json_loads, True),
+    'msgpack': Codec('application/msgpack', msgpack_dumps, msgpack_loads, msgpack is not None),
+    'cbor': Codec('application/cbor', cbor_dumps, cbor_loads, cbor2 is not None),
+}
+
+
+def _default():
+    """Encodes the values a codec does not know, as the app JSON encoder does"""
+    return current_app.json_encoder().default
+
+
+class CodecRenderer(renderers.BaseRenderer):
+    """Renders the responses with a codec"""
+    codec = None
+    charset = None
+
+    def render(self, data, media_type, **options):
+        return self.codec.dumps(data, default=_default())
+
+
+class CodecParser(parsers.BaseParser):
+    """Parses the request bodies with a codec"""
+    codec = None
+
+    def parse(self, stream, media_type, **options):
+        try:
+            return self.codec.loads(stream.read())
+        except Exception as exc:  # each library has its own errors
+            raise exceptions.ParseError('{} parse error - {}'.format(self.media_type, exc))
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    """orjson when installed, the json module for indented responses"""
+
+    def render(self, data, media_type, **options):
+        if orjson is None or options.get('indent') is not None:
+            return super(JSONRenderer, self).render(data, media_type, **options)
+        return json_dumps(data, default=_default())
+
+
+class JSONParser(CodecParser):
+    codec = CODECS['json']
+    media_type = codec.media_type
+
+
+class MsgPackRenderer(CodecRenderer):
+    codec = CODECS['msgpack']
+    media_type = codec.media_type
+
+
+class MsgPackParser(CodecParser):
+    codec = CODECS['msgpack']
+    media_type = codec.media_type
+
+
+class CBORRenderer(CodecRenderer):
+    codec = CODECS['cbor']
+    media_type = codec.media_type
+
+
+class CBORParser(CodecParser):
+    codec = CODECS['cbor']
+    media_type = codec.media_type
+
+
+# name: (class, whether its library is installed)
+RENDERER_CLASSES = {
+    'json': (JSONRenderer, True),
+    'msgpack': (MsgPackRenderer, MsgPackRenderer.codec.available),
+    'cbor': (CBORRenderer, CBORRenderer.codec.available),
+    'browsable': (renderers.BrowsableAPIRenderer, True),
+}
+PARSER_CLASSES = {
+    'json': (JSONParser, True),
+    'msgpack': (MsgPackParser, MsgPackParser.codec.available),
+    'cbor': (CBORParser, CBORParser.codec.available),
+    'urlencoded': (parsers.URLEncodedParser, True),
+    'multipart': (parsers.MultiPartParser, True),
+}
+
+
+class APIRequest(BaseAPIRequest):
+    """Flask-API request, parsing the chunked bodies too"""
+
+    def body_length(self):
+        """
+        :return: the body length, from its Content-Length, or read until its end when chunked
+        """
+        if self.content_length is not None:
+            return self.content_length
+        return len(self.get_data(cache=True))
+
+    def _parse(self):
+        if self.content_length is not None or not self.content_type or not self.body_length():
+            return super(APIRequest, self)._parse()
+        # same as Flask-API, with the body already read
+        body = self.get_data(cache=True)
+        negotiator = self.negotiator_class()
+        parsers = [parser_cls() for parser_cls in self.parser_classes]
+        try:
+            parser, media_type = negotiator.select_parser(parsers)
+            ret = parser.parse(io.BytesIO(body), media_type, content_length=len(body))
+        except Exception:
+            self._set_empty_data()  # accessing request.data again does not raise again
+            raise
+        if parser.handles_file_uploads:
+            self._data, self._files = ret
+        else:
+            self._data, self._files = ret, self.empty_data_class()
+        self._form = self._data if parser.handles_form_data else self.empty_data_class()
+
+
+def _classes(names, classes, kind):
+    selected = []
+    for name in names:
+        if name not in classes:
+            raise ValueError('Unknown {} {!r}, must be one of: {}.'.format(kind, name, ', '.join(sorted(classes))))
+        cls, available = classes[name]
+        if available:
+            selected.append(cls)
+        else:
+            logger.warning('The %s %s is left out, its library is not installed', name, kind)
+    return selected
+
+
+def register(app):
+    """
+    Sets the Flask-API renderers and parsers of an app, from its RENDERERS and PARSERS config, and its request class.
+    :param app: the FlaskAPI app
+    """
+    app.config['DEFAULT_RENDERERS'] = _classes(app.config['RENDERERS'], RENDERER_CLASSES, 'renderer')
+    app.config['DEFAULT_PARSERS'] = _classes(app.config['PARSERS'], PARSER_CLASSES, 'parser')
+    app.request_class = APIRequest
+
+
+def request_data():
+    """
+    The request body, parsed according to its Content-Type (415 Unsupported Media Type without parser).
+    :return: the body, None when the request has none
+    """
+    if not request.content_type or not request.body_length():
+        return None
+    return request.data
@@ -1,40 +1,117 @@
 try:
-    from .schemas import models, owner_schema
+    from .schemas import models, owner_schema, owner_dumper, apply_loading_plan
+    from .schemas.models import stats
+    from . import bulk, caching, conditional, fieldsets, multiget, negotiation, pagination, streaming, sync
 except SystemError:  # in case we call this module directly (doctest)
-    from schemas import models, owner_schema
+    from schemas import models, owner_schema, owner_dumper, apply_loading_plan
+    from schemas.models import stats
+    import bulk
+    import caching
+    import conditional
+    import fieldsets
+    import multiget
+    import negotiation
+    import pagination
+    import streaming
+    import sync
 
 import http
+
+import sqlalchemy
 from sqlalchemy_utils import PasswordType, EmailType, UUIDType, ColorType  #,NumericRangeType
 from flask import jsonify, request
 from marshmallow import fields, post_load
 
 
 
+def _embeds_pets():
+    """Whether the requested owners embed their pets"""
+    try:
+        schema, _ = fieldsets.sparse(owner_schema, owner_dumper)
+    except fieldsets.FieldsError:
+        return False
+    return 'pets' in schema.fields
+
+
+def _derived_pets():
+    """Whether the requested owners embed pets whose current stats change without any write (lazy stats mode)"""
+    return stats.lazy_stats_enabled() and _embeds_pets()
+
+
+# embedded pets, and their species, are part of the responses
+@caching.cached_response('owners', 'users', 'animals', 'species', bypass=_derived_pets)
 def owners():
     """
-    Retrieves all owners
+    Retrieves a page of owners
+    (see pagination module for limit and after parameters, streaming module for full dumps, multiget module for ids,
+    sync module for modified_since, fieldsets module for sparse dumps and embedded relationships)
     :return:
     """
-    all_users = models.Owner.get_all()
-    user_dict, errors = owner_schema.dump(all_users, many=True)
+    try:
+        schema, dumper = fieldsets.sparse(owner_schema, owner_dumper)
+        query = apply_loading_plan(models.Owner.query, schema)
+        ids = multiget.ids_args()
+        if ids is not None:
+            return multiget.multi_get(query, models.Owner.id, dumper, ids)
+        since = sync.since_args()
+        fmt = streaming.stream_format()
+        if since is not None:
+            return sync.changes(query, models.Owner, dumper, since, fmt)
+        if fmt:
+            return streaming.stream_collection(query, dumper, models.Owner.id, fmt)
+        page = pagination.keyset_page(query, models.Owner.id)
+    except (fieldsets.FieldsError, multiget.MultiGetError, pagination.PaginationError,
+            streaming.StreamingError, sync.SyncError) as e:
+        return e.args[0], http.HTTPStatus.BAD_REQUEST
+    user_dict, errors = dumper.dump(page.items, many=True)
     if not errors:
-        return user_dict
+        return user_dict, http.HTTPStatus.OK, pagination.page_headers(page)
     else:  # break properly
         return '', http.HTTPStatus.INTERNAL_SERVER_ERROR
 
 
+def _owner_validators(id, schema):
+    """
+    The conditional GET validators of an owner (see conditional module), None if not found.
+    Embedded pets are part of them : they change without any write of the owner.
+    """
+    row = models.db.session.query(models.Owner.id, models.Owner.date_modified, models.User.date_modified) \
+        .select_from(models.Owner).outerjoin(models.User).filter(models.Owner.id == id).first()
+    if row is None:
+        return None
+    dates, derived = list(row[1:]), None
+    if 'pets' in schema.fields:
+        # pets added or removed change the owner pet_count (see models.counters), the others their date_modified
+        dates.extend(models.db.session.query(
+            sqlalchemy.func.max(models.Animal.date_modified), sqlalchemy.func.max(models.Species.date_modified))
+            .select_from(models.Animal).join(models.Species).filter(models.Animal.owner_id == row[0]).one())
+        if stats.lazy_stats_enabled():  # current stats change without any write
+            derived = models.Animal.derived_stats(models.Animal.owner_id == row[0])
+    return conditional.make_validators(row[0], dates, derived, variant=fieldsets.variant_key())
+
+
 def owner_read(id):
     """
     Retrieve an owner
+    (answers 304 Not Modified to If-None-Match and If-Modified-Since, see conditional module)
     :param id:
     :return:
     """
-    owner = models.Owner.query.get(id)
+    try:
+        schema, dumper = fieldsets.sparse(owner_schema, owner_dumper)
+    except fieldsets.FieldsError as e:
+        return e.args[0], http.HTTPStatus.BAD_REQUEST
+    validators = _owner_validators(id, schema)
+    if validators is None:
+        return '', http.HTTPStatus.NOT_FOUND
+    if conditional.not_modified(validators):
+        return '', http.HTTPStatus.NOT_MODIFIED, conditional.headers(validators)
+    owner = apply_loading_plan(models.Owner.query, schema).get(id)
     if not owner:
         return '', http.HTTPStatus.NOT_FOUND
-    owner_dict, errors = owner_schema.dump(owner)
+    owner_dict, errors = dumper.dump(owner)
     if not errors:
-        return owner_dict
+        return owner_dict, http.HTTPStatus.OK, conditional.headers(validators)
     else:  # break properly
         return '', http.HTTPStatus.INTERNAL_SERVER_ERROR
 
@@ -45,7 +122,11 @@ def owner_edit(id):
     :param id: the owner id
     :return:
     """
-    data = request.get_json()
+    data = negotiation.request_data()
+    try:
+        dumper = fieldsets.sparse(owner_schema, owner_dumper)[1]
+    except fieldsets.FieldsError as e:
+        return e.args[0], http.HTTPStatus.BAD_REQUEST
     owner = models.Owner.query.get(id)
 
     if not owner:
@@ -54,7 +135,7 @@ def owner_edit(id):
     for k, v in data.items():
         setattr(owner, k, v)
 
-    user_dict, errors = owner_schema.dump(owner)
+    user_dict, errors = dumper.dump(owner)
     if not errors:
         return user_dict
     else:  # break properly
@@ -64,14 +145,22 @@ def owner_edit(id):
 def owner_add():
     """
     Adds an owner
+    (or many at once from a JSON array, see bulk module)
     :return:
     """
-    data = request.get_json()
+    data = negotiation.request_data()
+    try:
+        dumper = fieldsets.sparse(owner_schema, owner_dumper)[1]
+    except fieldsets.FieldsError as e:
+        return e.args[0], http.HTTPStatus.BAD_REQUEST
+    if isinstance(data, list):
+        return bulk.bulk_add(owner_schema)
+
     owner, errors = owner_schema.load(data, )
     if not errors:
         owner.save()
 
-    owner_dict, errors = owner_schema.dump(owner)
+    owner_dict, errors = dumper.dump(owner)
     if not errors:
         return owner_dict, http.HTTPStatus.CREATED
     else:  # break properly
@@ -81,15 +170,20 @@ def owner_add():
 def owner_delete(id):
     """
     Deletes an owner
+    (with a cascade parameter for its pets, orphan by default, or delete or reject, see models.cascades)
     :param id: the owner id
     :return:
     """
     owner = models.Owner.query.get(id)
-    if owner:
-        owner.delete()
-        return '', http.HTTPStatus.NO_CONTENT
-    else:
+    if not owner:
         return '', http.HTTPStatus.NOT_FOUND
+    try:
+        models.cascades.delete(models.Owner, owner.id, cascade=request.args.get('cascade'))
+    except models.cascades.CascadeError as e:
+        return e.args[0], http.HTTPStatus.BAD_REQUEST
+    except models.cascades.DependentsError as e:
+        return e.args[0], http.HTTPStatus.CONFLICT
+    return '', http.HTTPStatus.NO_CONTENT
 
 
 if __name__ == "__main__":
@@ -0,0 +1,100 @@
+"""
+Keyset (cursor) pagination for collection endpoints.
+
+A page is selected with ``WHERE id > :after ORDER BY id LIMIT :limit``, which is answered
+directly by the primary key index, whatever the position of the page in the table.
+(an OFFSET based page would have to scan and skip all the previous rows first)
+
+Query parameters :
+ - limit : number of items in the page (defaults to PAGE_SIZE, capped by PAGE_SIZE_MAX)
+ - after : cursor, id of the last item of the previous page
+ - limit=all : opt-in to get everything in one response, still capped by UNPAGINATED_MAX
+
+The cursor for the next page is returned in the `Link` header (github style) and in `X-Next-Cursor`.
+"""
+
+import collections
+from urllib.parse import urlencode
+
+from flask import current_app, request
+
+# items of the page, and cursor for the next page (None if this is the last page)
+Page = collections.namedtuple('Page', ['items', 'next'])
+
+
+class PaginationError(ValueError):
+    """Invalid pagination parameters. args[0] is a marshmallow-like errors dict"""
+    pass
+
+
+def page_args(args=None):
+    """
+    Parses pagination parameters.
+    :param args: the request args (defaults to flask request.args)
+    :return: a tuple (limit, after)
+    """
+    args = request.args if args is None else args
+    config = current_app.config
+    errors = {}
+
+    limit = args.get('limit')
+    if limit is None:
+        limit = config['PAGE_SIZE']
+    elif limit == 'all':
+        limit = config['UNPAGINATED_MAX']
+    else:
+        try:
+            limit = int(limit)
+            if limit < 1:
+                raise ValueError
+            limit = min(limit, config['PAGE_SIZE_MAX'])
+        except ValueError:
+            errors['limit'] = ['Not a valid page size.']
+
+    after = args.get('after')
+    if after is not None:
+        try:
+            after = int(after)
+        except ValueError:
+            errors['after'] = ['Not a valid cursor.']
+
+    if errors:
+        raise PaginationError(errors)
+
+    return limit, after
+
+
+def keyset_page(query, key, args=None):
+    """
+    Retrieves one page of the query results, ordered by key.
+    :param query: the sqlalchemy query to paginate
+    :param key: the unique, indexed, column to paginate on (usually the primary key)
+    :param args: the request args (defaults to flask request.args)
+    :return: a Page
+    """
+    limit, after = page_args(args)
+    if after is not None:
+        query = query.filter(key > after)
+
+    # fetching one more row tells us if there is a next page, without a COUNT
+    items = query.order_by(key).limit(limit + 1).all()
+    if len(items) > limit:
+        items = items[:limit]
+        return Page(items, getattr(items[-1], key.key))
+    return Page(items, None)
+
+
+def page_headers(page):
+    """
+    Builds the headers pointing to the next page.
+    :param page: the current Page
+    :return: a headers dict
+    """
+    if page.next is None:
+        return {}
+    args = request.args.to_dict()
+    args['after'] = page.next
+    return {
+        'Link': '<{}?{}>; rel="next"'.format(request.base_url, urlencode(args)),
+        'X-Next-Cursor': str(page.next),
+    }
@@ -10,5 +10,15 @@ from ._bootstrap import ma
 
 from .users import user_schema
 from .owners import owner_schema
-from .species import species_schema
+from .species import species_schema, species_stats_schema
 from .animals import animal_schema
+
+from .loading import apply_loading_plan
+from . import cache
+
+# precompiled dumps for the hot paths, once all nested schemas are resolvable
+from .compiled import compile_schema
+user_dumper = compile_schema(user_schema)
+owner_dumper = compile_schema(owner_schema)
+species_dumper = compile_schema(species_schema)
+animal_dumper = compile_schema(animal_schema)
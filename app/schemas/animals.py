@@ -1,16 +1,53 @@
 try:
     from ._bootstrap import ma
-    from .models import Animal, Species
+    from .models import Animal, Species, stats
     from .species import SpeciesSchema
+    from . import cache
 except SystemError:  # in case we call this module directly (doctest)
     from _bootstrap import ma
-    from models import Animal, Species
+    from models import Animal, Species, stats
     from species import SpeciesSchema
+    import cache
 
 
 from marshmallow import fields, pre_load
 
 
+class CachedSpecies(fields.Nested):
+    """The nested species of an animal, dumped from the species cache when there is one (see cache module)"""
+    cached = True  # no need to load the relationship with the animals
+    columns = ('species_id', )
+
+    def cached_dump(self, obj):
+        """The nested species of an animal from the cache, None without cache (see compiled module)"""
+        species_dict = cache.species_by_id(obj.species_id) if isinstance(obj, Animal) else None
+        if species_dict is not None:
+            # the nested schema may be restricted (only, exclude, sparse fieldsets)
+            return {k: species_dict[k] for k, f in self.schema.fields.items() if not f.load_only and k in species_dict}
+        return None
+
+    def serialize(self, attr, obj, accessor=None):
+        species_dict = self.cached_dump(obj)
+        if species_dict is not None:
+            return species_dict
+        return super(CachedSpecies, self).serialize(attr, obj, accessor=accessor)
+
+
+class Stat(fields.Integer):
+    """An animal stat, dumped as its current value (derived from its baseline in lazy stats mode)"""
+    columns = ('happy', 'hungry', 'stats_updated_at', 'species_id')
+
+    @staticmethod
+    def is_plain():
+        """Whether the dumped values are the stored ones, read as plain attributes (see compiled module)"""
+        return not stats.lazy_stats_enabled()
+
+    def get_value(self, attr, obj, accessor=None, default=fields.missing_):
+        if isinstance(obj, Animal):
+            return getattr(obj.current_stats(), attr)
+        return super(Stat, self).get_value(attr, obj, accessor=accessor, default=default)
+
+
 class AnimalSchema(ma.ModelSchema):
     """This class represents the animals table.
         A Pet is part of a species and belongs to an owner
@@ -66,7 +103,9 @@ class AnimalSchema(ma.ModelSchema):
      'hungry': 42,
      'id': 1,
      'name': 'testanimal',
-     'species': {'name': 'testspecies'}}
+     'owner_id': 1,
+     'species': {'name': 'testspecies'},
+     'species_id': 1}
 
     >>> animal_schema.load(dump_data, session=session).data
     <Animal: testanimal <Species: testspecies>>
@@ -74,11 +113,12 @@ class AnimalSchema(ma.ModelSchema):
 
     class Meta:
         fields = ('id', 'name', 'happy', 'hungry', 'species', 'species_id', 'owner', 'owner_id')
-        load_only = ('species_id', 'owner_id')
         dump_only = ('id', 'species', 'owner')
         model = Animal
 
-    species = fields.Nested(SpeciesSchema, dump_only=True)
+    happy = Stat(allow_none=True)
+    hungry = Stat(allow_none=True)
+    species = CachedSpecies(SpeciesSchema, dump_only=True, exclude=('member_count', ))  # cached, would be stale
     # indirect nested relation to avoid cycle
     owner = fields.Nested('OwnerSchema', dump_only=True, exclude=('pets', ))
     #author = ma.HyperlinkRelated('owner')
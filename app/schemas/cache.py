@@ -0,0 +1,171 @@
+"""
+In-process read-through cache for the species.
+
+Species are designed with the game, and seldom change, but every animal dump nests one.
+Each app (so each worker) keeps the dumped species, by id and by name, in a LRU cache
+bounded by SPECIES_CACHE_SIZE entries, each entry expiring SPECIES_CACHE_TTL seconds after it was read
+from the database. Species views invalidate the entries they change. Other writes (admin views, shell...)
+are seen once the entries expire.
+
+Usage :
+>>> cache = LRUCache(maxsize=2, ttl=60)
+>>> cache.get('a') is None
+True
+>>> cache.put('a', 1)
+>>> cache.put('b', 2)
+>>> cache.get('a')
+1
+>>> cache.put('c', 3)  # evicts the least recently used
+>>> cache.get('b') is None
+True
+>>> cache.stats() == {'hits': 1, 'misses': 2, 'size': 2, 'maxsize': 2, 'ttl': 60}
+True
+"""
+
+import collections
+import threading
+import time
+
+from flask import current_app, has_app_context
+
+try:
+    from .models import Species
+    from .species import species_schema
+except SystemError:  # in case we call this module directly (doctest)
+    from models import Species
+    from species import species_schema
+
+
+class LRUCache(object):
+    """
+    A thread safe mapping, bounded in size, with entries expiring after ttl seconds.
+    The size is the number of entries, or the sum of sizeof(value) when sizeof is given.
+    """
+
+    def __init__(self, maxsize=128, ttl=None, clock=time.monotonic, sizeof=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._entries = collections.OrderedDict()  # key: (expiry, value), least recently used first
+        self._lock = threading.Lock()
+
+    def _sizeof(self, entry):
+        return self.sizeof(entry[1]) if self.sizeof is not None else 1
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] is None or entry[0] > self.clock()):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]  # expired
+                self.size -= self._sizeof(entry)
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        entry = (self.clock() + self.ttl if self.ttl is not None else None, value)
+        if self._sizeof(entry) > self.maxsize:
+            return  # would evict everything else
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= self._sizeof(previous)
+            self._entries[key] = entry
+            self.size += self._sizeof(entry)
+            while self.size > self.maxsize:
+                self.size -= self._sizeof(self._entries.popitem(last=False)[1])
+
+    def invalidate(self, key):
+        """Forgets an entry, returns its value (or None)"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.size -= self._sizeof(entry)
+        return entry[1] if entry is not None else None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """Counters, for monitoring"""
+        return {'hits': self.hits, 'misses': self.misses, 'size': self.size,
+                'maxsize': self.maxsize, 'ttl': self.ttl}
+
+
+def species_cache():
+    """
+    The species cache of the current app
+    :return: the LRUCache, None outside of an app context
+    """
+    if not has_app_context():
+        return None
+    cache = current_app.extensions.get('species_cache')
+    if cache is None:
+        cache = current_app.extensions.setdefault('species_cache', LRUCache(
+            maxsize=current_app.config.get('SPECIES_CACHE_SIZE', 1024),
+            ttl=current_app.config.get('SPECIES_CACHE_TTL', 300)))
+    return cache
+
+
+def _read_through(key, query):
+    cache = species_cache()
+    if cache is None:
+        return None
+    species_dict = cache.get(key)
+    if species_dict is None:
+        species = query()
+        if species is None:
+            return None  # not cached, it may be created later on
+        species_dict, errors = species_schema.dump(species)
+        if errors:
+            return None
+        cache.put(('id', species.id), species_dict)
+        cache.put(('name', species.name), species_dict)
+    return species_dict
+
+
+def species_by_id(id):
+    """
+    Retrieves a dumped species, through the cache
+    :param id: the species id
+    :return: the species dict, None if not found or outside of an app context
+    """
+    return _read_through(('id', id), lambda: Species.query.get(id))
+
+
+def species_by_name(name):
+    """
+    Retrieves a dumped species, through the cache
+    :param name: the species name
+    :return: the species dict, None if not found or outside of an app context
+    """
+    return _read_through(('name', name), lambda: Species.query.filter_by(name=name).first())
+
+
+def invalidate_species(id=None, name=None):
+    """
+    Forgets a species, to be called when it is changed or deleted
+    :param id: the species id
+    :param name: the species name, if it is known
+    """
+    cache = species_cache()
+    if cache is None:
+        return
+    for cached in (cache.invalidate(('id', id)), cache.invalidate(('name', name))):
+        if cached is not None:  # and the other key of the same species
+            cache.invalidate(('id', cached.get('id')))
+            cache.invalidate(('name', cached.get('name')))
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
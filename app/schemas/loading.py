@@ -0,0 +1,105 @@
+"""
+Eager loading plans derived from the schemas.
+
+All relationships in our models are lazy, so dumping a list of N rows with a nested schema
+issues 1 + N (+ N*M ...) queries. Here we walk the nested fields a schema will actually dump,
+and build the matching sqlalchemy loader options :
+ - joinedload for many-to-one relationships (joined in the same SELECT)
+ - selectinload for collections (one extra SELECT ... WHERE IN per collection, whatever N)
+For schemas restricted to some fields (only, see fieldsets module), only the columns the dump needs
+are loaded (load_only), the others are deferred.
+
+Usage through sqlalchemy:
+>>> import sqlalchemy
+>>> import animals, owners  # import other modules to resolve relationships
+>>> sqlalchemy.orm.configure_mappers()
+
+>>> len(loading_options(animals.animal_schema))  # owner.user (species come from their cache)
+1
+>>> len(loading_options(owners.owner_schema))  # user, pets
+2
+"""
+
+import functools
+
+import sqlalchemy
+from marshmallow import fields
+from sqlalchemy.orm import joinedload, load_only, selectinload
+
+
+def _nested_relationships(schema):
+    """
+    Yields (relationship property, nested schema) for each nested field dumped by the schema.
+    """
+    mapper = sqlalchemy.inspect(schema.opts.model)
+    for name, field in schema.fields.items():
+        if field.load_only:
+            continue  # never dumped
+        if isinstance(field, fields.List):
+            field = field.container
+        if not isinstance(field, fields.Nested) or getattr(field, 'cached', False):
+            continue  # not a relationship, or dumped from a cache
+        relationship = mapper.relationships.get(field.attribute or name)
+        if relationship is not None:
+            yield relationship, field.schema
+
+
+def _columns(schema):
+    """
+    The column attributes needed to dump with the schema : primary key, dumped columns,
+    foreign keys of dumped relationships, and columns declared by fields deriving their value (field.columns).
+    """
+    mapper = sqlalchemy.inspect(schema.opts.model)
+    keys = {mapper.get_property_by_column(c).key for c in mapper.primary_key}
+    for name, field in schema.fields.items():
+        if field.load_only:
+            continue  # never dumped
+        attribute = field.attribute or name
+        keys.update(getattr(field, 'columns', ()))
+        if attribute in mapper.column_attrs:
+            keys.add(attribute)
+        elif attribute in mapper.relationships:
+            keys.update(mapper.get_property_by_column(c).key for c in mapper.relationships[attribute].local_columns)
+    return sorted(k for k in keys if k in mapper.column_attrs)
+
+
+def _options(schema, parent=None, depth=0):
+    options = []
+    if parent is None and schema.only is not None:
+        options.append(load_only(*_columns(schema)))
+    for relationship, nested in sorted(_nested_relationships(schema), key=lambda rn: rn[0].key):
+        attribute = relationship.class_attribute
+        if relationship.uselist:
+            loader = parent.selectinload(attribute) if parent else selectinload(attribute)
+        else:
+            loader = parent.joinedload(attribute) if parent else joinedload(attribute)
+        sub_options = _options(nested, loader, depth + 1) if depth < 8 else []  # guard against cycles
+        options += sub_options or [loader]
+        if nested.only is not None:
+            options.append(loader.load_only(*_columns(nested)))
+    return options
+
+
+@functools.lru_cache(maxsize=None)
+def loading_options(schema):
+    """
+    Computes (once per schema) the loader options needed to dump with that schema.
+    :param schema: the (model) schema instance that will be used to dump
+    :return: a tuple of loader options for query.options()
+    """
+    return tuple(_options(schema))
+
+
+def apply_loading_plan(query, schema):
+    """
+    Applies the schema loading plan to a query.
+    :param query: the query retrieving the rows to dump
+    :param schema: the schema that will be used to dump the rows
+    :return: the query, with its eager loading options
+    """
+    return query.options(*loading_options(schema))
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
@@ -8,6 +8,21 @@ from .animals import Animal
 from .owners import Owner
 from .species import Species
 from .users import User
+from .species_stats import SpeciesStats
+from .tombstones import Tombstone
+from .journal import AnimalEvent, AnimalCheckpoint
+from . import cascades, changes, counters, journal, rollups, species_stats, tombstones, versions
+
+# caches depending on the tables content
+versions.track(Animal, Owner, Species, User)
+# aggregates of the animals, maintained with each write
+rollups.track(Animal, species_stats, counters)
+# deletions, for clients syncing changes
+tombstones.track(Animal, Owner, Species, User)
+# stats changes, for auditing
+journal.track(Animal)
+# animals change feed (server-sent events)
+changes.track(Animal)
 
 
 from flask_admin import Admin
@@ -1,11 +1,20 @@
 try:
     from ._bootstrap import db
+    from . import stats
 except SystemError:  # in case we call this module directly (doctest)
     from _bootstrap import db
+    import stats
+
+import collections
+import datetime
+
+import sqlalchemy
 
 
 from sqlalchemy_utils import PasswordType, EmailType, UUIDType, ColorType  #,NumericRangeType
 
+STATS = ('happy', 'hungry')  # columns following the stats clock (stats_updated_at)
+
 
 class Animal(db.Model):
     """This class represents the animals table.
@@ -44,19 +53,31 @@ class Animal(db.Model):
     """
 
     __tablename__ = 'animals'
+    __table_args__ = (
+        db.Index('ix_animals_species_id_hungry', 'species_id', 'hungry'),  # hungriest pets of a species
+        db.Index('ix_animals_species_id_happy', 'species_id', 'happy'),  # happiest pets of a species (species stats)
+        db.Index('ix_animals_hungry_desc', db.text('hungry DESC'), 'id'),  # hungriest pets
+        db.Index('ix_animals_happy', 'happy', 'id'),  # unhappiest pets
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255))
     happy = db.Column(db.Integer(), default=0)
     hungry = db.Column(db.Integer(), default=0)
-    owner_id = db.Column(db.Integer, db.ForeignKey('owners.id'), nullable=True)  # allow orphan pets
-    species_id = db.Column(db.Integer, db.ForeignKey('species.id'), nullable=False)
+    owner_id = db.Column(db.Integer, db.ForeignKey('owners.id'), nullable=True, index=True)  # allow orphan pets
+    species_id = db.Column(db.Integer, db.ForeignKey('species.id'), nullable=False, index=True)
 
     # authoring
     date_created = db.Column(db.DateTime, default=db.func.current_timestamp())
     date_modified = db.Column(
         db.DateTime, default=db.func.current_timestamp(),
-        onupdate=db.func.current_timestamp())
+        onupdate=db.func.current_timestamp(), index=True)  # delta sync (see sync module)
+    # stats clock : when happy and hungry were last brought up to date, by a simulation tick or a stats rebase
+    # (other writes leave it, and the stats keep decaying from it, see models.stats)
+    stats_updated_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+
+    # current stats of an animal
+    Stats = collections.namedtuple('Stats', ['happy', 'hungry'])
 
     #https://github.com/klen/mixer#support-for-flask-sqlalchemy-models-that-have-init-arguments
     # def __init__(self, name):
@@ -90,10 +111,107 @@ class Animal(db.Model):
             session.rollback()
             raise
 
+    def current_stats(self, now=None):
+        """
+        The stats of this animal now.
+        In lazy stats mode, happy and hungry columns only hold a baseline, as of stats_updated_at,
+        and the current stats are derived from the species rates (see models.stats).
+        Stats changed, but not flushed yet, are the current ones.
+        :param now: the current (UTC) time, defaults to now
+        :return: a Stats tuple
+        """
+        if not stats.lazy_stats_enabled() or self.stats_updated_at is None or self.species is None:
+            return self.Stats(self.happy, self.hungry)
+        elapsed = max(((now or datetime.datetime.utcnow()) - self.stats_updated_at).total_seconds(), 0)
+        happy, hungry = stats.advance_one(self.happy or 0, self.hungry or 0,
+                                          self.species.happy_rate or 0, self.species.hunger_rate or 0,
+                                          elapsed, stats.rate_period())
+        attrs = sqlalchemy.inspect(self).attrs
+        return self.Stats(self.happy if attrs.happy.history.added else happy,
+                          self.hungry if attrs.hungry.history.added else hungry)
+
+    @classmethod
+    def derived_stats(cls, criterion, session=None, now=None):
+        """
+        The current stats of the animals matching a criterion, from a column-only query, without loading them
+        (same values as current_stats).
+        :param criterion: the animals filter
+        :param session: optional in case flask has not been initialized
+        :param now: the current (UTC) time, defaults to now
+        :return: a list of (id, Stats), in id order
+        """
+        if session is None:
+            session = db.session
+        now = now or datetime.datetime.utcnow()
+        lazy, period = stats.lazy_stats_enabled(), stats.rate_period()
+        animals, species = cls.__table__, cls.__mapper__.relationships['species'].mapper.local_table
+        derived = []
+        for id, happy, hungry, stats_updated_at, happy_rate, hunger_rate in session.execute(
+                sqlalchemy.select([animals.c.id, animals.c.happy, animals.c.hungry, animals.c.stats_updated_at,
+                                   species.c.happy_rate, species.c.hunger_rate])
+                .select_from(animals.join(species)).where(criterion).order_by(animals.c.id)):
+            if lazy and stats_updated_at is not None:
+                elapsed = max((now - stats_updated_at).total_seconds(), 0)
+                happy, hungry = stats.advance_one(happy or 0, hungry or 0, happy_rate or 0, hunger_rate or 0,
+                                                  elapsed, period)
+            derived.append((id, cls.Stats(happy, hungry)))
+        return derived
+
+    @classmethod
+    def rebase_updates(cls, updates, session=None, now=None):
+        """
+        Completes partial updates (see bulk module) so they move the stats clock as flushing an instance would :
+        in lazy stats mode, the stats baseline is moved to now, otherwise the updates setting a stat restart
+        the clock.
+        :param updates: a list of (id, {column: value})
+        :param session: optional in case flask has not been initialized
+        :param now: the current (UTC) time, defaults to now
+        :return: the list of updates, with the baseline columns
+        """
+        now = now or datetime.datetime.utcnow()
+        if not stats.lazy_stats_enabled():
+            return [(id, dict(values, stats_updated_at=now) if any(s in values for s in STATS) else values)
+                    for id, values in updates]
+        if session is None:
+            session = db.session
+        period = stats.rate_period()
+        animals, species = cls.__table__, cls.__mapper__.relationships['species'].mapper.local_table
+
+        ids = sorted({id for id, _ in updates})
+        baselines = {}
+        for start in range(0, len(ids), 500):  # under SQLite host parameters limit
+            baselines.update((row[0], row[1:]) for row in session.execute(
+                sqlalchemy.select([animals.c.id, animals.c.happy, animals.c.hungry, animals.c.stats_updated_at,
+                                   species.c.happy_rate, species.c.hunger_rate])
+                .select_from(animals.join(species)).where(animals.c.id.in_(ids[start:start + 500]))))
+
+        rebased = []
+        for id, values in updates:
+            if id in baselines:
+                happy, hungry, stats_updated_at, happy_rate, hunger_rate = baselines[id]
+                elapsed = max((now - stats_updated_at).total_seconds(), 0) if stats_updated_at else 0
+                happy, hungry = stats.advance_one(happy or 0, hungry or 0, happy_rate or 0, hunger_rate or 0,
+                                                  elapsed, period)
+                values = dict({'happy': happy, 'hungry': hungry}, stats_updated_at=now, **values)
+            rebased.append((id, values))
+        return rebased
+
     def __repr__(self):
         return "<Animal: {} {} {}>".format(self.name, self.species, self.owner)
 
 
+@sqlalchemy.event.listens_for(Animal, 'before_update')
+def rebase_stats(mapper, connection, target):
+    """In lazy stats mode, any write moves the stats baseline to now. Otherwise, setting a stat restarts the clock"""
+    attrs = sqlalchemy.inspect(target).attrs
+    if stats.lazy_stats_enabled():
+        now = datetime.datetime.utcnow()
+        target.happy, target.hungry = target.current_stats(now=now)
+        target.stats_updated_at = now
+    elif any(attrs[s].history.added for s in STATS) and not attrs.stats_updated_at.history.added:
+        target.stats_updated_at = datetime.datetime.utcnow()
+
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod(verbose=True)
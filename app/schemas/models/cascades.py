@@ -0,0 +1,131 @@
+"""
+Set-based deletes of owners and species, whatever the number of their animals.
+
+session.delete(owner) loads the whole pets collection, to null out each pet owner_id with its own UPDATE.
+delete runs a constant number of statements instead, with a cascade for the dependent animals :
+ - 'orphan' : the animals are kept, without owner (owners only, species_id is not nullable)
+ - 'delete' : the animals are deleted too
+ - 'reject' : nothing is deleted when there are animals (DependentsError)
+The rollups of the deleted animals (species_stats, counters) are recomputed for the rows they touched only,
+and the tombstones are written, as the ORM events would (see rollups and tombstones modules).
+The change feed gets a resync marker when animals were orphaned or deleted (see changes module).
+"""
+
+try:
+    from ._bootstrap import db
+    from .animals import Animal
+    from .owners import Owner
+    from .species import Species
+    from . import changes, counters, species_stats, tombstones, versions
+except SystemError:  # in case we call this module directly (doctest)
+    from _bootstrap import db
+    from animals import Animal
+    from owners import Owner
+    from species import Species
+    import changes
+    import counters
+    import species_stats
+    import tombstones
+    import versions
+
+import sqlalchemy
+
+CASCADES = ('orphan', 'delete', 'reject')
+
+# the animals foreign key to each parent, and the default cascade
+DEPENDENTS = {
+    Owner: (Animal.__table__.c.owner_id, 'orphan'),
+    Species: (Animal.__table__.c.species_id, 'reject'),
+}
+
+
+class CascadeError(ValueError):
+    """Invalid cascade. args[0] is a marshmallow-like errors dict"""
+    pass
+
+
+class DependentsError(ValueError):
+    """The row still has dependents, with the reject cascade. args[0] is a marshmallow-like errors dict"""
+    pass
+
+
+def cascades(model):
+    """
+    :param model: the parent model class, Owner or Species
+    :return: the cascades available for its dependents
+    """
+    foreign_key, _ = DEPENDENTS[model]
+    return tuple(c for c in CASCADES if c != 'orphan' or foreign_key.nullable)
+
+
+def delete(model, id, cascade=None, session=None, commit=True):
+    """
+    Deletes an owner or a species, and its animals according to the cascade, in a constant number of statements.
+    :param model: the model class, Owner or Species
+    :param id: the row id
+    :param cascade: 'orphan', 'delete' or 'reject', defaults to the current behavior of the model
+    :param session: optional in case flask has not been initialized
+    :param commit: whether to commit
+    :return: True if the row was deleted, False if it does not exist
+    """
+    if session is None:
+        session = db.session
+    foreign_key, default = DEPENDENTS[model]
+    cascade = cascade or default
+    if cascade not in cascades(model):
+        raise CascadeError({'cascade': ['Must be one of: {}.'.format(', '.join(cascades(model)))]})
+
+    table, animals = model.__table__, Animal.__table__
+    dependents = foreign_key == id
+    session.flush()  # pending ORM changes first, the statements below depend on them
+    if session.execute(sqlalchemy.select([table.c.id]).where(table.c.id == id)).first() is None:
+        return False
+    if cascade == 'reject':
+        count = session.execute(sqlalchemy.select([sqlalchemy.func.count()]).where(dependents)).scalar()
+        if count:
+            raise DependentsError({'_schema': ['Still has {} {}.'.format(count, animals.name)]})
+
+    written = {table.name} | set(tombstones.TABLES)
+    try:
+        if cascade == 'orphan':
+            values = {foreign_key.key: None}
+            if session.execute(animals.update().where(dependents).values(values)).rowcount:
+                changes.resync(session)
+            written.add(animals.name)
+        elif cascade == 'delete':
+            # rows of the other parents, whose rollups change
+            touched = {column: [i for i, in session.execute(
+                sqlalchemy.select([animals.c[column]]).distinct().where(dependents))]
+                for column in counters.COLUMNS if column != foreign_key.key}
+            tombstones.bury_where(session, animals, dependents)
+            if session.execute(animals.delete().where(dependents)).rowcount:
+                changes.resync(session)
+            for column, ids in touched.items():
+                counters.refresh(session, column, ids)
+            species_stats.refresh(session, touched.get('species_id', []))
+            written.update({animals.name} | set(counters.TABLES) | set(species_stats.TABLES))
+
+        if model is Species:  # its (empty) statistics go with it
+            species_stats.refresh(session, [id])
+            written.update(species_stats.TABLES)
+        tombstones.bury(session, table.name, [id])
+        session.execute(table.delete().where(table.c.id == id))
+
+        session.info.setdefault('changed_tables', set()).update(written)
+        instance = session.identity_map.get(sqlalchemy.orm.util.identity_key(model, id))
+        if instance is not None:
+            session.expunge(instance)
+        session.expire_all()  # loaded animals and counters are stale
+        if commit:
+            session.commit()
+    except:
+        session.rollback()
+        raise
+    finally:  # the statements skip the ORM events
+        versions.bump(*written)
+    return True
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
@@ -0,0 +1,220 @@
+"""
+Change feed of the animals : rows created, updated and deleted, published to an in-process hub once committed.
+
+ORM writes are collected in the session when they are flushed, and published by the session after_commit hook
+(a rollback drops them). Core statements and bulk operations do not go through the ORM events, and have to
+collect the rows they write themselves (collect), or publish a resync marker when they change too many rows
+to tell (resync). Sessions with a 'hold_changes' info flag keep them until published explicitly (see batch module).
+
+The hub fans the changes out to its subscribers, each with a bounded queue : a slow subscriber never holds
+the writers back, its oldest changes are dropped instead, and it gets a resync marker before the next ones.
+Like the versions counters, the hub only sees the writes of the current process.
+
+Usage :
+>>> hub = Hub()
+>>> subscription = hub.subscribe(maxsize=2, match=lambda change: 3 in change.keys['species_id'])
+>>> hub.publish([Change('update', {'id': 1}, {'owner_id': {1}, 'species_id': {3}}) for _ in range(3)])
+>>> hub.publish([Change('delete', {'id': 2}, {'owner_id': {1}, 'species_id': {4}})])
+>>> [(e.kind, e.data) for e in iter(lambda: subscription.get(timeout=0), None)]
+[('resync', {'dropped': 1}), ('update', {'id': 1}), ('update', {'id': 1})]
+>>> subscription.close()
+>>> len(hub)
+0
+"""
+
+import collections
+import itertools
+import threading
+
+import sqlalchemy
+
+KINDS = ('create', 'update', 'delete', 'resync')
+COLUMNS = ('id', 'name', 'happy', 'hungry', 'owner_id', 'species_id')
+KEYS = ('owner_id', 'species_id')  # subscribers filters, on the former and the new values
+
+# ids per IN (...) clause, safely under SQLite host parameters limit (999)
+CHUNK_SIZE = 500
+
+# a change, before publication : kind, data (the row as written) and keys {key: set of values}
+Change = collections.namedtuple('Change', ['kind', 'data', 'keys'])
+# a published change, with its sequence id in the hub
+Event = collections.namedtuple('Event', ['id', 'kind', 'data'])
+
+_tracked = set()  # models in the feed
+
+
+class HubFullError(RuntimeError):
+    """The hub has no room for another subscriber"""
+    pass
+
+
+class Subscription(object):
+    """A subscriber of the hub, and its bounded queue of events"""
+
+    def __init__(self, hub, maxsize, match=None):
+        """
+        :param hub: the hub
+        :param maxsize: the number of events kept, the oldest are dropped beyond
+        :param match: optional predicate of the changes to receive
+        """
+        self.hub = hub
+        self.match = match
+        self.dropped = 0
+        self._events = collections.deque(maxlen=maxsize)
+        self._ready = threading.Condition()
+
+    def put(self, event):
+        """Queues an event, dropping the oldest one when the queue is full"""
+        with self._ready:
+            if len(self._events) == self._events.maxlen:
+                self.dropped += 1
+            self._events.append(event)
+            self._ready.notify()
+
+    def get(self, timeout=None):
+        """
+        The next event, a resync marker first when events were dropped.
+        :param timeout: seconds to wait for one
+        :return: an Event, None on timeout
+        """
+        with self._ready:
+            if not self._events and not self.dropped:
+                self._ready.wait(timeout)
+            if self.dropped:
+                dropped, self.dropped = self.dropped, 0
+                return Event(self.hub.last_id, 'resync', {'dropped': dropped})
+            return self._events.popleft() if self._events else None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class Hub(object):
+    """Fans the committed changes out to the subscribers"""
+
+    def __init__(self):
+        self.last_id = 0
+        self._subscriptions = set()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    def subscribe(self, maxsize, match=None, limit=None):
+        """
+        :param maxsize: the queue size of the subscriber
+        :param match: optional predicate of the changes to receive
+        :param limit: optional maximum number of subscribers
+        :return: a Subscription, to close once done
+        """
+        with self._lock:
+            if limit is not None and len(self._subscriptions) >= limit:
+                raise HubFullError(limit)
+            subscription = Subscription(self, maxsize, match)
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, changes):
+        """
+        Sends changes to the matching subscribers. A resync change goes to every subscriber.
+        :param changes: a list of Change
+        """
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+            events = []
+            for change in changes:
+                self.last_id = next(self._ids)
+                events.append((change, Event(self.last_id, change.kind, change.data)))
+        for subscription in subscriptions:
+            for change, event in events:
+                if change.kind == 'resync' or subscription.match is None or subscription.match(change):
+                    subscription.put(event)
+
+
+hub = Hub()
+
+
+def _pending(session):
+    return session.info.setdefault('pending_changes', [])
+
+
+def _change(kind, data, former=None):
+    keys = {k: {data.get(k)} | set(former.get(k, ()) if former else ()) for k in KEYS}
+    return Change(kind, data, keys)
+
+
+def collect(session, model, kind, ids):
+    """
+    Collects the changes of Core statements, published once committed.
+    Call it after inserts and updates, before deletes.
+    :param session: the session
+    :param model: the model class (untracked models are ignored)
+    :param kind: 'create', 'update' or 'delete'
+    :param ids: the rows ids
+    """
+    if model not in _tracked:
+        return
+    table = model.__table__
+    ids = sorted(set(ids))
+    for start in range(0, len(ids), CHUNK_SIZE):
+        _pending(session).extend(_change(kind, dict(row)) for row in session.execute(
+            sqlalchemy.select([table.c[c] for c in COLUMNS]).where(table.c.id.in_(ids[start:start + CHUNK_SIZE]))))
+
+
+def resync(session):
+    """
+    Tells every subscriber to fetch the state again, once committed (for writes of too many rows)
+    :param session: the session
+    """
+    _pending(session).append(Change('resync', {}, {k: set() for k in KEYS}))
+
+
+def publish_pending(session):
+    """Publishes the changes collected in a session"""
+    hub.publish(session.info.pop('pending_changes', ()))
+
+
+def _written(kind):
+    def listener(mapper, connection, target):
+        session = sqlalchemy.orm.object_session(target)
+        if session is None:
+            return
+        state = sqlalchemy.inspect(target)
+        data = {c: state.dict[c] for c in COLUMNS if c in state.dict}  # as written, expired columns left out
+        former = None
+        if kind == 'update':
+            former = {k: [v for v in state.attrs[k].history.deleted if v is not None] for k in KEYS}
+        _pending(session).append(_change(kind, data, former))
+    return listener
+
+
+@sqlalchemy.event.listens_for(sqlalchemy.orm.Session, 'after_commit')
+def _committed(session):
+    if not session.info.get('hold_changes'):
+        publish_pending(session)
+
+
+@sqlalchemy.event.listens_for(sqlalchemy.orm.Session, 'after_soft_rollback')
+def _rolled_back(session, previous_transaction):
+    session.info.pop('pending_changes', None)
+
+
+def track(*models):
+    """
+    Publishes the ORM writes of models to the hub
+    :param models: the model classes
+    """
+    for model in models:
+        _tracked.add(model)
+        for kind, event in (('create', 'after_insert'), ('update', 'after_update'), ('delete', 'after_delete')):
+            sqlalchemy.event.listen(model, event, _written(kind))
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
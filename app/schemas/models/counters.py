@@ -0,0 +1,91 @@
+"""
+Denormalized counters of animals : owners pet_count, and species member_count.
+
+They are maintained in the same transaction as the animals inserts, deletes, and owner or species reassignments
+(see rollups module), with relative UPDATEs (pet_count = pet_count + 1) : concurrent transactions do not lose
+each other changes. Changing a counter changes the owner or species date_modified, like any other change of
+their dump (see conditional module).
+refresh recounts some rows (see cascades module), rebuild recomputes every counter from the animals
+(flask reconcile command), in case they drifted.
+"""
+
+try:
+    from ._bootstrap import db
+    from .animals import Animal
+    from .owners import Owner
+    from .species import Species
+except SystemError:  # in case we call this module directly (doctest)
+    from _bootstrap import db
+    from animals import Animal
+    from owners import Owner
+    from species import Species
+
+import collections
+
+import sqlalchemy
+
+# animals columns the counters depend on, and tables written (see rollups module)
+COLUMNS = ('owner_id', 'species_id')
+TABLES = ('owners', 'species')
+
+# ids per IN (...) clause, safely under SQLite host parameters limit (999)
+CHUNK_SIZE = 500
+
+# counted table, counter column, for each animals column
+COUNTERS = {
+    'owner_id': (Owner.__table__, 'pet_count'),
+    'species_id': (Species.__table__, 'member_count'),
+}
+
+
+def apply(connection, removed=(), added=()):
+    """
+    Applies changes of the animals to the counters, once the animals are written.
+    :param connection: a connection or a session
+    :param removed: (owner_id, species_id) rows of the former animals
+    :param added: (owner_id, species_id) rows of the new animals
+    """
+    for index, column in enumerate(COLUMNS):
+        deltas = collections.Counter()
+        for sign, rows in ((-1, removed), (1, added)):
+            for row in rows:
+                if row[index] is not None:
+                    deltas[row[index]] += sign
+        table, counter = COUNTERS[column]
+        for id in sorted(deltas):  # same lock order in every transaction
+            if deltas[id]:
+                connection.execute(table.update().where(table.c.id == id).values(
+                    {counter: table.c[counter] + deltas[id]}))
+
+
+def refresh(connection, column, ids):
+    """
+    Recounts the animals of some owners or species (O(animals of these rows)).
+    :param connection: a connection or a session
+    :param column: the animals column, owner_id or species_id
+    :param ids: the owners or species ids
+    """
+    table, counter = COUNTERS[column]
+    animals = Animal.__table__
+    ids = sorted(i for i in set(ids) if i is not None)  # same lock order in every transaction
+    count = sqlalchemy.select([sqlalchemy.func.count()]).where(animals.c[column] == table.c.id).as_scalar()
+    for start in range(0, len(ids), CHUNK_SIZE):
+        connection.execute(table.update().where(table.c.id.in_(ids[start:start + CHUNK_SIZE])).values({counter: count}))
+
+
+def rebuild(session=None):
+    """
+    Recomputes every counter from the animals, and commits.
+    :param session: optional in case flask has not been initialized
+    """
+    if session is None:
+        session = db.session
+    animals = Animal.__table__
+    try:
+        for column, (table, counter) in COUNTERS.items():
+            count = sqlalchemy.select([sqlalchemy.func.count()]).where(animals.c[column] == table.c.id).as_scalar()
+            session.execute(table.update().where(table.c[counter] != count).values({counter: count}))
+        session.commit()
+    except:
+        session.rollback()
+        raise
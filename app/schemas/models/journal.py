@@ -0,0 +1,343 @@
+"""
+Journal of the animals stats changes : the append-only animal_events table, folded into the animals by compaction.
+
+Each event holds the happy and hungry changes (deltas) of one animal :
+ - 'feed' and 'play' for the actions (see actions module)
+ - 'create' and 'edit' for the ORM writes (Animal.save), recorded in the same flush as the change of the row,
+   and for the bulk creations and edits too (record_created and record_updates, see bulk module)
+ - 'decay' for the simulation ticks (see simulation module)
+Events are inserted, and only written again once, when compaction folds them : recording one is a cheap,
+sequential insert. Every change of the stats is journaled, the other Core statements writing them have to record
+their events.
+The animals existing before the journal start from a checkpoint of their stats (see its migration).
+
+An event is either applied (the animal row was written in the same transaction), or pending : with
+ACTIONS_JOURNAL set, actions only record pending events, and compact folds them into the animals later.
+Compaction goes through the events not folded yet (a partial index keeps them at hand), in id order, chunk by chunk,
+their rows locked : one executemany UPDATE of the animals per chunk for the pending changes, and a checkpoint
+per animal, with its journaled stats. The events are then marked folded (and applied). Events committed after
+later ones were folded (a long transaction) are folded by the next compaction all the same, none is skipped.
+rebuild then only replays the events of an animal not folded yet.
+purge removes the folded events older than the retention, chunk by chunk (flask purge-journal command).
+"""
+
+try:
+    from ._bootstrap import db
+    from .animals import Animal
+    from . import changes, rollups, stats, versions
+except SystemError:  # in case we call this module directly (doctest)
+    from _bootstrap import db
+    from animals import Animal
+    import changes
+    import rollups
+    import stats
+    import versions
+
+import collections
+import time
+
+import sqlalchemy
+
+TABLES = ('animal_events', 'animal_checkpoints')
+STATS = ('happy', 'hungry')
+
+# ids per IN (...) clause, safely under SQLite host parameters limit (999)
+CHUNK_SIZE = 500
+
+_tracked = set()  # models journaled
+
+# number of events folded, and whether the whole journal was folded
+CompactionResult = collections.namedtuple('CompactionResult', ['folded', 'complete'])
+
+
+class AnimalEvent(db.Model):
+    """This class represents the animal_events table, one row per change of an animal stats.
+
+    Usage through sqlalchemy :
+    >>> import sqlalchemy
+    >>> engine = sqlalchemy.create_engine('sqlite:///:memory:')
+    >>> Session = sqlalchemy.orm.sessionmaker(bind=engine)
+    >>> session = Session()
+
+    >>> import species, users, owners, animals  #import other modules to resolve relationships
+    >>> AnimalEvent.metadata.create_all(engine)
+    >>> track(animals.Animal)
+    >>> spec = species.Species(name='testspecies', happy_rate=5, hunger_rate=23)
+    >>> spec.save(session=session)
+    >>> animal = animals.Animal(name='testanimal', happy=4, hungry=42, species_id=spec.id)
+    >>> animal.save(session=session)
+    >>> animal.hungry = 32
+    >>> animal.save(session=session)
+    >>> [(e.action, e.happy, e.hungry) for e in session.query(AnimalEvent).order_by(AnimalEvent.id)]
+    [('create', 4, 42), ('edit', 0, -10)]
+    >>> rebuild(animal.id, session=session)
+    Stats(happy=4, hungry=32)
+    """
+
+    __tablename__ = 'animal_events'
+
+    id = db.Column(db.Integer, primary_key=True)
+    animal_id = db.Column(db.Integer, nullable=False)  # no foreign key : the journal outlives the animals
+    action = db.Column(db.String(16), nullable=False)
+    happy = db.Column(db.BigInteger, nullable=False, default=0)  # changes, wider than the stats
+    hungry = db.Column(db.BigInteger, nullable=False, default=0)
+    applied = db.Column(db.Boolean, nullable=False, default=True)  # already written to the animal row
+    folded = db.Column(db.Boolean, nullable=False, default=False)  # into the checkpoint of the animal
+    date_created = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
+
+    __table_args__ = (
+        # the events left to fold, however old
+        db.Index('ix_animal_events_unfolded', 'id', postgresql_where=db.text('NOT folded'),
+                 sqlite_where=db.text('NOT folded')),
+    )
+
+    def __repr__(self):
+        return "<AnimalEvent: {} {} {}>".format(self.animal_id, self.action, self.id)
+
+
+class AnimalCheckpoint(db.Model):
+    """This class represents the animal_checkpoints table, the journaled stats of an animal as of one event"""
+
+    __tablename__ = 'animal_checkpoints'
+
+    animal_id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.Integer, nullable=False, index=True)  # last event folded
+    happy = db.Column(db.Integer, nullable=False)
+    hungry = db.Column(db.Integer, nullable=False)
+    date_created = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
+
+    def __repr__(self):
+        return "<AnimalCheckpoint: {} {}>".format(self.animal_id, self.event_id)
+
+
+def _clip(value):
+    return min(max(value, stats.STAT_MIN), stats.STAT_MAX)
+
+
+def record(connection, events, applied=True):
+    """
+    Appends events to the journal, in one executemany INSERT.
+    :param connection: a connection or a session
+    :param events: a list of (animal id, action, {stat: delta})
+    :param applied: whether the animals rows were written in the same transaction
+    """
+    if events:
+        connection.execute(AnimalEvent.__table__.insert(), [
+            {'animal_id': id, 'action': action, 'happy': deltas.get('happy', 0), 'hungry': deltas.get('hungry', 0),
+             'applied': applied} for id, action, deltas in events])
+
+
+def record_created(connection, instances):
+    """
+    Journals the creation of instances inserted without the ORM events (see bulk module).
+    :param connection: a connection or a session
+    :param instances: the new instances, with their ids (untracked models are ignored)
+    :return: the tables written, whose versions have to be bumped
+    """
+    events = [(i.id, 'create', {s: getattr(i, s) or 0 for s in STATS}) for i in instances if type(i) in _tracked]
+    record(connection, events)
+    return set(TABLES) if events else set()
+
+
+def record_updates(connection, model, updates):
+    """
+    Journals the stats set by partial updates run without the ORM events (see bulk module), before they are run.
+    :param connection: a connection or a session
+    :param model: the model class (untracked models are ignored)
+    :param updates: a list of (id, {column: value})
+    :return: the tables written, whose versions have to be bumped
+    """
+    if model not in _tracked:
+        return set()
+    groups = {}
+    for id, values in updates:
+        changed = tuple(s for s in STATS if s in values)
+        if changed:
+            groups.setdefault(changed, []).append(dict({'e_' + s: values[s] or 0 for s in changed}, e_id=id))
+    for changed, rows in groups.items():
+        connection.execute(_edited(model.__table__, sqlalchemy.bindparam('e_id'), {
+            s: sqlalchemy.bindparam('e_' + s, type_=sqlalchemy.BigInteger) for s in changed}), rows)
+    return set(TABLES) if groups else set()
+
+
+def add_to_stats(connection, deltas):
+    """
+    Adds deltas to the animals stats, in one executemany UPDATE, maintaining their rollups and the change feed.
+    The stats clock is left as it is : the deltas add to the stats (the baseline in lazy stats mode), which keep
+    decaying from it (see models.stats).
+    :param connection: a session
+    :param deltas: a dict {animal id: {stat: delta}}
+    :return: the tables written, whose versions have to be bumped
+    """
+    table = Animal.__table__
+    ids = sorted(deltas)
+    values = {s: stats.clipped(table.c[s] + sqlalchemy.bindparam('d_' + s)) for s in STATS}
+    statement = table.update().where(table.c.id == sqlalchemy.bindparam('d_id')).values(values)
+
+    # core updates skip the ORM events maintaining the rollups
+    changed_rollups = rollups.tracked(Animal, changed=STATS)
+    removed = rollups.snapshot(connection, Animal, ids, changed_rollups)
+    connection.execute(statement, [dict({'d_' + s: deltas[id].get(s, 0) for s in STATS}, d_id=id) for id in ids])
+    rollups.apply(connection, removed, rollups.snapshot(connection, Animal, ids, changed_rollups))
+    changes.collect(connection, Animal, 'update', ids)
+    return {table.name} | {t for r in changed_rollups for t in r.TABLES}
+
+
+def _fold(connection, rows):
+    """Folds a chunk of events, in id order : pending changes into the animals, everything into the checkpoints"""
+    events, checkpoints = {}, AnimalCheckpoint.__table__
+    for row in rows:
+        events.setdefault(row.animal_id, []).append(row)
+
+    pending = {}
+    for id, animal_events in events.items():
+        changes = [e for e in animal_events if not e.applied]
+        if changes:
+            pending[id] = {s: sum(getattr(e, s) for e in changes) for s in STATS}
+    written = add_to_stats(connection, pending) if pending else set()
+
+    ids = sorted(events)
+    for start in range(0, len(ids), CHUNK_SIZE):
+        chunk = ids[start:start + CHUNK_SIZE]
+        states = {row.animal_id: row for row in connection.execute(
+            sqlalchemy.select([checkpoints]).where(checkpoints.c.animal_id.in_(chunk)))}
+        new_states = []
+        for id in chunk:
+            state = states.get(id)
+            happy, hungry, last = (state.happy, state.hungry, state.event_id) if state is not None else (0, 0, 0)
+            for event in events[id]:
+                happy, hungry = _clip(happy + event.happy), _clip(hungry + event.hungry)
+            new_states.append({'animal_id': id, 'event_id': max(last, events[id][-1].id),
+                               'happy': happy, 'hungry': hungry})
+        connection.execute(checkpoints.delete().where(checkpoints.c.animal_id.in_(chunk)))
+        connection.execute(checkpoints.insert(), new_states)
+
+    table, folded = AnimalEvent.__table__, [row.id for row in rows]
+    for start in range(0, len(folded), CHUNK_SIZE):
+        connection.execute(table.update().where(table.c.id.in_(folded[start:start + CHUNK_SIZE]))
+                           .values(folded=True, applied=True))
+    return written | set(TABLES)
+
+
+def compact(session=None, chunk_size=10000, budget=None):
+    """
+    Folds the events not folded yet, one transaction per chunk of events.
+    :param session: optional in case flask has not been initialized
+    :param chunk_size: number of events folded at once
+    :param budget: optional time budget, in seconds
+    :return: a CompactionResult
+    """
+    if session is None:
+        session = db.session
+    deadline = time.monotonic() + budget if budget is not None else None
+    events = AnimalEvent.__table__
+    # locked : a concurrent compaction waits, and then skips them
+    select = sqlalchemy.select([events.c.id, events.c.animal_id, events.c.happy, events.c.hungry, events.c.applied]) \
+        .where(sqlalchemy.not_(events.c.folded)).order_by(events.c.id).limit(chunk_size).with_for_update()
+
+    folded, written = 0, set()
+    try:
+        while True:
+            rows = session.execute(select).fetchall()
+            if rows:
+                written.update(_fold(session, rows))
+                session.commit()
+                folded += len(rows)
+            if len(rows) < chunk_size:
+                return CompactionResult(folded, True)
+            if deadline is not None and time.monotonic() > deadline:
+                return CompactionResult(folded, False)
+    except:
+        session.rollback()
+        raise
+    finally:  # core updates skip the ORM events
+        versions.bump(*written)
+
+
+def rebuild(animal_id, session=None):
+    """
+    The journaled stats of an animal : its checkpoint, and the events not folded into it yet.
+    :param animal_id: the animal id
+    :param session: optional in case flask has not been initialized
+    :return: a Stats tuple (see Animal), None when nothing was journaled for this animal
+    """
+    if session is None:
+        session = db.session
+    events, checkpoints = AnimalEvent.__table__, AnimalCheckpoint.__table__
+    state = session.execute(sqlalchemy.select([checkpoints]).where(checkpoints.c.animal_id == animal_id)).first()
+    happy, hungry = (state.happy, state.hungry) if state is not None else (0, 0)
+    # only the tail of the journal, in primary key order
+    changes = session.execute(sqlalchemy.select([events.c.happy, events.c.hungry])
+                              .where(sqlalchemy.not_(events.c.folded)).where(events.c.animal_id == animal_id)
+                              .order_by(events.c.id)).fetchall()
+    if state is None and not changes:
+        return None
+    for happy_change, hungry_change in changes:
+        happy, hungry = _clip(happy + happy_change), _clip(hungry + hungry_change)
+    return Animal.Stats(happy, hungry)
+
+
+def purge(before, session=None, chunk_size=10000):
+    """
+    Removes the folded events older than a date, one transaction per chunk, and the checkpoints of deleted animals.
+    :param before: the (UTC) date
+    :param session: optional in case flask has not been initialized
+    :param chunk_size: number of events removed at once
+    :return: the number of events removed
+    """
+    if session is None:
+        session = db.session
+    events, checkpoints, animals = AnimalEvent.__table__, AnimalCheckpoint.__table__, Animal.__table__
+    count = 0
+    try:
+        old = events.c.folded & (events.c.date_created < before)
+        while True:
+            ids = [id for id, in session.execute(
+                sqlalchemy.select([events.c.id]).where(old).order_by(events.c.id).limit(chunk_size))]
+            if not ids:
+                break
+            count += session.execute(events.delete().where(old).where(events.c.id.between(ids[0], ids[-1]))).rowcount
+            session.commit()
+        session.execute(checkpoints.delete().where(~checkpoints.c.animal_id.in_(sqlalchemy.select([animals.c.id]))))
+        session.commit()
+    except:
+        session.rollback()
+        raise
+    return count
+
+
+def _created(mapper, connection, target):
+    record(connection, [(target.id, 'create', {s: getattr(target, s) or 0 for s in STATS})])
+
+
+def _edited(table, id, values):
+    """The INSERT of the 'edit' event of a row, the change from its stored stats, before the row is written"""
+    changes = [values[s] - sqlalchemy.func.coalesce(table.c[s], 0) if s in values
+               else sqlalchemy.literal(0, sqlalchemy.BigInteger) for s in STATS]
+    select = sqlalchemy.select([table.c.id, sqlalchemy.literal('edit')] + changes) \
+        .where(table.c.id == id).where(sqlalchemy.or_(*(c != 0 for c in changes)))
+    return AnimalEvent.__table__.insert().from_select(['animal_id', 'action'] + list(STATS), select)
+
+
+def _updating(mapper, connection, target):
+    attrs = sqlalchemy.inspect(target).attrs
+    if not any(attrs[s].history.has_changes() for s in STATS):
+        return
+    connection.execute(_edited(mapper.local_table, target.id, {
+        s: sqlalchemy.literal(getattr(target, s) or 0, sqlalchemy.BigInteger) for s in STATS}))
+
+
+def track(model):
+    """
+    Journals the stats changes of each ORM insert and update
+    :param model: the model class, Animal
+    """
+    _tracked.add(model)
+    for identifier, listener in (('after_insert', _created), ('before_update', _updating)):
+        if not sqlalchemy.event.contains(model, identifier, listener):
+            sqlalchemy.event.listen(model, identifier, listener)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
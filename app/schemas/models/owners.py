@@ -47,13 +47,14 @@ class Owner(db.Model):
     #name = db.Column(db.String)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     pets = db.relationship('Animal', backref='owner', lazy=True, uselist=True)
+    pet_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # see counters
 
 
     # authoring
     date_created = db.Column(db.DateTime, default=db.func.current_timestamp())
     date_modified = db.Column(
         db.DateTime, default=db.func.current_timestamp(),
-        onupdate=db.func.current_timestamp())
+        onupdate=db.func.current_timestamp(), index=True)  # delta sync (see sync module)
 
     # https://github.com/klen/mixer#support-for-flask-sqlalchemy-models-that-have-init-arguments
     # def __init__(self, nick, email):
@@ -0,0 +1,146 @@
+"""
+Aggregates of a table stored in other tables (rollups), maintained in the same transaction as the writes.
+
+A rollup is a module with :
+ - COLUMNS : the columns of the aggregated table it depends on
+ - TABLES : the tables it writes (their versions are bumped, see versions module)
+ - apply(connection, removed, added) : applies rows (tuples of the COLUMNS values) that disappeared, or appeared
+   (an updated row is removed with its former values, and added with its new ones)
+
+track registers ORM events calling apply for each insert, update and delete, once the row is written.
+Bulk and Core paths skip the ORM events, and have to snapshot the rows they change, before and after :
+
+    rollups = tracked(Animal, changed=['hungry'])
+    removed = snapshot(session, Animal, ids, rollups)
+    ... (Core UPDATE of the animals)
+    apply(session, removed, snapshot(session, Animal, ids, rollups))
+"""
+
+try:
+    from . import versions
+except SystemError:  # in case we call this module directly (doctest)
+    import versions
+
+import sqlalchemy
+
+# ids per IN (...) clause, safely under SQLite host parameters limit (999)
+CHUNK_SIZE = 500
+
+_rollups = {}  # model: list of rollups
+
+
+def tracked(model, changed=None):
+    """
+    :param model: the model class
+    :param changed: only the rollups depending on these columns
+    :return: the rollups of a model
+    """
+    return [r for r in _rollups.get(model, []) if changed is None or set(changed) & set(r.COLUMNS)]
+
+
+def snapshot(connection, model, ids, rollups=None):
+    """
+    The rows of some ids, as stored now, for each rollup.
+    :param connection: a connection or a session
+    :param model: the model class
+    :param ids: the ids
+    :param rollups: the rollups (defaults to all the rollups of the model)
+    :return: a dict {rollup: list of rows}
+    """
+    rollups = tracked(model) if rollups is None else rollups
+    columns = sorted({c for r in rollups for c in r.COLUMNS})
+    table = model.__table__
+    ids = sorted(set(ids))
+    rows = []
+    if columns:
+        for start in range(0, len(ids), CHUNK_SIZE):
+            rows.extend(dict(row) for row in connection.execute(
+                sqlalchemy.select([table.c[c] for c in columns]).where(table.c.id.in_(ids[start:start + CHUNK_SIZE]))))
+    return {r: [tuple(row[c] for c in r.COLUMNS) for row in rows] for r in rollups}
+
+
+def apply(connection, removed=None, added=None):
+    """
+    Applies snapshots to their rollups.
+    :param connection: a connection or a session
+    :param removed: the former rows, {rollup: list of rows}
+    :param added: the new rows, {rollup: list of rows}
+    """
+    removed, added = removed or {}, added or {}
+    for rollup in sorted(set(removed) | set(added), key=lambda r: r.__name__):
+        rollup.apply(connection, removed=removed.get(rollup, ()), added=added.get(rollup, ()))
+        versions.bump(*rollup.TABLES)
+
+
+def _row(target, rollup):
+    return tuple(getattr(target, c) for c in rollup.COLUMNS)
+
+
+def _histories(target, rollup):
+    attrs = sqlalchemy.inspect(target).attrs
+    return [attrs[c].history for c in rollup.COLUMNS]
+
+
+def _written(target, rollups):
+    """Marks the rollups tables as changed, for the versions bump on commit"""
+    session = sqlalchemy.orm.object_session(target)
+    if session is not None:
+        session.info.setdefault('changed_tables', set()).update(t for r in rollups for t in r.TABLES)
+
+
+def _inserted(mapper, connection, target):
+    rollups = tracked(type(target))
+    apply(connection, added={r: [_row(target, r)] for r in rollups})
+    _written(target, rollups)
+
+
+def _updating(mapper, connection, target):
+    unknown = [r for r in tracked(type(target)) if any(h.has_changes() for h in _histories(target, r))
+               and not all(h.deleted or h.unchanged for h in _histories(target, r))]
+    if unknown:  # former values were not loaded, read them before they are overwritten
+        sqlalchemy.inspect(target).info['rollups_rows'] = snapshot(connection, type(target), [target.id], unknown)
+
+
+def _updated(mapper, connection, target):
+    formers = sqlalchemy.inspect(target).info.pop('rollups_rows', {})
+    removed, added = {}, {}
+    for rollup in tracked(type(target)):
+        histories = _histories(target, rollup)  # still the flushed changes
+        if rollup in formers:
+            removed[rollup] = formers[rollup]
+        elif any(h.has_changes() for h in histories):
+            removed[rollup] = [tuple(h.deleted[0] if h.deleted else h.unchanged[0] for h in histories)]
+        else:
+            continue
+        added[rollup] = [_row(target, rollup)]
+    if added:
+        apply(connection, removed, added)
+        _written(target, added)
+
+
+def _deleting(mapper, connection, target):
+    sqlalchemy.inspect(target).info['rollups_rows'] = {r: [_row(target, r)] for r in tracked(type(target))}
+
+
+def _deleted(mapper, connection, target):
+    removed = sqlalchemy.inspect(target).info.pop('rollups_rows', {})
+    apply(connection, removed=removed)
+    _written(target, removed)
+
+
+def track(model, *rollups):
+    """
+    Maintains rollups on each ORM write of a model
+    :param model: the model class
+    :param rollups: the rollup modules
+    """
+    if model not in _rollups:
+        for event, listener in (('after_insert', _inserted), ('before_update', _updating),
+                                ('after_update', _updated), ('before_delete', _deleting), ('after_delete', _deleted)):
+            sqlalchemy.event.listen(model, event, listener)
+    _rollups.setdefault(model, []).extend(rollups)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
@@ -46,12 +46,13 @@ class Species(db.Model):
     hunger_rate = db.Column(db.Integer(), default=0)  # avoiding float issues
 
     members = db.relationship('Animal', backref='species', lazy=True, uselist=True)
+    member_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # see counters
 
     # authoring
     date_created = db.Column(db.DateTime, default=db.func.current_timestamp())
     date_modified = db.Column(
         db.DateTime, default=db.func.current_timestamp(),
-        onupdate=db.func.current_timestamp())
+        onupdate=db.func.current_timestamp(), index=True)  # delta sync (see sync module)
 
     #https://github.com/klen/mixer#support-for-flask-sqlalchemy-models-that-have-init-arguments
     # def __init__(self, name):
@@ -0,0 +1,217 @@
+"""
+Per species aggregate statistics of the animals : count, and average/min/max of happy and hungry.
+
+The species_stats table is a rollup of the animals table, maintained incrementally :
+ - inserts, updates and deletes of animals apply their change to the species rows, in the same transaction
+   (see rollups module). The row of a species is inserted with its first animals, in a savepoint : when a concurrent
+   transaction inserted it first, the change is applied to its row instead. Counts and sums are incremented. Extremes widen with added values, and are recomputed
+   (with one indexed min/max lookup, see animals indexes) only when a removed value was an extreme.
+ - rebuild recomputes the whole table from the animals (flask reconcile command), in case it drifted.
+Reading the statistics is then O(number of species), whatever the number of animals.
+
+Null stats are not aggregated, like SQL aggregates do, but the animal is still counted.
+In lazy stats mode, the aggregates are the stored stats baselines (see models.stats).
+"""
+
+try:
+    from ._bootstrap import db
+    from .animals import Animal
+    from .species import Species
+except SystemError:  # in case we call this module directly (doctest)
+    from _bootstrap import db
+    from animals import Animal
+    from species import Species
+
+import sqlalchemy
+
+STATS = ('happy', 'hungry')
+# animals columns the statistics depend on, and tables written (see rollups module)
+COLUMNS = ('species_id',) + STATS
+TABLES = ('species_stats',)
+
+# ids per IN (...) clause, safely under SQLite host parameters limit (999)
+CHUNK_SIZE = 500
+
+
+class SpeciesStats(db.Model):
+    """This class represents the species_stats table, aggregated from the animals table.
+
+    Usage through sqlalchemy :
+    >>> import sqlalchemy
+    >>> engine = sqlalchemy.create_engine('sqlite:///:memory:')
+    >>> Session = sqlalchemy.orm.sessionmaker(bind=engine)
+    >>> session = Session()
+
+    >>> import users, owners  #import other modules to resolve relationships
+    >>> SpeciesStats.metadata.create_all(engine)
+    >>> spec = Species(name='testspecies', happy_rate=5, hunger_rate=23)
+    >>> session.add_all([Animal(name='a', happy=4, hungry=40, species=spec), Animal(name='b', happy=8, species=spec)])
+    >>> session.commit()
+    >>> stats = session.query(SpeciesStats).get(spec.id)
+    >>> stats.count, stats.happy_avg, stats.happy_min, stats.happy_max, stats.hungry_avg
+    (2, 6.0, 4, 8, 20.0)
+
+    >>> session.delete(session.query(Animal).filter_by(name='a').one())
+    >>> session.commit()
+    >>> stats.count, stats.happy_avg, stats.happy_min, stats.happy_max, stats.hungry_avg
+    (1, 8.0, 8, 8, 0.0)
+    """
+
+    __tablename__ = 'species_stats'
+
+    species_id = db.Column(db.Integer, db.ForeignKey('species.id'), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)  # animals
+    happy_count = db.Column(db.Integer, nullable=False, default=0)  # animals with a happy stat
+    happy_sum = db.Column(db.BigInteger, nullable=False, default=0)
+    happy_min = db.Column(db.Integer)
+    happy_max = db.Column(db.Integer)
+    hungry_count = db.Column(db.Integer, nullable=False, default=0)  # animals with a hungry stat
+    hungry_sum = db.Column(db.BigInteger, nullable=False, default=0)
+    hungry_min = db.Column(db.Integer)
+    hungry_max = db.Column(db.Integer)
+
+    @classmethod
+    def empty(cls, species_id):
+        """The statistics of a species without animals"""
+        return cls(species_id=species_id, count=0, happy_count=0, happy_sum=0, hungry_count=0, hungry_sum=0)
+
+    @property
+    def happy_avg(self):
+        return self.happy_sum / self.happy_count if self.happy_count else None
+
+    @property
+    def hungry_avg(self):
+        return self.hungry_sum / self.hungry_count if self.hungry_count else None
+
+    def __repr__(self):
+        return "<SpeciesStats: {} {}>".format(self.species_id, self.count)
+
+
+def _aggregates(species_ids=None):
+    """SELECT of the species_stats rows, computed from the animals"""
+    animals = Animal.__table__
+    columns = [animals.c.species_id, sqlalchemy.func.count().label('count')]
+    for stat in STATS:
+        column = animals.c[stat]
+        columns += [
+            sqlalchemy.func.count(column).label(stat + '_count'),
+            sqlalchemy.func.coalesce(sqlalchemy.func.sum(column), 0).label(stat + '_sum'),
+            sqlalchemy.func.min(column).label(stat + '_min'),
+            sqlalchemy.func.max(column).label(stat + '_max'),
+        ]
+    select = sqlalchemy.select(columns).group_by(animals.c.species_id)
+    if species_ids is not None:
+        select = select.where(animals.c.species_id.in_(species_ids))
+    return select
+
+
+def refresh(connection, species_ids):
+    """
+    Recomputes the statistics of some species from the animals (O(animals of these species)).
+    :param connection: a connection or a session
+    :param species_ids: the species ids
+    """
+    table = SpeciesStats.__table__
+    species_ids = sorted(i for i in set(species_ids) if i is not None)
+    for start in range(0, len(species_ids), CHUNK_SIZE):
+        chunk = species_ids[start:start + CHUNK_SIZE]
+        connection.execute(table.delete().where(table.c.species_id.in_(chunk)))
+        connection.execute(table.insert().from_select([c.name for c in table.c], _aggregates(chunk)))
+
+
+def rebuild(session=None):
+    """
+    Recomputes the whole species_stats table from the animals, and commits.
+    :param session: optional in case flask has not been initialized
+    :return: the number of species with animals
+    """
+    if session is None:
+        session = db.session
+    table = SpeciesStats.__table__
+    try:
+        session.execute(table.delete())
+        count = session.execute(table.insert().from_select([c.name for c in table.c], _aggregates())).rowcount
+        session.commit()
+    except:
+        session.rollback()
+        raise
+    return count
+
+
+def _extreme(column, lowest, added, removed, recompute):
+    """New value of a min (lowest) or max column, after adding and removing values"""
+    expression = column
+    if added:
+        best = min(added) if lowest else max(added)
+        expression = sqlalchemy.case([(column.is_(None) | (column > best if lowest else column < best), best)],
+                                     else_=column)
+    if removed:
+        # a removed value was the extreme : look for the new one (the animals are already written)
+        worst = min(removed) if lowest else max(removed)
+        expression = sqlalchemy.case([(column >= worst if lowest else column <= worst, recompute)],
+                                     else_=expression)
+    return expression
+
+
+def apply(connection, removed=(), added=()):
+    """
+    Applies changes of the animals to the species statistics, once the animals are written.
+    An updated animal is removed with its former values, and added with its new ones.
+    :param connection: a connection or a session
+    :param removed: (species_id, happy, hungry) rows of the former animals
+    :param added: (species_id, happy, hungry) rows of the new animals
+    """
+    deltas = {}
+    for sign, rows in ((-1, removed), (1, added)):
+        for species_id, *values in rows:
+            delta = deltas.setdefault(species_id, {'count': 0, 'stats': {s: [0, 0, [], []] for s in STATS}})
+            delta['count'] += sign
+            for stat, value in zip(STATS, values):
+                if value is not None:
+                    stat_delta = delta['stats'][stat]
+                    stat_delta[0] += sign
+                    stat_delta[1] += sign * value
+                    stat_delta[2 if sign > 0 else 3].append(value)
+
+    table, animals = SpeciesStats.__table__, Animal.__table__
+    missing = []
+    for species_id in sorted(i for i in deltas if i is not None):  # same lock order in every transaction
+        delta = deltas[species_id]
+        values = {'count': table.c.count + delta['count']}
+        for stat, (count, total, added_values, removed_values) in delta['stats'].items():
+            values[stat + '_count'] = table.c[stat + '_count'] + count
+            values[stat + '_sum'] = table.c[stat + '_sum'] + total
+            for suffix, function, lowest in (('_min', sqlalchemy.func.min, True), ('_max', sqlalchemy.func.max, False)):
+                recompute = sqlalchemy.select([function(animals.c[stat])]) \
+                    .where(animals.c.species_id == species_id).as_scalar()
+                values[stat + suffix] = _extreme(table.c[stat + suffix], lowest, added_values, removed_values,
+                                                 recompute)
+        update = table.update().where(table.c.species_id == species_id).values(values)
+        result = connection.execute(update)
+        if result.rowcount:
+            continue
+        if any(stat_delta[3] for stat_delta in delta['stats'].values()) or delta['count'] < 0:
+            missing.append(species_id)  # removing animals that were not aggregated : out of sync
+            continue
+        # first animals of the species (the animals table may hold more new animals already, not aggregated yet)
+        row = {'species_id': species_id, 'count': delta['count']}
+        for stat, (count, total, added_values, _) in delta['stats'].items():
+            row.update({stat + '_count': count, stat + '_sum': total,
+                        stat + '_min': min(added_values, default=None), stat + '_max': max(added_values, default=None)})
+        try:
+            with connection.begin_nested():  # the transaction goes on after a failed insert
+                connection.execute(table.insert().values(row))
+        except sqlalchemy.exc.IntegrityError:  # a concurrent transaction inserted the species row first
+            connection.execute(update)
+    refresh(connection, missing)
+
+
+@sqlalchemy.event.listens_for(Species, 'after_delete')
+def _species_deleted(mapper, connection, target):
+    table = SpeciesStats.__table__
+    connection.execute(table.delete().where(table.c.species_id == target.id))
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
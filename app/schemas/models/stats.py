@@ -0,0 +1,140 @@
+"""
+Animal stats evolution over time, from their species rates.
+
+Species rates are given per SIMULATION_RATE_PERIOD (in seconds, one hour by default) :
+ - happy decreases by happy_rate per period
+ - hungry increases by hunger_rate per period
+Stats are kept in the SQL INTEGER range.
+The time elapsed is counted from the animal stats clock (stats_updated_at), which only the simulation ticks
+and the writes setting (or, in lazy stats mode, rebasing) the stats move : other writes do not lose the decay.
+
+The same computation is used :
+ - by the simulation engine, on numpy arrays, to write the new stats periodically
+ - in lazy stats mode (LAZY_STATS), on one animal, to derive its current stats when reading it
+The simulation only writes the whole changes (whole_changes) : it moves the clock by the time they account for,
+and the rest of the elapsed time carries over to the next tick, however frequent the ticks are. The stats written
+lag by less than a step (the rates period over the gcd of the rates), both stats sharing one clock.
+"""
+
+import datetime
+import math
+
+import numpy as np
+import sqlalchemy
+from flask import current_app, has_app_context
+
+# SQL INTEGER range
+STAT_MIN = -2147483648
+STAT_MAX = 2147483647
+
+DEFAULT_RATE_PERIOD = 3600
+
+
+def advance(happy, hungry, happy_rate, hunger_rate, elapsed, period):
+    """
+    Computes the stats after some elapsed time, element-wise on numpy arrays.
+    >>> happy, hungry = advance(np.array([50, 0]), np.array([50, 0]), 2, 4, np.array([1800, 7200]), 3600)
+    >>> happy.tolist(), hungry.tolist()
+    ([49, -4], [52, 8])
+
+    :param happy: happy stats at the start
+    :param hungry: hungry stats at the start
+    :param happy_rate: happy decrease per period
+    :param hunger_rate: hungry increase per period
+    :param elapsed: elapsed times, in seconds
+    :param period: the rates period, in seconds
+    :return: a tuple (happy, hungry), truncated to integers
+    """
+    periods = np.asarray(elapsed, dtype=np.float64) / period
+    new_happy = np.clip(happy - np.trunc(periods * happy_rate), STAT_MIN, STAT_MAX).astype(np.int64)
+    new_hungry = np.clip(hungry + np.trunc(periods * hunger_rate), STAT_MIN, STAT_MAX).astype(np.int64)
+    return new_happy, new_hungry
+
+
+def advance_one(happy, hungry, happy_rate, hunger_rate, elapsed, period):
+    """
+    Computes the stats of one animal after some elapsed time, like advance() does, without numpy overhead.
+    >>> advance_one(50, 50, 2, 4, 1800, 3600)
+    (49, 52)
+    >>> advance_one(0, 0, 2, 4, 7200, 3600)
+    (-4, 8)
+    """
+    periods = float(elapsed) / period
+    new_happy = min(max(happy - math.trunc(periods * happy_rate), STAT_MIN), STAT_MAX)
+    new_hungry = min(max(hungry + math.trunc(periods * hunger_rate), STAT_MIN), STAT_MAX)
+    return new_happy, new_hungry
+
+
+def whole_changes(happy_rate, hunger_rate, elapsed, period):
+    """
+    Changes of the stats over the whole steps of some elapsed times, element-wise on numpy arrays.
+    Over a step, both stats change by whole numbers (period / gcd of the rates) : the time left over is not
+    accounted for, its changes are not lost but carried over.
+    >>> happy, hungry, used = whole_changes(2, 4, np.array([60, 1800, 5000]), 3600)
+    >>> happy.tolist(), hungry.tolist(), used.tolist()
+    ([0, -1, -2], [0, 2, 4], [0.0, 1800.0, 3600.0])
+
+    :param happy_rate: happy decrease per period
+    :param hunger_rate: hungry increase per period
+    :param elapsed: elapsed times, in seconds
+    :param period: the rates period, in seconds
+    :return: a tuple (happy changes, hungry changes, seconds used), the changes as integers
+    """
+    divisor = math.gcd(int(happy_rate), int(hunger_rate)) or 1
+    step = float(period) / divisor
+    steps = np.floor(np.asarray(elapsed, dtype=np.float64) / step).astype(np.int64)
+    return -steps * (int(happy_rate) // divisor), steps * (int(hunger_rate) // divisor), steps * step
+
+
+def clipped(value):
+    """SQL expression of a stat kept in the SQL INTEGER range, for relative updates (stat + delta)"""
+    return sqlalchemy.case([(value < STAT_MIN, STAT_MIN), (value > STAT_MAX, STAT_MAX)], else_=value)
+
+
+def elapsed_seconds(now, dates):
+    """
+    Elapsed seconds since each date, as a numpy array (None meaning no time elapsed, future dates too).
+    Dates can be datetimes, or ISO format strings as stored by SQLite (much faster to parse with numpy).
+    >>> now = datetime.datetime(2018, 3, 8, 18, 53, 52)
+    >>> elapsed_seconds(now, ['2018-03-08 17:53:52.500000', None, '2018-03-09 00:00:00']).tolist()
+    [3599.5, 0.0, 0.0]
+    >>> elapsed_seconds(now, [datetime.datetime(2018, 3, 8, 18, 53, 51)]).tolist()
+    [1.0]
+    """
+    if any(isinstance(d, str) for d in dates):
+        stamps = np.array([d if d is not None else now.isoformat() for d in dates], dtype='datetime64[us]')
+        elapsed = (np.datetime64(now, 'us') - stamps) / np.timedelta64(1, 's')
+    else:
+        # much faster than numpy own datetime64 conversion of datetimes
+        elapsed = np.array([(now - d).total_seconds() if d is not None else 0.0 for d in dates], dtype=np.float64)
+    return np.maximum(elapsed, 0)
+
+
+def later_dates(dates, seconds):
+    """
+    Dates moved forward, to the microsecond.
+    >>> later_dates(['2018-03-08 17:53:52.500000', datetime.datetime(2018, 3, 8)], np.array([0.25, 3600]))
+    [datetime.datetime(2018, 3, 8, 17, 53, 52, 750000), datetime.datetime(2018, 3, 8, 1, 0)]
+
+    :param dates: datetimes, or ISO format strings (see elapsed_seconds)
+    :param seconds: the times to add, in seconds
+    :return: a list of datetimes
+    """
+    stamps = np.array(dates, dtype='datetime64[us]')
+    return (stamps + np.round(np.asarray(seconds, dtype=np.float64) * 1e6).astype('timedelta64[us]')).tolist()
+
+
+def lazy_stats_enabled():
+    """Whether stats are derived when read (LAZY_STATS), instead of written by the simulation"""
+    return has_app_context() and current_app.config.get('LAZY_STATS', False)
+
+
+def rate_period():
+    """The species rates period, in seconds"""
+    return current_app.config.get('SIMULATION_RATE_PERIOD', DEFAULT_RATE_PERIOD) if has_app_context() \
+        else DEFAULT_RATE_PERIOD
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
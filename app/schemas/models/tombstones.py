@@ -0,0 +1,116 @@
+"""
+Tombstones of the deleted rows, so clients syncing changes (see sync module) learn about deletions too.
+
+Each ORM delete of a tracked model (Animal.delete(), Owner.delete(), session.delete(...)) writes a tombstone,
+in the same transaction. Core statements and bulk operations do not go through the ORM events, and have to
+bury the ids they delete themselves (bury_where, before a set-based DELETE).
+purge removes the tombstones older than the retention (flask purge-tombstones command) : clients which did not
+sync since have to download everything again.
+"""
+
+try:
+    from ._bootstrap import db
+except SystemError:  # in case we call this module directly (doctest)
+    from _bootstrap import db
+
+import sqlalchemy
+
+TABLES = ('tombstones',)
+
+# ids per INSERT, safely under SQLite host parameters limit (999)
+CHUNK_SIZE = 300
+
+
+class Tombstone(db.Model):
+    """This class represents the tombstones table, one row per deleted row of a tracked table.
+
+    Usage through sqlalchemy :
+    >>> import sqlalchemy
+    >>> engine = sqlalchemy.create_engine('sqlite:///:memory:')
+    >>> Session = sqlalchemy.orm.sessionmaker(bind=engine)
+    >>> session = Session()
+
+    >>> import species, users, owners, animals  #import other modules to resolve relationships
+    >>> Tombstone.metadata.create_all(engine)
+    >>> track(species.Species)
+    >>> spec = species.Species(name='testspecies', happy_rate=5, hunger_rate=23)
+    >>> spec.save(session=session)
+    >>> spec_id = spec.id
+    >>> spec.delete(session=session)
+    >>> [(t.table_name, t.row_id == spec_id) for t in session.query(Tombstone)]
+    [('species', True)]
+    """
+
+    __tablename__ = 'tombstones'
+    __table_args__ = (
+        db.Index('ix_tombstones_table_name_date_deleted', 'table_name', 'date_deleted'),  # deletions since
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(64), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    date_deleted = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
+
+    def __repr__(self):
+        return "<Tombstone: {} {}>".format(self.table_name, self.row_id)
+
+
+def bury(connection, table, ids):
+    """
+    Writes the tombstones of deleted rows.
+    :param connection: a connection or a session
+    :param table: the table name
+    :param ids: the deleted rows ids
+    """
+    ids = list(ids)
+    for start in range(0, len(ids), CHUNK_SIZE):
+        connection.execute(Tombstone.__table__.insert(), [{'table_name': table, 'row_id': id}
+                                                         for id in ids[start:start + CHUNK_SIZE]])
+
+
+def bury_where(connection, table, criterion):
+    """
+    Writes the tombstones of the rows about to be deleted, in one INSERT ... SELECT.
+    :param connection: a connection or a session
+    :param table: the table
+    :param criterion: the WHERE clause of the DELETE
+    """
+    select = sqlalchemy.select([sqlalchemy.literal(table.name), table.c.id]).where(criterion)
+    connection.execute(Tombstone.__table__.insert().from_select(['table_name', 'row_id'], select))
+
+
+def purge(before, session=None):
+    """
+    Removes the tombstones older than a date, and commits.
+    :param before: the (UTC) date
+    :param session: optional in case flask has not been initialized
+    :return: the number of tombstones removed
+    """
+    if session is None:
+        session = db.session
+    try:
+        count = session.execute(Tombstone.__table__.delete().where(Tombstone.date_deleted < before)).rowcount
+        session.commit()
+    except:
+        session.rollback()
+        raise
+    return count
+
+
+def _deleted(mapper, connection, target):
+    bury(connection, mapper.local_table.name, [target.id])
+
+
+def track(*models):
+    """
+    Writes a tombstone on each ORM delete
+    :param models: the model classes
+    """
+    for model in models:
+        if not sqlalchemy.event.contains(model, 'after_delete', _deleted):
+            sqlalchemy.event.listen(model, 'after_delete', _deleted)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
@@ -48,7 +48,7 @@ class User(db.Model):
     date_created = db.Column(db.DateTime, default=db.func.current_timestamp())
     date_modified = db.Column(
         db.DateTime, default=db.func.current_timestamp(),
-        onupdate=db.func.current_timestamp())
+        onupdate=db.func.current_timestamp(), index=True)  # delta sync (see sync module)
 
     # https://github.com/klen/mixer#support-for-flask-sqlalchemy-models-that-have-init-arguments
     # def __init__(self, nick, email):
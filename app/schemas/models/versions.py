@@ -0,0 +1,85 @@
+"""
+Per table version counters, for caches depending on tables content.
+
+Each ORM insert, update or delete bumps the version of the model table, once when the row is flushed,
+and once more when the session commits : a cache entry computed in between, from the data committed
+before, is then not used anymore. Core statements and bulk operations do not go through the ORM events,
+and have to bump the versions themselves.
+
+The counters are kept in memory : they only see the writes of the current process.
+
+Usage :
+>>> before = version('animals')
+>>> bump('animals')
+>>> version('animals') == before + 1
+True
+>>> versions(['animals', 'species']) == (before + 1, version('species'))
+True
+"""
+
+import collections
+import threading
+
+import sqlalchemy
+
+_versions = collections.Counter()
+_lock = threading.Lock()
+
+
+def version(table):
+    """
+    :param table: a table name
+    :return: the current version of the table
+    """
+    return _versions[table]
+
+
+def versions(tables):
+    """
+    :param tables: table names
+    :return: a tuple of the tables current versions
+    """
+    return tuple(_versions[t] for t in tables)
+
+
+def bump(*tables):
+    """
+    Changes the versions of tables
+    :param tables: table names
+    """
+    with _lock:
+        for t in tables:
+            _versions[t] += 1
+
+
+def _changed(mapper, connection, target):
+    table = mapper.local_table.name
+    bump(table)
+    session = sqlalchemy.orm.object_session(target)
+    if session is not None:
+        session.info.setdefault('changed_tables', set()).add(table)
+
+
+@sqlalchemy.event.listens_for(sqlalchemy.orm.Session, 'after_commit')
+def _committed(session):
+    bump(*session.info.pop('changed_tables', ()))
+
+
+@sqlalchemy.event.listens_for(sqlalchemy.orm.Session, 'after_soft_rollback')
+def _rolled_back(session, previous_transaction):
+    bump(*session.info.pop('changed_tables', ()))
+
+
+def track(*models):
+    """
+    Bumps the tables versions on each ORM write
+    :param models: the model classes
+    """
+    for model in models:
+        for event in ('after_insert', 'after_update', 'after_delete'):
+            sqlalchemy.event.listen(model, event, _changed)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
@@ -60,8 +60,16 @@ class OwnerSchema(ma.ModelSchema):
     >>> import pprint  #ordering dict output
     >>> pprint.pprint(dump_data)  # doctest: +ELLIPSIS
     {'id': 1,
-     'pets': [{'name': 'testanimal', 'species': {'name': 'testspecies'}}],
-     'user': {'email': 'tester@comp.any', 'id': 1, 'nick': 'testuser'}}
+     'pet_count': 1,
+     'pets': [{'happy': 0,
+               'hungry': 0,
+               'id': 1,
+               'name': 'testanimal',
+               'owner_id': 1,
+               'species': {...},
+               'species_id': 1}],
+     'user': {'email': 'tester@comp.any', 'id': 1, 'nick': 'testuser'},
+     'user_id': 1}
 
     >>> owner_schema.load(dump_data, session=session).data  # check invertibility
     <Owner: <User: testuser> [<Animal: testanimal>]>
@@ -69,13 +77,13 @@ class OwnerSchema(ma.ModelSchema):
 
 
     class Meta:
-        fields = ('id', 'user', 'pets', 'user_id')
-        load_only = ('user_id',)
-        dump_only = ('id', 'user')
+        fields = ('id', 'user', 'pets', 'user_id', 'pet_count')
+        dump_only = ('id', 'user', 'pet_count')
         model = Owner
 
     #fields.Nested(UserSchema, only=["nick", "email"])
-    pets = fields.Nested(AnimalSchema, many=True, load_only=["species_id"], dump_only=["species"])
+    # indirect nested relation to avoid cycle
+    pets = fields.Nested(AnimalSchema, many=True, exclude=('owner', ))
 
     user = fields.Nested(UserSchema, dump_only=True)
 
@@ -1,14 +1,14 @@
 try:
     from ._bootstrap import ma
-    from .models import Species
+    from .models import Species, SpeciesStats
 except SystemError:  # in case we call this module directly (doctest)
     from _bootstrap import ma
-    from models import Species
+    from models import Species, SpeciesStats
 
 
 import http
 
-from marshmallow import post_load
+from marshmallow import post_load, fields
 
 from sqlalchemy_utils import PasswordType, EmailType, UUIDType, ColorType  #,NumericRangeType
 from flask import jsonify, request
@@ -36,14 +36,14 @@ class SpeciesSchema(ma.ModelSchema):
     >>> dump_data = species_schema.dump(species_data).data
     >>> import pprint  #ordering dict output
     >>> pprint.pprint(dump_data)  # doctest: +ELLIPSIS
-    {'happy_rate': 5, 'hunger_rate': 23, 'id': 1, 'name': 'testspecies'}
+    {'happy_rate': 5, 'hunger_rate': 23, 'id': 1, 'member_count': 0, 'name': 'testspecies'}
 
     >>> species_schema.load(dump_data, session=session).data  # check invertibility
     <Species: testspecies>
     """
     class Meta:
-        fields = ('id', 'name', 'happy_rate', 'hunger_rate')
-        dump_only = ('id', )
+        fields = ('id', 'name', 'happy_rate', 'hunger_rate', 'member_count')
+        dump_only = ('id', 'member_count')
         model = Species
 
     # author = ma.Nested(AuthorSchema)
@@ -61,6 +61,34 @@ species_schema = SpeciesSchema()
 # species_schema = SpeciesSchema(many=True)
 
 
+class SpeciesStatsSchema(ma.ModelSchema):
+    """
+    Aggregate statistics of the animals of a species (see models.species_stats), read only.
+    >>> stats = SpeciesStats(species_id=1, count=2, happy_count=2, happy_sum=12, happy_min=4, happy_max=8,
+    ...                      hungry_count=0, hungry_sum=0)
+    >>> import pprint  #ordering dict output
+    >>> pprint.pprint(species_stats_schema.dump(stats).data)
+    {'count': 2,
+     'happy_avg': 6.0,
+     'happy_max': 8,
+     'happy_min': 4,
+     'hungry_avg': None,
+     'hungry_max': None,
+     'hungry_min': None,
+     'species_id': 1}
+    """
+    class Meta:
+        fields = ('species_id', 'count', 'happy_avg', 'happy_min', 'happy_max', 'hungry_avg', 'hungry_min', 'hungry_max')
+        dump_only = fields
+        model = SpeciesStats
+
+    happy_avg = fields.Float(dump_only=True)
+    hungry_avg = fields.Float(dump_only=True)
+
+
+species_stats_schema = SpeciesStatsSchema()
+
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod(verbose=True)
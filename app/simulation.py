@@ -0,0 +1,126 @@
+"""
+Pet stats simulation engine.
+
+Stats evolve with the species rates (see models.stats).
+A tick advances every animal by the time elapsed since its stats were last brought up to date (stats_updated_at :
+the other writes, actions included, do not reset it).
+Animals are processed species by species, in chunks of SIMULATION_CHUNK_SIZE rows :
+their stats clocks are loaded as a numpy array, the changes are computed for the whole chunk at once,
+and written with one executemany UPDATE.
+Only the whole changes are written, the stats clock moves by the time they account for (see models.stats) :
+the rest carries over to the next tick. The changes are added to the stats (happy = happy + :change), and the chunk
+rows are locked (SELECT ... FOR UPDATE) until the tick commits : concurrent actions and edits are not overwritten.
+The changes are journaled ('decay' events, see models.journal), in the same transaction.
+A tick is bounded by a time budget. When the budget is exhausted, it returns a cursor to resume from.
+"""
+
+import collections
+import datetime
+import time
+
+import sqlalchemy
+
+try:
+    from .schemas import models
+    from .schemas.models import changes, journal, versions
+    from .schemas.models.stats import clipped, elapsed_seconds, later_dates, whole_changes
+except SystemError:  # in case we call this module directly (doctest)
+    from schemas import models
+    from schemas.models import changes, journal, versions
+    from schemas.models.stats import clipped, elapsed_seconds, later_dates, whole_changes
+
+# number of animals changed, and cursor (species_id, animal_id) to resume from, None when the tick is complete
+TickResult = collections.namedtuple('TickResult', ['updated', 'resume'])
+
+
+def tick_species(session, species_id, happy_rate, hunger_rate, now, period, chunk_size, after=0, deadline=None):
+    """
+    Advances all the animals of one species.
+    :return: a tuple (changed, last id) where last id is None when the species is complete
+    """
+    table = models.Animal.__table__
+    select = sqlalchemy.select([
+        table.c.id,
+        sqlalchemy.type_coerce(table.c.stats_updated_at, sqlalchemy.String),  # parsed with numpy (see stats)
+    ]).where(table.c.species_id == species_id).where(table.c.id > sqlalchemy.bindparam('after')) \
+        .order_by(table.c.id).limit(chunk_size).with_for_update()
+    update = table.update().where(table.c.id == sqlalchemy.bindparam('b_id')).values(
+        happy=clipped(sqlalchemy.func.coalesce(table.c.happy, 0) + sqlalchemy.bindparam('b_happy')),
+        hungry=clipped(sqlalchemy.func.coalesce(table.c.hungry, 0) + sqlalchemy.bindparam('b_hungry')),
+        stats_updated_at=sqlalchemy.bindparam('b_clock'),
+    )
+
+    changed = 0
+    while True:
+        rows = session.execute(select, {'after': after}).fetchall()
+        if not rows:
+            return changed, None
+        ids, dates = zip(*rows)
+
+        happy, hungry, used = whole_changes(happy_rate, hunger_rate, elapsed_seconds(now, dates), period)
+        moved = used.nonzero()[0].tolist()
+        clocks = dict(zip(moved, later_dates([dates[i] for i in moved], used[moved])))
+        params = [{'b_id': ids[i], 'b_happy': int(happy[i]), 'b_hungry': int(hungry[i]),
+                   'b_clock': clocks[i] if dates[i] is not None else now}  # starts the clock
+                  for i in range(len(ids)) if i in clocks or dates[i] is None]
+        if params:
+            session.execute(update, params)
+            journal.record(session, [(p['b_id'], 'decay', {'happy': p['b_happy'], 'hungry': p['b_hungry']})
+                                     for p in params if p['b_happy'] or p['b_hungry']])
+        changed += len(params)
+        after = ids[-1]
+        if deadline is not None and time.monotonic() > deadline:
+            return changed, after
+
+
+def tick(session=None, period=3600, chunk_size=10000, budget=None, resume=None, now=None):
+    """
+    Advances all animals stats, by the time elapsed since their stats clock.
+    :param session: optional in case flask has not been initialized
+    :param period: the species rates period, in seconds
+    :param chunk_size: number of animals computed and updated at once
+    :param budget: optional time budget, in seconds
+    :param resume: the cursor returned by a previous, unfinished, tick
+    :param now: the current (UTC) time, defaults to now
+    :return: a TickResult
+    """
+    if session is None:
+        session = models.db.session
+    now = now or datetime.datetime.utcnow()
+    deadline = time.monotonic() + budget if budget is not None else None
+    resume_species, resume_after = resume or (None, 0)
+
+    species = models.Species.__table__
+    query = sqlalchemy.select([species.c.id, species.c.happy_rate, species.c.hunger_rate]).order_by(species.c.id)
+    if resume_species is not None:
+        query = query.where(species.c.id >= resume_species)
+
+    updated = 0
+    try:
+        for species_id, happy_rate, hunger_rate in session.execute(query).fetchall():
+            after = resume_after if species_id == resume_species else 0
+            if not happy_rate and not hunger_rate:
+                continue  # nothing changes for this species
+            count, last = tick_species(session, species_id, happy_rate or 0, hunger_rate or 0, now, period,
+                                       chunk_size, after=after, deadline=deadline)
+            updated += count
+            if count:  # core updates skip the ORM events, the species was scanned anyway
+                models.species_stats.refresh(session, [species_id])
+            if last is not None:
+                changes.resync(session)  # too many rows for the change feed
+                session.commit()
+                return TickResult(updated, (species_id, last))
+        if updated:
+            changes.resync(session)
+        session.commit()
+    except:
+        session.rollback()
+        raise
+    finally:  # core updates skip the ORM events
+        versions.bump(models.Animal.__table__.name, *models.species_stats.TABLES, *journal.TABLES)
+    return TickResult(updated, None)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
@@ -1,7 +1,17 @@
 try:
-    from .schemas import models, species_schema
+    from .schemas import models, species_schema, species_dumper, species_stats_schema, apply_loading_plan, cache
+    from . import bulk, caching, conditional, fieldsets, multiget, negotiation, pagination, streaming, sync
 except SystemError:  # in case we call this module directly (doctest)
-    from schemas import models, species_schema
+    from schemas import models, species_schema, species_dumper, species_stats_schema, apply_loading_plan, cache
+    import bulk
+    import caching
+    import conditional
+    import fieldsets
+    import multiget
+    import negotiation
+    import pagination
+    import streaming
+    import sync
 
 
 import http
@@ -13,15 +23,33 @@ from flask import jsonify, request
 
 
 
+@caching.cached_response('species')
 def species():
     """
-    Retrieves all species
+    Retrieves a page of species
+    (see pagination module for limit and after parameters, streaming module for full dumps, multiget module for ids,
+    sync module for modified_since, fieldsets module for sparse dumps)
     :return:
     """
-    all_species = models.Species.all()
-    user_dict, errors = species_schema.dump(all_species, many=True)
+    try:
+        schema, dumper = fieldsets.sparse(species_schema, species_dumper)
+        query = apply_loading_plan(models.Species.query, schema)
+        ids = multiget.ids_args()
+        if ids is not None:
+            return multiget.multi_get(query, models.Species.id, dumper, ids)
+        since = sync.since_args()
+        fmt = streaming.stream_format()
+        if since is not None:
+            return sync.changes(query, models.Species, dumper, since, fmt)
+        if fmt:
+            return streaming.stream_collection(query, dumper, models.Species.id, fmt)
+        page = pagination.keyset_page(query, models.Species.id)
+    except (fieldsets.FieldsError, multiget.MultiGetError, pagination.PaginationError,
+            streaming.StreamingError, sync.SyncError) as e:
+        return e.args[0], http.HTTPStatus.BAD_REQUEST
+    user_dict, errors = dumper.dump(page.items, many=True)
     if not errors:
-        return user_dict
+        return user_dict, http.HTTPStatus.OK, pagination.page_headers(page)
     else:  # break properly
         return '', http.HTTPStatus.INTERNAL_SERVER_ERROR
 
@@ -29,15 +57,27 @@ def species():
 def species_read(id):
     """
     Retrieve a species
+    (answers 304 Not Modified to If-None-Match and If-Modified-Since, see conditional module)
     :param id: the species id
     :return:
     """
-    species = models.Species.query.get(id)
+    try:
+        schema, dumper = fieldsets.sparse(species_schema, species_dumper)
+    except fieldsets.FieldsError as e:
+        return e.args[0], http.HTTPStatus.BAD_REQUEST
+    row = models.db.session.query(models.Species.id, models.Species.date_modified) \
+        .filter(models.Species.id == id).first()
+    if row is None:
+        return '', http.HTTPStatus.NOT_FOUND
+    validators = conditional.make_validators(row[0], row[1:], variant=fieldsets.variant_key())
+    if conditional.not_modified(validators):
+        return '', http.HTTPStatus.NOT_MODIFIED, conditional.headers(validators)
+    species = apply_loading_plan(models.Species.query, schema).get(id)
     if not species:
         return '', http.HTTPStatus.NOT_FOUND
-    species_dict, errors = species_schema.dump(species)
+    species_dict, errors = dumper.dump(species)
     if not errors:
-        return species_dict
+        return species_dict, http.HTTPStatus.OK, conditional.headers(validators)
     else:  # break properly
         return '', http.HTTPStatus.INTERNAL_SERVER_ERROR
 
@@ -58,16 +98,21 @@ def species_edit(id):
     :param id:
     :return:
     """
-    data = request.get_json()
+    data = negotiation.request_data()
+    try:
+        dumper = fieldsets.sparse(species_schema, species_dumper)[1]
+    except fieldsets.FieldsError as e:
+        return e.args[0], http.HTTPStatus.BAD_REQUEST
     user = models.Species.query.get(id)
 
     if not user:
         return '', http.HTTPStatus.NOT_FOUND
 
+    cache.invalidate_species(user.id, user.name)
     for k, v in data.items():
         setattr(user, k, v)
 
-    species_dict, errors = species_schema.dump(user)
+    species_dict, errors = dumper.dump(user)
     if not errors:
         return species_dict
     else:  # break properly
@@ -77,14 +122,23 @@ def species_edit(id):
 def species_add():
     """
     Adds a species
+    (or many at once from a JSON array, see bulk module)
     :return:
     """
-    data = request.get_json()
+    data = negotiation.request_data()
+    try:
+        dumper = fieldsets.sparse(species_schema, species_dumper)[1]
+    except fieldsets.FieldsError as e:
+        return e.args[0], http.HTTPStatus.BAD_REQUEST
+    if isinstance(data, list):
+        return bulk.bulk_add(species_schema)
+
     user, errors = species_schema.load(data, )
     if not errors:
         user.save()
+        cache.invalidate_species(user.id, user.name)
 
-    user_dict, errors = species_schema.dump(user)
+    user_dict, errors = dumper.dump(user)
     if not errors:
         return user_dict, http.HTTPStatus.CREATED
     else:  # break properly
@@ -94,15 +148,62 @@ def species_add():
 def species_delete(id):
     """
     Deletes a species
+    (with a cascade parameter for its members, reject by default, or delete, see models.cascades)
     :param id:
     :return:
     """
     species = models.Species.query.get(id)
-    if species:
-        species.delete()
-        return '', http.HTTPStatus.NO_CONTENT
-    else:
+    if not species:
+        return '', http.HTTPStatus.NOT_FOUND
+    species_id, name = species.id, species.name
+    try:
+        models.cascades.delete(models.Species, species_id, cascade=request.args.get('cascade'))
+    except models.cascades.CascadeError as e:
+        return e.args[0], http.HTTPStatus.BAD_REQUEST
+    except models.cascades.DependentsError as e:
+        return e.args[0], http.HTTPStatus.CONFLICT
+    cache.invalidate_species(species_id, name)
+    return '', http.HTTPStatus.NO_CONTENT
+
+
+def species_stats():
+    """
+    Retrieves the animals statistics of all species, from the species_stats rollup (see models.species_stats)
+    :return:
+    """
+    rollups = {s.species_id: s for s in models.SpeciesStats.query}
+    stats = [rollups.get(id) or models.SpeciesStats.empty(id)
+             for id, in models.db.session.query(models.Species.id).order_by(models.Species.id)]
+    stats_dict, errors = species_stats_schema.dump(stats, many=True)
+    if not errors:
+        return stats_dict, http.HTTPStatus.OK
+    else:  # break properly
+        return '', http.HTTPStatus.INTERNAL_SERVER_ERROR
+
+
+def species_stats_read(id):
+    """
+    Retrieves the animals statistics of a species, from the species_stats rollup (see models.species_stats)
+    :param id: the species id
+    :return:
+    """
+    if not models.db.session.query(models.Species.id).filter(models.Species.id == id).first():
         return '', http.HTTPStatus.NOT_FOUND
+    stats = models.SpeciesStats.query.get(id) or models.SpeciesStats.empty(int(id))
+    stats_dict, errors = species_stats_schema.dump(stats)
+    if not errors:
+        return stats_dict, http.HTTPStatus.OK
+    else:  # break properly
+        return '', http.HTTPStatus.INTERNAL_SERVER_ERROR
+
+
+def species_cache_stats():
+    """
+    Species cache counters, for monitoring
+    :return:
+    """
+    species_cache = cache.species_cache()
+    return species_cache.stats()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,121 @@
+"""
+Server-Sent Events : the animals change feed, pushed to dashboards instead of having them poll the collection.
+
+GET /api/animals/stream (text/event-stream) subscribes to the change hub (see models.changes) :
+ - owner_id and species_id filters (=value, or __in=value,value,...) : only the changes of these animals
+   (an animal moved to another owner or species is sent to the subscribers of both)
+ - each event has the hub sequence as id, the change kind as type (create, update, delete), and the animal,
+   as written, as JSON data :
+
+    id: 42
+    event: update
+    data: {"id": 7, "name": "rex", "happy": 12, "hungry": 3, "owner_id": 2, "species_id": 1}
+
+ - a resync event tells the client it missed changes (its queue overflowed, it reconnected with a Last-Event-ID,
+   or a bulk write changed too many rows) : it should sync the animals again (see sync module).
+ - a comment is sent every SSE_HEARTBEAT seconds without changes, to keep the connection through proxies,
+   and to notice the disconnected clients.
+Each stream holds a worker thread while it lasts, the hub accepts SSE_MAX_SUBSCRIBERS of them (503 beyond) :
+the server needs threaded workers, with more threads than that (gunicorn gthread workers, see Procfile).
+A sync worker would be held by one stream, and killed at its timeout.
+"""
+
+import http
+import json
+
+from flask import Response, current_app, request
+from marshmallow import fields
+
+try:
+    from .schemas.models import changes
+    from . import filters
+except SystemError:  # in case we call this module directly (doctest)
+    from schemas.models import changes
+    import filters
+
+OPERATORS = ('eq', 'in')
+INTEGER_MESSAGE = fields.Integer.default_error_messages['invalid']
+
+
+def parse_keys(schema, args=None):
+    """
+    Parses the stream filters.
+    :param schema: the schema validating the values
+    :param args: the request args (defaults to flask request.args)
+    :return: a dict {key: set of values}
+    """
+    args = request.args if args is None else args
+    keys, errors = {}, {}
+    for name, operator, value in filters.parse_filters(schema, changes.KEYS, args):
+        param = name if operator == 'eq' else '{}__{}'.format(name, operator)
+        if operator not in OPERATORS:
+            errors[param] = ['Unknown filter operator.']
+            continue
+        try:  # matched in python, against the ids as written
+            values = {int(v) for v in (value if operator == 'in' else [value])}
+        except (TypeError, ValueError):
+            errors[param] = [INTEGER_MESSAGE]
+            continue
+        keys[name] = keys[name] & values if name in keys else values
+    if errors:
+        raise filters.FilterError(errors)
+    return keys
+
+
+def matcher(keys):
+    """
+    :param keys: the filters, {key: set of values}
+    :return: the predicate of the changes matching all the filters, None to match everything
+    """
+    if not keys:
+        return None
+    return lambda change: all(change.keys[k] & values for k, values in keys.items())
+
+
+def format_event(event, encoder=None):
+    """
+    >>> format_event(changes.Event(3, 'delete', {'id': 7}))
+    'id: 3\\nevent: delete\\ndata: {"id": 7}\\n\\n'
+    """
+    return 'id: {}\nevent: {}\ndata: {}\n\n'.format(event.id, event.kind, json.dumps(event.data, cls=encoder))
+
+
+def iter_events(subscription, heartbeat, encoder=None, resync=False):
+    """
+    The stream body, until the client disconnects.
+    :param subscription: the hub subscription
+    :param heartbeat: seconds between keep-alive comments
+    :param encoder: optional JSON encoder
+    :param resync: whether to start with a resync event
+    :return: a generator of SSE messages
+    """
+    yield 'retry: {}\n\n'.format(int(heartbeat * 1000))
+    if resync:
+        yield format_event(changes.Event(subscription.hub.last_id, 'resync', {}))
+    while True:
+        event = subscription.get(timeout=heartbeat)
+        yield format_event(event, encoder) if event is not None else ': keep-alive\n\n'
+
+
+def stream(schema):
+    """
+    Change feed view implementation.
+    :param schema: the schema validating the filters
+    :return: a view return value
+    """
+    try:
+        match = matcher(parse_keys(schema))
+    except filters.FilterError as e:
+        return e.args[0], http.HTTPStatus.BAD_REQUEST
+    config = current_app.config
+    try:
+        subscription = changes.hub.subscribe(config['SSE_QUEUE_SIZE'], match, limit=config['SSE_MAX_SUBSCRIBERS'])
+    except changes.HubFullError:
+        return {'_schema': ['Too many subscribers, retry later.']}, http.HTTPStatus.SERVICE_UNAVAILABLE, \
+            {'Retry-After': str(config['SSE_HEARTBEAT'])}
+    body = iter_events(subscription, config['SSE_HEARTBEAT'], current_app.json_encoder,
+                       resync='Last-Event-ID' in request.headers)
+    response = Response(body, mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(subscription.close)  # even when the body was never iterated
+    return response
@@ -0,0 +1,94 @@
+"""
+Streaming responses for full collection dumps (admin, exports).
+
+Instead of loading all the rows and dumping them with `many=True` in one big list,
+the query is iterated with yield_per and the rows are dumped and encoded chunk by chunk,
+from a generator, so the worker memory stays flat whatever the size of the table.
+
+Query parameters :
+ - stream=json : the response body is a (chunked) JSON array
+ - stream=ndjson : the response body is newline delimited JSON, one item per line
+"""
+
+import itertools
+import json
+
+from flask import Response, current_app, request, stream_with_context
+
+STREAM_FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+class StreamingError(ValueError):
+    """Invalid streaming parameters. args[0] is a marshmallow-like errors dict"""
+    pass
+
+
+def stream_format(args=None):
+    """
+    Parses the streaming parameter.
+    :param args: the request args (defaults to flask request.args)
+    :return: the requested stream format, or None if no streaming is requested
+    """
+    args = request.args if args is None else args
+    fmt = args.get('stream')
+    if fmt is not None and fmt not in STREAM_FORMATS:
+        raise StreamingError({'stream': ['Must be one of: {}.'.format(', '.join(sorted(STREAM_FORMATS)))]})
+    return fmt
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    chunk = list(itertools.islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(iterator, size))
+
+
+def iter_dumps(query, schema, key, chunk_size):
+    """
+    Dumps the rows of the query, one chunk at a time.
+    :param query: the query retrieving the rows to dump
+    :param schema: the schema to dump the rows with
+    :param key: the column to order the rows by (usually the primary key)
+    :param chunk_size: the number of rows fetched and dumped at once
+    :return: a generator of lists of dumped items
+    """
+    for rows in _chunks(query.order_by(key).yield_per(chunk_size), chunk_size):
+        data, errors = schema.dump(rows, many=True)
+        if errors:  # too late to change the status, we can only stop here
+            raise RuntimeError("Dump errors while streaming : {}".format(errors))
+        yield data
+
+
+def _encode_json(dumps, encoder):
+    yield '['
+    separator = ''
+    for data in dumps:
+        yield separator + ','.join(json.dumps(item, cls=encoder, ensure_ascii=False) for item in data)
+        separator = ','
+    yield ']'
+
+
+def _encode_ndjson(dumps, encoder):
+    for data in dumps:
+        yield ''.join(json.dumps(item, cls=encoder, ensure_ascii=False) + '\n' for item in data)
+
+
+def stream_collection(query, schema, key, fmt, tail=(), headers=None):
+    """
+    Builds a streamed response dumping all the rows of the query.
+    :param query: the query retrieving the rows to dump
+    :param schema: the schema to dump the rows with
+    :param key: the column to order the rows by (usually the primary key)
+    :param fmt: the stream format
+    :param tail: lists of items to stream after the rows (already dumped)
+    :param headers: optional response headers
+    :return: a flask Response, with a generator as body
+    """
+    dumps = itertools.chain(iter_dumps(query, schema, key, current_app.config['STREAM_CHUNK_SIZE']), tail)
+    encode = _encode_ndjson if fmt == 'ndjson' else _encode_json
+    body = encode(dumps, current_app.json_encoder)
+    return Response(stream_with_context(body), mimetype=STREAM_FORMATS[fmt], headers=headers)
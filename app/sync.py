@@ -0,0 +1,160 @@
+"""
+Delta sync for collection endpoints : only the rows changed since the client last sync, and the deleted ones.
+
+Query parameter :
+ - modified_since : a sync token (or any UTC date, ``2018-03-27T10:00:00``), ``0`` for a first, full, sync
+
+The response lists the rows modified (or created) since, found with the date_modified indexes, and the rows
+deleted since, found in the tombstones (see models.tombstones), as {"id": id, "deleted": true}, in id order.
+It is paginated like the collection (the cursor covers both), or streamed, and other parameters (fields, embed,
+filters) still apply to the modified rows. A new sync token is returned in the `X-Sync-Token` header, of the first
+page : the client keeps it for its next sync, once it went through all the pages.
+
+The token is the server time, set back by SYNC_OVERLAP : a write committing while the client syncs is sent again
+next time, rather than never. Clients apply changes as upserts, and deletions of unknown ids as no-ops.
+Tokens older than TOMBSTONES_RETENTION are refused with 410 Gone, the client has to sync everything again.
+In lazy stats mode, stats drifting with the time passing are not changes (see models.stats).
+"""
+
+try:
+    from .schemas.models import Tombstone
+    from . import pagination, streaming
+except SystemError:  # in case we call this module directly (doctest)
+    from schemas.models import Tombstone
+    import pagination
+    import streaming
+
+import datetime
+import heapq
+import http
+import itertools
+
+import sqlalchemy
+from flask import current_app, request
+
+TOKEN_FORMAT = '%Y-%m-%dT%H:%M:%S'
+SINCE_FORMATS = (TOKEN_FORMAT + '.%f', TOKEN_FORMAT, '%Y-%m-%d')
+# modified_since=0, the client has nothing yet : every row, and no deletions
+BEGINNING = datetime.datetime(1970, 1, 1)
+
+
+class SyncError(ValueError):
+    """Invalid sync parameters. args[0] is a marshmallow-like errors dict"""
+    pass
+
+
+def since_args(args=None):
+    """
+    Parses the modified_since parameter.
+    :param args: the request args (defaults to flask request.args)
+    :return: the (UTC) datetime, None if no delta sync is requested
+    """
+    args = request.args if args is None else args
+    value = args.get('modified_since')
+    if value is None:
+        return None
+    if value == '0':
+        return BEGINNING
+    for fmt in SINCE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise SyncError({'modified_since': ['Not a valid sync token.']})
+
+
+def _since(column, since):
+    """
+    column >= since.
+    SQLite stores the current_timestamp defaults without fraction ('2018-03-27 10:00:00'), which sorts before
+    the bound datetime ('2018-03-27 10:00:00.000000') : compare strictly after the previous microsecond instead.
+    """
+    return column > since - datetime.timedelta(microseconds=1)
+
+
+def deleted_ids(model, since):
+    """
+    :param model: the model class
+    :param since: the (UTC) datetime
+    :return: a select of the ids deleted since, and not created again
+    """
+    tombstones, table = Tombstone.__table__, model.__table__
+    return sqlalchemy.select([tombstones.c.row_id]).distinct().where(sqlalchemy.and_(
+        tombstones.c.table_name == table.name,
+        _since(tombstones.c.date_deleted, since),
+        ~sqlalchemy.exists().where(table.c.id == tombstones.c.row_id),
+    ))
+
+
+def _deleted(id):
+    return {'id': id, 'deleted': True}
+
+
+def _deleted_chunks(session, deleted, chunk_size):
+    result = session.execute(deleted.order_by(Tombstone.__table__.c.row_id))
+    rows = result.fetchmany(chunk_size)
+    while rows:
+        yield [_deleted(id) for id, in rows]
+        rows = result.fetchmany(chunk_size)
+
+
+def changes_page(query, key, deleted, args=None):
+    """
+    Retrieves one page of changes, modified rows and deleted ids merged in id order (see pagination module).
+    :param query: the sqlalchemy query of the modified rows
+    :param key: the id column
+    :param deleted: the select of the deleted ids (see deleted_ids), None for none
+    :param args: the request args (defaults to flask request.args)
+    :return: a Page, of (id, row) items, row is None for deleted ids
+    """
+    limit, after = pagination.page_args(args)
+    row_id = Tombstone.__table__.c.row_id
+    if after is not None:
+        query = query.filter(key > after)
+        deleted = deleted.where(row_id > after) if deleted is not None else None
+
+    rows = query.order_by(key).limit(limit + 1).all()
+    ids = query.session.execute(deleted.order_by(row_id).limit(limit + 1)) if deleted is not None else ()
+    # a deleted id is never a current row : no duplicates
+    items = list(itertools.islice(heapq.merge(((getattr(row, key.key), row) for row in rows),
+                                              ((id, None) for id, in ids), key=lambda item: item[0]), limit + 1))
+    if len(items) > limit:
+        items = items[:limit]
+        return pagination.Page(items, items[-1][0])
+    return pagination.Page(items, None)
+
+
+def changes(query, model, dumper, since, fmt=None):
+    """
+    Delta sync view implementation.
+    :param query: the sqlalchemy query retrieving the collection (with its loading plan)
+    :param model: the model class
+    :param dumper: the schema (or compiled dumper) to dump the rows with
+    :param since: the (UTC) datetime of the client last sync (see since_args)
+    :param fmt: the stream format, None for pages (see streaming module)
+    :return: a view return value
+    """
+    config = current_app.config
+    now = datetime.datetime.utcnow()
+    if since != BEGINNING and since < now - datetime.timedelta(seconds=config['TOMBSTONES_RETENTION']):
+        return {'modified_since': ['Too old, a full sync is required.']}, http.HTTPStatus.GONE
+    token = now.replace(microsecond=0) - datetime.timedelta(seconds=config['SYNC_OVERLAP'])
+    headers = {'X-Sync-Token': token.strftime(TOKEN_FORMAT)}
+
+    if since != BEGINNING:
+        query = query.filter(_since(model.date_modified, since))
+    deleted = deleted_ids(model, since) if since != BEGINNING else None
+    if fmt:
+        tail = _deleted_chunks(query.session, deleted, config['STREAM_CHUNK_SIZE']) if deleted is not None else ()
+        return streaming.stream_collection(query, dumper, model.id, fmt, tail=tail, headers=headers)
+
+    page = changes_page(query, model.id, deleted)
+    dumped, errors = dumper.dump([row for _, row in page.items if row is not None], many=True)
+    if errors:  # break properly
+        return '', http.HTTPStatus.INTERNAL_SERVER_ERROR
+    dumped = iter(dumped)
+    data = [_deleted(id) if row is None else next(dumped) for id, row in page.items]
+    if 'after' in request.args:
+        headers = {}
+    headers.update(pagination.page_headers(page))
+    return data, http.HTTPStatus.OK, headers
@@ -1,24 +1,52 @@
 import http
 
 try:
-    from .schemas import models, user_schema
+    from .schemas import models, user_schema, user_dumper, apply_loading_plan
+    from . import bulk, caching, conditional, fieldsets, multiget, negotiation, pagination, streaming, sync
 except SystemError:  # in case we call this module directly (doctest)
-    from schemas import models, user_schema
+    from schemas import models, user_schema, user_dumper, apply_loading_plan
+    import bulk
+    import caching
+    import conditional
+    import fieldsets
+    import multiget
+    import negotiation
+    import pagination
+    import streaming
+    import sync
 
 from sqlalchemy_utils import PasswordType, EmailType, UUIDType  #,NumericRangeType
-from flask import jsonify, request
+from flask import jsonify
 from marshmallow import post_load
 
 
+@caching.cached_response('users')
 def users():
     """
-    Retrieve all users
+    Retrieve a page of users
+    (see pagination module for limit and after parameters, streaming module for full dumps, multiget module for ids,
+    sync module for modified_since, fieldsets module for sparse dumps)
     :return:
     """
-    all_users = models.User.all()
-    user_dict, errors = user_schema.dump(all_users, many=True)
+    try:
+        schema, dumper = fieldsets.sparse(user_schema, user_dumper)
+        query = apply_loading_plan(models.User.query, schema)
+        ids = multiget.ids_args()
+        if ids is not None:
+            return multiget.multi_get(query, models.User.id, dumper, ids)
+        since = sync.since_args()
+        fmt = streaming.stream_format()
+        if since is not None:
+            return sync.changes(query, models.User, dumper, since, fmt)
+        if fmt:
+            return streaming.stream_collection(query, dumper, models.User.id, fmt)
+        page = pagination.keyset_page(query, models.User.id)
+    except (fieldsets.FieldsError, multiget.MultiGetError, pagination.PaginationError,
+            streaming.StreamingError, sync.SyncError) as e:
+        return e.args[0], http.HTTPStatus.BAD_REQUEST
+    user_dict, errors = dumper.dump(page.items, many=True)
     if not errors:
-        return user_dict
+        return user_dict, http.HTTPStatus.OK, pagination.page_headers(page)
     else:  # break properly
         return '', http.HTTPStatus.INTERNAL_SERVER_ERROR
 
@@ -26,15 +54,26 @@ def users():
 def user_read(id):
     """
     Retrieve one user
+    (answers 304 Not Modified to If-None-Match and If-Modified-Since, see conditional module)
     :param id:
     :return:
     """
-    user = models.User.query.get(id)
+    try:
+        schema, dumper = fieldsets.sparse(user_schema, user_dumper)
+    except fieldsets.FieldsError as e:
+        return e.args[0], http.HTTPStatus.BAD_REQUEST
+    row = models.db.session.query(models.User.id, models.User.date_modified).filter(models.User.id == id).first()
+    if row is None:
+        return '', http.HTTPStatus.NOT_FOUND
+    validators = conditional.make_validators(row[0], row[1:], variant=fieldsets.variant_key())
+    if conditional.not_modified(validators):
+        return '', http.HTTPStatus.NOT_MODIFIED, conditional.headers(validators)
+    user = apply_loading_plan(models.User.query, schema).get(id)
     if not user:
         return '', http.HTTPStatus.NOT_FOUND
-    user_dict, errors = user_schema.dump(user)
+    user_dict, errors = dumper.dump(user)
     if not errors:
-        return user_dict
+        return user_dict, http.HTTPStatus.OK, conditional.headers(validators)
     else:  # break properly
         return '', http.HTTPStatus.INTERNAL_SERVER_ERROR
 
@@ -45,7 +84,11 @@ def user_edit(id):
     :param id: the user id
     :return:
     """
-    data = request.get_json()
+    data = negotiation.request_data()
+    try:
+        dumper = fieldsets.sparse(user_schema, user_dumper)[1]
+    except fieldsets.FieldsError as e:
+        return e.args[0], http.HTTPStatus.BAD_REQUEST
     user = models.User.query.get(id)
 
     if not user:
@@ -54,7 +97,7 @@ def user_edit(id):
     for k, v in data.items():
         setattr(user, k, v)
 
-    user_dict, errors = user_schema.dump(user)
+    user_dict, errors = dumper.dump(user)
     if not errors:
         return user_dict
     else:  # break properly
@@ -64,14 +107,22 @@ def user_edit(id):
 def user_add():
     """
     Adds a user
+    (or many at once from a JSON array, see bulk module)
     :return:
     """
-    data = request.get_json()
+    data = negotiation.request_data()
+    try:
+        dumper = fieldsets.sparse(user_schema, user_dumper)[1]
+    except fieldsets.FieldsError as e:
+        return e.args[0], http.HTTPStatus.BAD_REQUEST
+    if isinstance(data, list):
+        return bulk.bulk_add(user_schema)
+
     user, errors = user_schema.load(data, )
     if not errors:
         user.save()
 
-    user_dict, errors = user_schema.dump(user)
+    user_dict, errors = dumper.dump(user)
     if not errors:
         return user_dict, http.HTTPStatus.CREATED
     else:  # break properly
@@ -0,0 +1,57 @@
+"""
+Benchmark : hungriest animals leaderboard.
+
+ - stored stats : index order read (ix_animals_hungry_desc), whatever the number of animals
+ - derived stats (lazy stats mode) : numpy top-k over all animals, chunk by chunk
+
+Run from the repository root :
+python -m benchmarks.bench_leaderboard [number of animals in database]
+"""
+
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+import sqlalchemy
+
+from app import leaderboard
+from app.schemas import models
+
+SPECIES = 10
+
+
+def bench(count, k=50):
+    with tempfile.TemporaryDirectory() as directory:
+        engine = sqlalchemy.create_engine('sqlite:///' + os.path.join(directory, 'bench.db'))
+        session = sqlalchemy.orm.sessionmaker(bind=engine)()
+        models.Animal.metadata.create_all(engine)
+
+        species = models.Species.__table__
+        animals = models.Animal.__table__
+        now = datetime.datetime.utcnow()
+        session.execute(species.insert(), [{'id': i + 1, 'name': 'species{}'.format(i), 'happy_rate': i, 'hunger_rate': 2 * i}
+                                           for i in range(SPECIES)])
+        for start in range(0, count, 100000):
+            session.execute(animals.insert(), [
+                {'name': 'animal{}'.format(i), 'happy': (13 * i) % 1000, 'hungry': (7 * i) % 1000,
+                 'species_id': i % SPECIES + 1, 'stats_updated_at': now - datetime.timedelta(seconds=i % 3600)}
+                for i in range(start, min(count, start + 100000))])
+        session.commit()
+
+        query = session.query(models.Animal)
+        start = time.perf_counter()
+        leaderboard.top_stored(query, 'hungry', k)
+        duration = time.perf_counter() - start
+        print("stored    {:>9} animals, top {} {:8.2f} ms".format(count, k, duration * 1000))
+
+        start = time.perf_counter()
+        leaderboard.top_ids_derived(query, 'hungry', k, chunk_size=10000, now=now, period=3600)
+        duration = time.perf_counter() - start
+        print("derived   {:>9} animals, top {} {:8.1f} ms | {:>6.3f} M animals/s".format(
+            count, k, duration * 1000, count / duration / 1e6))
+
+
+if __name__ == "__main__":
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
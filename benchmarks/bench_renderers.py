@@ -0,0 +1,56 @@
+"""
+Benchmark : response encoding of 10k dumped animals, json module vs orjson, msgpack and cbor (see negotiation module).
+
+Encode time, and payload size, for the list the animals view renders. The codecs whose library is not installed
+are reported as such.
+
+Run from the repository root :
+python -m benchmarks.bench_renderers
+"""
+
+import json
+import timeit
+
+import sqlalchemy
+from flask.json import JSONEncoder
+
+from app import negotiation
+from app.schemas import models, animal_schema, animal_dumper, apply_loading_plan
+from benchmarks.bench_serializers import populate
+
+default = JSONEncoder().default
+
+
+def json_module(data):
+    """What the Flask-API JSON renderer does"""
+    return json.dumps(data, cls=JSONEncoder, ensure_ascii=False).encode('utf-8')
+
+
+def bench(name, dumps, data, reference=None, number=5):
+    duration = min(timeit.repeat(lambda: dumps(data), number=1, repeat=number))
+    size = len(dumps(data))
+    print("{:>8} x {:<6} {:8.1f} ms | {:>9} bytes{}".format(
+        name, len(data), duration * 1000, size,
+        ' | speedup x{:.1f}, size {:.0%}'.format(reference[0] / duration, size / reference[1]) if reference else ''))
+    return duration, size
+
+
+if __name__ == "__main__":
+    engine = sqlalchemy.create_engine('sqlite:///:memory:')
+    session = sqlalchemy.orm.sessionmaker(bind=engine)()
+    models.Animal.metadata.create_all(engine)
+    populate(session)
+
+    # dumped upfront : we only measure the encoding
+    animals = animal_dumper.dump(apply_loading_plan(session.query(models.Animal), animal_schema).all(), many=True).data
+
+    reference = bench('json', json_module, animals)
+    for name, codec in sorted(negotiation.CODECS.items()):
+        if name == 'json' and negotiation.orjson is None:
+            print("{:>8} orjson not installed, json module fallback".format('orjson'))
+        elif not codec.available:
+            print("{:>8} not installed".format(name))
+        else:
+            dumps = lambda data, codec=codec: codec.dumps(data, default=default)
+            assert codec.loads(dumps(animals)) == json.loads(json_module(animals)), "{} output differs".format(name)
+            bench('orjson' if name == 'json' else name, dumps, animals, reference)
@@ -0,0 +1,63 @@
+"""
+Benchmark : pet stats simulation tick.
+
+ - compute only : numpy whole_changes() on millions of animals
+ - full tick : load, compute and write back animals in an sqlite database (on disk, in a temporary directory)
+
+Run from the repository root :
+python -m benchmarks.bench_simulation [number of animals in database]
+"""
+
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import sqlalchemy
+
+from app import simulation
+from app.schemas import models
+
+SPECIES = 10
+
+
+def bench_compute(count):
+    elapsed = np.random.uniform(0, 3600, count)
+    start = time.perf_counter()
+    simulation.whole_changes(3, 7, elapsed, 3600)
+    duration = time.perf_counter() - start
+    print("compute   {:>9} animals {:8.1f} ms | {:>6.1f} M animals/s".format(
+        count, duration * 1000, count / duration / 1e6))
+
+
+def bench_tick(count, chunk_size=10000):
+    with tempfile.TemporaryDirectory() as directory:
+        engine = sqlalchemy.create_engine('sqlite:///' + os.path.join(directory, 'bench.db'))
+        session = sqlalchemy.orm.sessionmaker(bind=engine)()
+        models.Animal.metadata.create_all(engine)
+
+        species = models.Species.__table__
+        animals = models.Animal.__table__
+        now = datetime.datetime.utcnow()
+        session.execute(species.insert(), [{'id': i + 1, 'name': 'species{}'.format(i), 'happy_rate': i, 'hunger_rate': 2 * i}
+                                           for i in range(SPECIES)])
+        for start in range(0, count, 100000):
+            session.execute(animals.insert(), [
+                {'name': 'animal{}'.format(i), 'happy': i % 100, 'hungry': (7 * i) % 100,
+                 'species_id': i % SPECIES + 1, 'stats_updated_at': now - datetime.timedelta(seconds=i % 3600)}
+                for i in range(start, min(count, start + 100000))])
+        session.commit()
+
+        start = time.perf_counter()
+        result = simulation.tick(session=session, chunk_size=chunk_size, now=now + datetime.timedelta(hours=1))
+        duration = time.perf_counter() - start
+        print("tick      {:>9} animals {:8.1f} ms | {:>6.3f} M animals/s ({} updated, species without rates skipped)".format(
+            count, duration * 1000, count / duration / 1e6, result.updated))
+
+
+if __name__ == "__main__":
+    for count in (10 ** 6, 5 * 10 ** 6):
+        bench_compute(count)
+    bench_tick(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -8,6 +8,57 @@ class Config(object):
     SECRET_KEY = os.getenv('SECRET')
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL')
 
+    # collections pagination
+    PAGE_SIZE = 100  # default number of items per page
+    PAGE_SIZE_MAX = 1000  # maximum number of items a client can ask for in one page
+    UNPAGINATED_MAX = 10000  # cap for the opt-in "limit=all" full dump
+    STREAM_CHUNK_SIZE = 1000  # rows fetched and dumped at once when streaming a collection
+    MULTIGET_MAX = 1000  # maximum number of ids in a multi-get (?ids=1,2,3)
+    TOP_K = 10  # default number of animals in a leaderboard
+    TOP_K_MAX = 1000  # maximum number of animals a client can ask for in a leaderboard
+
+    # delta sync
+    SYNC_OVERLAP = 2  # seconds a sync token is set back, writes committing late are synced twice rather than never
+    TOMBSTONES_RETENTION = 30 * 24 * 3600  # seconds, older sync tokens are refused and a full sync is required
+
+    # animals actions (feed, play)
+    ACTION_AMOUNT = 10  # default stat change of one action
+    ACTION_AMOUNT_MAX = 1000  # maximum stat change a client can ask for in one action
+    ACTIONS_FLUSH_WINDOW = 0  # seconds actions are buffered and summed per animal before being written (0 : at once)
+
+    # actions journal
+    ACTIONS_JOURNAL = False  # actions are only recorded, and folded into the animals later (flask compact-journal)
+    JOURNAL_CHUNK_SIZE = 10000  # events folded, or purged, per transaction
+    JOURNAL_RETENTION = 30 * 24 * 3600  # seconds folded events are kept for auditing (flask purge-journal)
+
+    # animals change feed (server-sent events)
+    SSE_QUEUE_SIZE = 1000  # changes kept per subscriber, the oldest are dropped beyond (and a resync event sent)
+    # each stream holds a worker thread : the Procfile runs gunicorn threaded workers (gthread), with
+    # WEB_THREADS (110 by default) threads, this many streams per worker process and room for the other requests
+    SSE_MAX_SUBSCRIBERS = 100
+    SSE_HEARTBEAT = 15  # seconds between keep-alive comments
+
+    # content negotiation (see negotiation module), in preference order
+    RENDERERS = ('json', 'msgpack', 'cbor', 'browsable')  # json is encoded by orjson, when installed
+    PARSERS = ('json', 'msgpack', 'cbor', 'urlencoded', 'multipart')  # request bodies (forms : browsable API)
+
+    # batch requests
+    BATCH_MAX = 50  # maximum number of sub-requests in one POST /api/batch
+
+    # species cache, per worker
+    SPECIES_CACHE_SIZE = 1024  # species kept, least recently used ones are dropped
+    SPECIES_CACHE_TTL = 300  # seconds, changes not made through the species views are seen after that
+
+    # collections responses cache, per worker
+    RESPONSE_CACHE_BYTES = 16 * 1024 * 1024  # response bodies kept, least recently used ones are dropped (0 disables)
+    RESPONSE_CACHE_TTL = 60  # seconds, writes from other processes are seen after that
+
+    # pet stats simulation
+    SIMULATION_RATE_PERIOD = 3600  # species happy_rate and hunger_rate are per hour
+    SIMULATION_CHUNK_SIZE = 10000  # animals computed and updated at once
+    SIMULATION_TICK_BUDGET = 10  # seconds, a tick stops there and can be resumed
+    LAZY_STATS = False  # derive stats when reading animals, from a baseline written only on user actions
+
 
 class DevelopmentConfig(Config):
     """Configurations for Development."""
@@ -0,0 +1,28 @@
+"""animals indexes on foreign keys and (species_id, hungry)
+
+Revision ID: 4f1c2a7d9e31
+Revises: b5c5fb616e90
+Create Date: 2018-03-20 10:12:05.118364
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f1c2a7d9e31'
+down_revision = 'b5c5fb616e90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_animals_owner_id'), 'animals', ['owner_id'], unique=False)
+    op.create_index(op.f('ix_animals_species_id'), 'animals', ['species_id'], unique=False)
+    op.create_index('ix_animals_species_id_hungry', 'animals', ['species_id', 'hungry'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_animals_species_id_hungry', table_name='animals')
+    op.drop_index(op.f('ix_animals_species_id'), table_name='animals')
+    op.drop_index(op.f('ix_animals_owner_id'), table_name='animals')
@@ -0,0 +1,26 @@
+"""animals indexes for the hungriest and unhappiest leaderboards
+
+Revision ID: 9a3e5b0c7d12
+Revises: 4f1c2a7d9e31
+Create Date: 2018-03-22 16:40:31.529047
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a3e5b0c7d12'
+down_revision = '4f1c2a7d9e31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_animals_hungry_desc', 'animals', [sa.text('hungry DESC'), 'id'], unique=False)
+    op.create_index('ix_animals_happy', 'animals', ['happy', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_animals_happy', table_name='animals')
+    op.drop_index('ix_animals_hungry_desc', table_name='animals')
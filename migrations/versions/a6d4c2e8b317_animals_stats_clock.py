@@ -0,0 +1,27 @@
+"""animals stats clock : stats_updated_at, apart from date_modified
+
+Revision ID: a6d4c2e8b317
+Revises: f1b7c3d95a20
+Create Date: 2018-04-02 09:17:41.528903
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6d4c2e8b317'
+down_revision = 'f1b7c3d95a20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('animals', sa.Column('stats_updated_at', sa.DateTime(), nullable=True))
+    # backfill : the stats were up to date at the last modification
+    op.execute('UPDATE animals SET stats_updated_at = date_modified')
+
+
+def downgrade():
+    with op.batch_alter_table('animals') as batch_op:
+        batch_op.drop_column('stats_updated_at')
@@ -0,0 +1,37 @@
+"""actions journal : folded events, instead of a compaction watermark
+
+Revision ID: b9e1d4f7a265
+Revises: a6d4c2e8b317
+Create Date: 2018-04-04 15:02:36.417285
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b9e1d4f7a265'
+down_revision = 'a6d4c2e8b317'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('animal_events', sa.Column('folded', sa.Boolean(), server_default=sa.false(), nullable=False))
+    # the events up to the checkpoint of their animal (the watermark, for purged checkpoints) were folded
+    events = sa.table('animal_events', sa.column('id'), sa.column('animal_id'),
+                      sa.column('applied', sa.Boolean()), sa.column('folded', sa.Boolean()))
+    checkpoints = sa.table('animal_checkpoints', sa.column('animal_id'), sa.column('event_id'))
+    checkpoint = sa.select([checkpoints.c.event_id]).where(checkpoints.c.animal_id == events.c.animal_id) \
+        .as_scalar()
+    watermark = sa.select([sa.func.max(checkpoints.c.event_id)]).as_scalar()
+    op.execute(events.update().where(events.c.id <= sa.func.coalesce(checkpoint, watermark))
+               .values(folded=True, applied=True))
+    op.create_index('ix_animal_events_unfolded', 'animal_events', ['id'], unique=False,
+                    postgresql_where=sa.text('NOT folded'), sqlite_where=sa.text('NOT folded'))
+
+
+def downgrade():
+    op.drop_index('ix_animal_events_unfolded', table_name='animal_events')
+    with op.batch_alter_table('animal_events') as batch_op:
+        batch_op.drop_column('folded')
@@ -0,0 +1,47 @@
+"""species_stats rollup of the animals, and animals (species_id, happy) index
+
+Revision ID: c3d8e1f04a56
+Revises: 9a3e5b0c7d12
+Create Date: 2018-03-24 11:02:47.803215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3d8e1f04a56'
+down_revision = '9a3e5b0c7d12'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_animals_species_id_happy', 'animals', ['species_id', 'happy'], unique=False)
+    op.create_table('species_stats',
+    sa.Column('species_id', sa.Integer(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.Column('happy_count', sa.Integer(), nullable=False),
+    sa.Column('happy_sum', sa.BigInteger(), nullable=False),
+    sa.Column('happy_min', sa.Integer(), nullable=True),
+    sa.Column('happy_max', sa.Integer(), nullable=True),
+    sa.Column('hungry_count', sa.Integer(), nullable=False),
+    sa.Column('hungry_sum', sa.BigInteger(), nullable=False),
+    sa.Column('hungry_min', sa.Integer(), nullable=True),
+    sa.Column('hungry_max', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['species_id'], ['species.id'], ),
+    sa.PrimaryKeyConstraint('species_id')
+    )
+    # backfill, in one pass over the animals (same as flask reconcile)
+    op.execute(
+        'INSERT INTO species_stats (species_id, count, happy_count, happy_sum, happy_min, happy_max, '
+        'hungry_count, hungry_sum, hungry_min, hungry_max) '
+        'SELECT species_id, count(*), count(happy), coalesce(sum(happy), 0), min(happy), max(happy), '
+        'count(hungry), coalesce(sum(hungry), 0), min(hungry), max(hungry) '
+        'FROM animals GROUP BY species_id'
+    )
+
+
+def downgrade():
+    op.drop_table('species_stats')
+    op.drop_index('ix_animals_species_id_happy', table_name='animals')
@@ -0,0 +1,57 @@
+"""owners pet_count and species member_count counters
+
+Revision ID: d7a2f9c61b08
+Revises: c3d8e1f04a56
+Create Date: 2018-03-26 09:47:13.220541
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7a2f9c61b08'
+down_revision = 'c3d8e1f04a56'
+branch_labels = None
+depends_on = None
+
+# rows counted per UPDATE, each committed on its own, to keep the locks short on large tables
+# (the counts use the animals owner_id and species_id indexes)
+CHUNK_SIZE = 1000
+
+animals = sa.table('animals', sa.column('owner_id'), sa.column('species_id'))
+owners = sa.table('owners', sa.column('id'), sa.column('pet_count'))
+species = sa.table('species', sa.column('id'), sa.column('member_count'))
+
+
+def backfill(table, counter, column):
+    """
+    Counts the animals of each row, chunk by chunk, in id order.
+    Each chunk is committed (autocommit) : the migration transaction would hold the locks of every chunk until
+    its end. The counters are also rebuilt by flask reconcile, should the backfill be interrupted.
+    """
+    connection = op.get_bind()
+    after = 0
+    with op.get_context().autocommit_block():
+        while True:
+            ids = [id for id, in connection.execute(
+                sa.select([table.c.id]).where(table.c.id > after).order_by(table.c.id).limit(CHUNK_SIZE))]
+            if not ids:
+                break
+            count = sa.select([sa.func.count()]).where(animals.c[column] == table.c.id).as_scalar()
+            connection.execute(table.update().where(table.c.id.between(ids[0], ids[-1])).values({counter: count}))
+            after = ids[-1]
+
+
+def upgrade():
+    op.add_column('owners', sa.Column('pet_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('species', sa.Column('member_count', sa.Integer(), server_default='0', nullable=False))
+    backfill(owners, 'pet_count', 'owner_id')
+    backfill(species, 'member_count', 'species_id')
+
+
+def downgrade():
+    with op.batch_alter_table('species') as batch_op:
+        batch_op.drop_column('member_count')
+    with op.batch_alter_table('owners') as batch_op:
+        batch_op.drop_column('pet_count')
@@ -0,0 +1,38 @@
+"""delta sync : date_modified indexes, and tombstones of the deleted rows
+
+Revision ID: e8b4d2a7c913
+Revises: d7a2f9c61b08
+Create Date: 2018-03-28 14:21:05.417093
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8b4d2a7c913'
+down_revision = 'd7a2f9c61b08'
+branch_labels = None
+depends_on = None
+
+SYNCED = ('animals', 'owners', 'species', 'users')
+
+
+def upgrade():
+    op.create_table('tombstones',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('table_name', sa.String(length=64), nullable=False),
+    sa.Column('row_id', sa.Integer(), nullable=False),
+    sa.Column('date_deleted', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_tombstones_table_name_date_deleted', 'tombstones', ['table_name', 'date_deleted'], unique=False)
+    for table in SYNCED:
+        op.create_index(op.f('ix_{}_date_modified'.format(table)), table, ['date_modified'], unique=False)
+
+
+def downgrade():
+    for table in SYNCED:
+        op.drop_index(op.f('ix_{}_date_modified'.format(table)), table_name=table)
+    op.drop_index('ix_tombstones_table_name_date_deleted', table_name='tombstones')
+    op.drop_table('tombstones')
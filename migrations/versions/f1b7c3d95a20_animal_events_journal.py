@@ -0,0 +1,49 @@
+"""actions journal : animal_events, and the animal_checkpoints of its compaction, seeded with the animals stats
+
+Revision ID: f1b7c3d95a20
+Revises: e8b4d2a7c913
+Create Date: 2018-03-30 10:42:17.206531
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1b7c3d95a20'
+down_revision = 'e8b4d2a7c913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('animal_events',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('animal_id', sa.Integer(), nullable=False),
+    sa.Column('action', sa.String(length=16), nullable=False),
+    sa.Column('happy', sa.BigInteger(), nullable=False),
+    sa.Column('hungry', sa.BigInteger(), nullable=False),
+    sa.Column('applied', sa.Boolean(), nullable=False),
+    sa.Column('date_created', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('animal_checkpoints',
+    sa.Column('animal_id', sa.Integer(), nullable=False),
+    sa.Column('event_id', sa.Integer(), nullable=False),
+    sa.Column('happy', sa.Integer(), nullable=False),
+    sa.Column('hungry', sa.Integer(), nullable=False),
+    sa.Column('date_created', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('animal_id')
+    )
+    op.create_index(op.f('ix_animal_checkpoints_event_id'), 'animal_checkpoints', ['event_id'], unique=False)
+    # existing animals start from their current stats (no event folded yet : watermark unchanged)
+    op.execute(
+        'INSERT INTO animal_checkpoints (animal_id, event_id, happy, hungry, date_created) '
+        'SELECT id, 0, coalesce(happy, 0), coalesce(hungry, 0), CURRENT_TIMESTAMP FROM animals'
+    )
+
+
+def downgrade():
+    op.drop_index(op.f('ix_animal_checkpoints_event_id'), table_name='animal_checkpoints')
+    op.drop_table('animal_checkpoints')
+    op.drop_table('animal_events')
@@ -1,8 +1,9 @@
+import datetime
 import os
 
 import click
 
-from app import create_app, models
+from app import create_app, models, simulation
 from flask_admin import Admin
 from flask_admin.contrib.sqla import ModelView
 from flask_migrate import Migrate
@@ -24,6 +25,57 @@ def testcmd():
     click.echo('Test the cmd')
 
 
+@app.cli.command()
+@click.option('--budget', type=float, default=None, help='time budget in seconds (see SIMULATION_TICK_BUDGET)')
+def simulate(budget):
+    """Advance all pets stats, by the time elapsed since their last change."""
+    if app.config.get('LAZY_STATS'):
+        click.echo('LAZY_STATS is set : stats are derived when read, nothing to simulate')
+        return
+    result = None
+    while result is None or result.resume is not None:
+        result = simulation.tick(
+            period=app.config['SIMULATION_RATE_PERIOD'],
+            chunk_size=app.config['SIMULATION_CHUNK_SIZE'],
+            budget=budget if budget is not None else app.config['SIMULATION_TICK_BUDGET'],
+            resume=result.resume if result else None,
+        )
+        click.echo('{} pets updated{}'.format(result.updated, ', resuming...' if result.resume else ''))
+
+
+@app.cli.command()
+def reconcile():
+    """Rebuild the species stats rollup, and the pets and members counters, from the animals table."""
+    count = models.species_stats.rebuild()
+    click.echo('species stats rebuilt for {} species'.format(count))
+    models.counters.rebuild()
+    click.echo('owners and species counters rebuilt')
+
+
+@app.cli.command('purge-tombstones')
+def purge_tombstones():
+    """Remove the tombstones older than TOMBSTONES_RETENTION (older sync tokens require a full sync anyway)."""
+    before = datetime.datetime.utcnow() - datetime.timedelta(seconds=app.config['TOMBSTONES_RETENTION'])
+    count = models.tombstones.purge(before)
+    click.echo('{} tombstones purged'.format(count))
+
+
+@app.cli.command('compact-journal')
+@click.option('--budget', type=float, default=None, help='time budget in seconds')
+def compact_journal(budget):
+    """Fold the pending actions of the journal into the pets stats, and checkpoint them."""
+    result = models.journal.compact(chunk_size=app.config['JOURNAL_CHUNK_SIZE'], budget=budget)
+    click.echo('{} events folded{}'.format(result.folded, '' if result.complete else ', more to fold'))
+
+
+@app.cli.command('purge-journal')
+def purge_journal():
+    """Remove the folded journal events older than JOURNAL_RETENTION."""
+    before = datetime.datetime.utcnow() - datetime.timedelta(seconds=app.config['JOURNAL_RETENTION'])
+    count = models.journal.purge(before, chunk_size=app.config['JOURNAL_CHUNK_SIZE'])
+    click.echo('{} journal events purged'.format(count))
+
+
 # for default action
 if __name__ == '__main__':
     app.run()
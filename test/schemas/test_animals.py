@@ -14,6 +14,13 @@ except SystemError:
 from app.schemas import models, animal_schema, species_schema, owner_schema
 
 
+def nested_species(species):
+    """The species dump nested in animals dumps (without the members counter, see CachedSpecies)"""
+    species_dict = species_schema.dump(species).data
+    species_dict.pop('member_count')
+    return species_dict
+
+
 @given(name=st.text(),
     happy=st.integers(min_value=-2147483648, max_value=2147483647),
     hungry=st.integers(min_value=-2147483648, max_value=2147483647)
@@ -48,11 +55,11 @@ def test_load_dump_animals_species_id_NO_owner_id_OK(name, happy, hungry):
             # compare dicts
             # species_id should have been expanded to the dummy species
             # owner should be None
-            assert fin.get('species') == species_schema.dump(species).data
+            assert fin.get('species') == nested_species(species)
             fin.pop('species')
             fin.pop('owner')
-            # the rest should be identical
-            ori.pop('species_id')
+            # the rest should be identical, with the foreign keys
+            ori['owner_id'] = None
             assert fin == ori
 
             # deleting table before removing dummy species
@@ -94,16 +101,14 @@ def test_load_dump_animals_species_id_owner_id_OK(name, happy, hungry):
 
                 # compare dicts
                 # owner_id should have been expanded to the dummy owner
-                assert fin.get('owner') == owner_schema.dump(owner).data
+                assert fin.get('owner') == {k: v for k, v in owner_schema.dump(owner).data.items() if k != 'pets'}
 
                 # spcies_id should have been expanded to the dummy species
-                assert fin.get('species') == species_schema.dump(species).data
+                assert fin.get('species') == nested_species(species)
 
                 fin.pop('owner')
                 fin.pop('species')
-                # the rest should be identical
-                ori.pop('owner_id')
-                ori.pop('species_id')
+                # the rest should be identical, with the foreign keys
                 assert fin == ori
 
                 # we should be able to delete the dummy owner but keep the orphan pet
@@ -121,10 +126,11 @@ def test_load_dump_animals_species_id_owner_id_OK(name, happy, hungry):
             assert fin.get('owner') is None
 
             # spcies_id should have been expanded to the dummy species
-            assert fin.get('species') == species_schema.dump(species).data
+            assert fin.get('species') == nested_species(species)
 
             fin.pop('species')
             fin.pop('owner')
+            ori['owner_id'] = None
             assert fin == ori
 
             # deleting table before removing dummy species
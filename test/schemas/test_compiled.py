@@ -0,0 +1,92 @@
+import json
+
+from hypothesis import given, settings
+import hypothesis.strategies as st
+
+try:
+    from .utils import clean_memorydb_session_from_schema, dummy_species, dummy_owner
+except SystemError:
+    from utils import clean_memorydb_session_from_schema, dummy_species, dummy_owner
+
+from app.schemas import models, animal_schema, owner_schema, species_schema, user_schema
+from app.schemas import animal_dumper, owner_dumper, species_dumper, user_dumper, compile_schema
+from app.schemas import apply_loading_plan
+from benchmarks import bench_serializers
+
+
+@settings(deadline=None)
+@given(names=st.lists(st.text()), data=st.data())
+def test_compiled_dump_animals_identical(names, data):
+
+    with clean_memorydb_session_from_schema(animal_schema) as s:
+
+        with dummy_species(s) as species:
+
+            with dummy_owner(s) as owner:
+
+                animals = []
+                for name in names:
+                    animal = models.Animal(
+                        name=name,
+                        happy=data.draw(st.none() | st.integers(min_value=-2147483648, max_value=2147483647)),
+                        hungry=data.draw(st.none() | st.integers(min_value=-2147483648, max_value=2147483647)),
+                        species_id=species.id,
+                        owner_id=data.draw(st.sampled_from([owner.id, None])),
+                    )
+                    animal.save(session=s)
+                    animals.append(animal)
+
+                fin, err = animal_dumper.dump(animals, many=True)
+                ori, ori_err = animal_schema.dump(animals, many=True)
+                assert not err and not ori_err
+                assert fin == ori
+                # same bytes once rendered
+                assert json.dumps(fin) == json.dumps(ori)
+
+                for a in animals:
+                    assert json.dumps(animal_dumper.dump(a).data) == json.dumps(animal_schema.dump(a).data)
+                    a.delete(session=s)
+
+
+def test_compiled_dump_owners_species_users_identical():
+
+    with clean_memorydb_session_from_schema(owner_schema) as s:
+
+        with dummy_species(s) as species:
+
+            with dummy_owner(s) as owner:
+
+                assert json.dumps(owner_dumper.dump(owner).data) == json.dumps(owner_schema.dump(owner).data)
+                assert json.dumps(user_dumper.dump(owner.user).data) == json.dumps(user_schema.dump(owner.user).data)
+                assert json.dumps(species_dumper.dump(species).data) == json.dumps(species_schema.dump(species).data)
+
+
+def test_compiled_dump_invalid_reports_errors():
+
+    with clean_memorydb_session_from_schema(species_schema) as s:
+
+        species = models.Species(name='testspecies', happy_rate='not a number')
+        # not saved, marshmallow should still complain the same way
+        assert species_dumper.dump(species).errors == species_schema.dump(species).errors != {}
+
+
+def test_compiled_after_marshmallow_dump():
+
+    # marshmallow fills its processors registry when dumping
+    animal_schema.dump([], many=True)
+    assert compile_schema(animal_schema)._dump is not None
+
+
+def test_compiled_dump_bench_data_identical():
+    """The compiled dumps of the benchmark data (see benchmarks/bench_serializers.py) are marshmallow ones, inlined"""
+
+    with clean_memorydb_session_from_schema(animal_schema) as s:
+
+        bench_serializers.populate(s)
+        animals = apply_loading_plan(s.query(models.Animal), animal_schema).all()
+        owners = apply_loading_plan(s.query(models.Owner), owner_schema).all()
+
+        for schema, dumper, rows in ((animal_schema, animal_dumper, animals), (owner_schema, owner_dumper, owners)):
+            assert json.dumps(dumper.dump(rows, many=True).data) == json.dumps(schema.dump(rows, many=True).data)
+            # every field read directly, none left to the generic marshmallow serialization (the slow path)
+            assert '.serialize(' not in dumper._plain_dump.source
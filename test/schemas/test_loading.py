@@ -0,0 +1,152 @@
+import contextlib
+
+from hypothesis import given, settings
+import hypothesis.strategies as st
+import sqlalchemy
+
+try:
+    from .utils import clean_memorydb_session_from_schema, dummy_species
+except SystemError:
+    from utils import clean_memorydb_session_from_schema, dummy_species
+
+from app.schemas import models, animal_schema, animal_dumper, owner_schema, apply_loading_plan
+from app import fieldsets
+
+
+@contextlib.contextmanager
+def statements_count(session):
+    """Counts the SQL statements sent through the session engine"""
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = session.get_bind()
+    sqlalchemy.event.listen(engine, 'before_cursor_execute', count)
+    yield statements
+    sqlalchemy.event.remove(engine, 'before_cursor_execute', count)
+
+
+def populate(session, species, count):
+    owners = []
+    for i in range(count):
+        user = models.User(nick='testuser{}'.format(i), email='tester{}@comp.any'.format(i))
+        owner = models.Owner(user=user)
+        owner.pets = [models.Animal(name='testanimal{}'.format(j), species_id=species.id) for j in range(2)]
+        owners.append(owner)
+    session.add_all(owners)
+    session.commit()
+    session.expire_all()  # forget everything to force loading
+
+
+@settings(max_examples=10)
+@given(count=st.integers(min_value=1, max_value=20))
+def test_dump_animals_constant_statements(count):
+
+    with clean_memorydb_session_from_schema(animal_schema) as s:
+
+        with dummy_species(s) as species:
+
+            populate(s, species, count)
+
+            with statements_count(s) as statements:
+                animals = apply_loading_plan(s.query(models.Animal), animal_schema).all()
+                fin, err = animal_schema.dump(animals, many=True)
+
+            assert not err
+            assert len(fin) == 2 * count
+            assert all(a.get('owner').get('user') and a.get('species') for a in fin)
+            # one joined SELECT, whatever the number of animals
+            # and, without the species cache of an app, one for the (single) species
+            assert len(statements) == 2
+
+            s.query(models.Animal).delete()
+            s.query(models.Owner).delete()
+            s.query(models.User).delete()
+            s.commit()
+
+
+@settings(max_examples=10)
+@given(count=st.integers(min_value=1, max_value=20))
+def test_dump_owners_constant_statements(count):
+
+    with clean_memorydb_session_from_schema(owner_schema) as s:
+
+        with dummy_species(s) as species:
+
+            populate(s, species, count)
+
+            with statements_count(s) as statements:
+                owners = apply_loading_plan(s.query(models.Owner), owner_schema).all()
+                fin, err = owner_schema.dump(owners, many=True)
+
+            assert not err
+            assert len(fin) == count
+            assert all(o.get('user') and len(o.get('pets')) == 2 for o in fin)
+            # one joined SELECT for the owners and their users, one SELECT ... IN for all their pets,
+            # and, without the species cache of an app, one for the (single) species
+            assert len(statements) == 3
+
+            s.query(models.Animal).delete()
+            s.query(models.Owner).delete()
+            s.query(models.User).delete()
+            s.commit()
+
+
+def test_embed_compiles_one_query_plan():
+
+    with clean_memorydb_session_from_schema(animal_schema) as s:
+
+        with dummy_species(s) as species:
+
+            populate(s, species, 3)
+
+            # default : foreign keys only, no join
+            schema, dumper = fieldsets.sparse(animal_schema, animal_dumper, {})
+            with statements_count(s) as statements:
+                fin, err = dumper.dump(apply_loading_plan(s.query(models.Animal), schema).all(), many=True)
+            assert not err
+            assert set(fin[0]) == {'id', 'name', 'happy', 'hungry', 'species_id', 'owner_id'}
+            assert len(statements) == 1 and 'JOIN' not in statements[0]
+
+            s.expire_all()
+            schema, dumper = fieldsets.sparse(animal_schema, animal_dumper, {'embed': 'owner.user'})
+            assert fieldsets.sparse(animal_schema, animal_dumper, {'embed': 'owner.user'})[0] is schema  # cached
+            with statements_count(s) as statements:
+                fin, err = dumper.dump(apply_loading_plan(s.query(models.Animal), schema).all(), many=True)
+            assert not err
+            assert fin[0]['owner']['user']['nick'] == 'testuser0' and 'pets' not in fin[0]['owner']
+            assert 'species' not in fin[0] and fin[0]['species_id'] == species.id
+            # one joined SELECT
+            assert len(statements) == 1 and 'JOIN users' in statements[0]
+
+            s.query(models.Animal).delete()
+            s.query(models.Owner).delete()
+            s.query(models.User).delete()
+            s.commit()
+
+
+def test_sparse_fields_load_only_needed_columns():
+
+    with clean_memorydb_session_from_schema(animal_schema) as s:
+
+        with dummy_species(s) as species:
+
+            populate(s, species, 3)
+
+            schema, dumper = fieldsets.sparse(animal_schema, animal_dumper, {'fields': 'name,owner.user.nick'})
+            with statements_count(s) as statements:
+                animals = apply_loading_plan(s.query(models.Animal), schema).all()
+                fin, err = dumper.dump(animals, many=True)
+
+            assert not err
+            assert fin[0] == {'name': 'testanimal0', 'owner': {'user': {'nick': 'testuser0'}}}
+            assert len(statements) == 1
+            # species and unrequested columns are not loaded
+            assert 'species' not in statements[0]
+            assert 'email' not in statements[0] and 'animals.date_created' not in statements[0]
+
+            s.query(models.Animal).delete()
+            s.query(models.Owner).delete()
+            s.query(models.User).delete()
+            s.commit()
@@ -44,8 +44,10 @@ def test_load_dump_owners_user_id():
             # user_id should have been expanded to the dummy user
             assert fin.get('user') == user_schema.dump(user).data
             fin.pop('user')
+            # no pets yet
+            assert fin.pop('pet_count') == 0
+            assert fin.pop('pets') == []
             # the rest should be identical
-            ori.pop('user_id')
             assert fin == ori
 
             # deleting table before removing dummy user
@@ -41,6 +41,9 @@ def test_load_dump_species(name, happy_rate, hunger_rate):
         assert 'id' in fin
         fin.pop('id')
 
+        # no members yet
+        assert fin.pop('member_count') == 0
+
         # compare dicts
         assert ori == fin
 
@@ -1,8 +1,11 @@
 import unittest
 import os
 import json
+import datetime
 
-from hypothesis import given
+import pytest
+import sqlalchemy
+from hypothesis import given, settings
 import hypothesis.strategies as st
 
 try:
@@ -11,9 +14,11 @@ except SystemError:
     from utils import clean_app_test_client, dummy_owner, dummy_species
 
 from app.animals import models, animal_schema
+from app import actions, bulk, simulation
 
 
 # BROWSE
+@settings(deadline=None)
 @given(names=st.lists(st.text()), data=st.data())
 def test_api_can_get_animals(names, data):
     """Test API can get a user (GET request)."""
@@ -69,6 +74,374 @@ def test_api_can_get_animals(names, data):
                     a.delete()
 
 
+def test_api_animals_embed():
+    """Test API nests animals relationships only when embedded, foreign keys otherwise"""
+
+    # binds the app to the current context
+    with clean_app_test_client(config_name="testing") as client:
+
+        with dummy_owner() as owner:
+
+            with dummy_species() as species:
+
+                animal = animal_schema.load({'name': 'pet', 'happy': 4, 'hungry': 42,
+                                             'species_id': species.get('id'), 'owner_id': owner.get('id')}).data
+                animal.save()
+
+                flat = {'id': animal.id, 'name': 'pet', 'happy': 4, 'hungry': 42,
+                        'species_id': species.get('id'), 'owner_id': owner.get('id')}
+                assert json.loads(client.get('/api/animals/{}'.format(animal.id)).data.decode('utf-8')) == flat
+                assert json.loads(client.get('/api/animals/').data.decode('utf-8')) == [flat]
+
+                test_data = json.loads(client.get('/api/animals/{}?embed=owner.user'.format(animal.id))
+                                       .data.decode('utf-8'))
+                assert test_data.get('owner').get('user').get('nick') == 'testuser'
+                assert test_data.get('owner').get('pet_count') == 1 and 'pets' not in test_data.get('owner')
+                assert 'species' not in test_data
+
+                # embedded relationships are distinct representations
+                etag = client.get('/api/animals/{}'.format(animal.id)).headers.get('ETag')
+                res = client.get('/api/animals/{}?embed=species'.format(animal.id), headers={'If-None-Match': etag})
+                assert res.status_code == 200
+                assert json.loads(res.data.decode('utf-8')).get('species').get('name') == species.get('name')
+
+                for embed in ('weight', 'name', 'owner.pets', 'species.members'):
+                    res = client.get('/api/animals/?embed={}'.format(embed))
+                    assert res.status_code == 400
+                    assert json.loads(res.data.decode('utf-8')).get('embed')
+
+                animal.delete()
+
+
+def test_api_animals_multi_get():
+    """Test API retrieves animals by id list, in request order, with not found markers"""
+
+    # binds the app to the current context
+    with clean_app_test_client(config_name="testing") as client:
+
+        with dummy_owner() as owner:
+
+            with dummy_species() as species:
+
+                animals = [animal_schema.load({'name': name, 'happy': 4, 'hungry': 42, 'species_id': species.get('id'),
+                                               'owner_id': owner.get('id')}).data for name in ('a', 'b', 'c')]
+                for animal in animals:
+                    animal.save()
+                a, b, c = (animal.id for animal in animals)
+                missing = c + 1000
+
+                res = client.get('/api/animals/?ids={},{},{},{}&fields=id,name'.format(c, missing, a, c))
+                assert res.status_code == 200
+                assert json.loads(res.data.decode('utf-8')) == [
+                    {'id': c, 'name': 'c'}, {'id': missing, 'not_found': True}, {'id': a, 'name': 'a'},
+                    {'id': c, 'name': 'c'}]
+
+                # filters still apply, rows filtered out are not found
+                res = client.get('/api/animals/?ids={},{}&name=b&fields=id'.format(a, b))
+                assert json.loads(res.data.decode('utf-8')) == [{'id': a, 'not_found': True}, {'id': b}]
+
+                # more ids than one IN (...) clause holds
+                ids = [b] + list(range(missing, missing + 1200)) + [a]
+                client.application.config['MULTIGET_MAX'] = 2000
+                res = client.get('/api/animals/?fields=id&ids=' + ','.join(str(id) for id in ids))
+                data = json.loads(res.data.decode('utf-8'))
+                assert [item['id'] for item in data] == ids
+                assert data[0] == {'id': b} and data[-1] == {'id': a}
+                assert all(item.get('not_found') for item in data[1:-1])
+
+                client.application.config['MULTIGET_MAX'] = 2
+                for ids in ('1,x', '1,2,3'):
+                    res = client.get('/api/animals/?ids={}'.format(ids))
+                    assert res.status_code == 400
+                    assert json.loads(res.data.decode('utf-8')).get('ids')
+
+                for animal in animals:
+                    animal.delete()
+
+
+def test_api_animals_delta_sync():
+    """Test API sends only the animals changed or deleted since a sync token"""
+
+    # binds the app to the current context
+    with clean_app_test_client(config_name="testing") as client:
+
+        with dummy_owner() as owner:
+
+            with dummy_species() as species:
+
+                animals = [animal_schema.load({'name': name, 'happy': 4, 'hungry': 42, 'species_id': species.get('id'),
+                                               'owner_id': owner.get('id')}).data for name in ('a', 'b', 'c')]
+                for animal in animals:
+                    animal.save()
+                a, b, c = animals
+
+                # first sync, everything
+                res = client.get('/api/animals/?modified_since=0&fields=id,name')
+                assert res.status_code == 200
+                assert json.loads(res.data.decode('utf-8')) == [{'id': x.id, 'name': x.name} for x in animals]
+                token = datetime.datetime.strptime(res.headers.get('X-Sync-Token'), '%Y-%m-%dT%H:%M:%S')
+                assert token <= datetime.datetime.utcnow()
+
+                # an hour later, nothing changed
+                an_hour_ago = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+                models.db.session.execute(models.Animal.__table__.update().values(date_modified=an_hour_ago))
+                models.db.session.commit()
+                since = (an_hour_ago + datetime.timedelta(minutes=1)).strftime('%Y-%m-%dT%H:%M:%S')
+                res = client.get('/api/animals/?modified_since={}'.format(since))
+                assert json.loads(res.data.decode('utf-8')) == []
+
+                b.name = 'bb'
+                b.save()
+                c_id = c.id
+                c.delete()
+                changes = [{'id': b.id, 'name': 'bb'}, {'id': c_id, 'deleted': True}]
+                res = client.get('/api/animals/?modified_since={}&fields=id,name'.format(since))
+                assert json.loads(res.data.decode('utf-8')) == changes
+
+                # page by page, the cursor covers both changes and deletions
+                res = client.get('/api/animals/?modified_since={}&fields=id,name&limit=1'.format(since))
+                assert json.loads(res.data.decode('utf-8')) == changes[:1]
+                assert res.headers.get('X-Sync-Token')
+                res = client.get('/api/animals/?modified_since={}&fields=id,name&limit=1&after={}'
+                                 .format(since, res.headers.get('X-Next-Cursor')))
+                assert json.loads(res.data.decode('utf-8')) == changes[1:]
+                assert res.headers.get('X-Sync-Token') is None and res.headers.get('X-Next-Cursor') is None
+
+                res = client.get('/api/animals/?modified_since={}&fields=id,name&stream=ndjson'.format(since))
+                assert [json.loads(line) for line in res.data.decode('utf-8').splitlines()] == changes
+
+                # deletions older than the tombstones retention are unknown
+                res = client.get('/api/animals/?modified_since=2000-01-01')
+                assert res.status_code == 410
+                res = client.get('/api/animals/?modified_since=yesterday')
+                assert res.status_code == 400
+                assert json.loads(res.data.decode('utf-8')).get('modified_since')
+
+                a.delete()
+                b.delete()
+
+
+def test_api_animals_change_stream():
+    """Test API pushes the committed animals changes to the matching subscribers, as server-sent events"""
+
+    def message(response):
+        return next(response.response).decode('utf-8')
+
+    def events(response, count):
+        messages = [message(response) for _ in range(count)]
+        return [(e.get('event'), json.loads(e.get('data', 'null'))) for e in
+                (dict(line.split(': ', 1) for line in m.strip().split('\n')) for m in messages)]
+
+    # binds the app to the current context
+    with clean_app_test_client(config_name="testing") as client:
+
+        client.application.config.update(SSE_HEARTBEAT=0.1, SSE_QUEUE_SIZE=3)
+
+        with dummy_owner() as owner:
+
+            with dummy_species() as species, dummy_species(name='dog') as other_species:
+
+                every = client.get('/api/animals/stream', buffered=False)
+                assert every.status_code == 200 and every.mimetype == 'text/event-stream'
+                filtered = client.get('/api/animals/stream?species_id={}'.format(species.get('id')), buffered=False)
+                assert message(every).startswith('retry:') and message(filtered).startswith('retry:')
+
+                animal = animal_schema.load({'name': 'pet', 'happy': 4, 'hungry': 42, 'species_id': species.get('id'),
+                                             'owner_id': owner.get('id')}).data
+                animal.save()
+                other = animal_schema.load({'name': 'rex', 'species_id': other_species.get('id'),
+                                            'owner_id': owner.get('id')}).data
+                other.save()
+                client.post('/api/animals/{}/feed'.format(animal.id))
+                animal.name = 'bad'
+                models.db.session.rollback()  # never published
+
+                expected = [('create', {'id': animal.id, 'name': 'pet', 'happy': 4, 'hungry': 42,
+                                        'species_id': species.get('id'), 'owner_id': owner.get('id')}),
+                            ('update', {'id': animal.id, 'name': 'pet', 'happy': 4, 'hungry': 32,
+                                        'species_id': species.get('id'), 'owner_id': owner.get('id')})]
+                assert events(filtered, 2) == expected
+                assert message(filtered) == ': keep-alive\n\n'
+
+                # the slow subscriber missed the oldest change
+                animal_id = animal.id
+                animal.delete()
+                assert [e[0] for e in events(every, 4)] == ['resync', 'create', 'update', 'delete']
+                assert events(filtered, 1) == [('delete', {'id': animal_id, 'name': 'pet', 'happy': 4,
+                                                           'hungry': 32, 'species_id': species.get('id'),
+                                                           'owner_id': owner.get('id')})]
+
+                assert client.get('/api/animals/stream?species_id__gt=1').status_code == 400
+                res = client.get('/api/animals/stream?owner_id=a')
+                assert json.loads(res.data.decode('utf-8')) == {'owner_id': ['Not a valid integer.']}
+                client.application.config['SSE_MAX_SUBSCRIBERS'] = 2
+                assert client.get('/api/animals/stream').status_code == 503
+
+                every.close()
+                filtered.close()
+                assert len(models.changes.hub) == 0
+                other.delete()
+
+
+def test_api_animals_sparse_fields():
+    """Test API dumps only the requested fields of animals, nested ones included"""
+
+    # binds the app to the current context
+    with clean_app_test_client(config_name="testing") as client:
+
+        with dummy_owner() as owner:
+
+            with dummy_species() as species:
+
+                animal = animal_schema.load({'name': 'pet', 'happy': 4, 'hungry': 42,
+                                             'species_id': species.get('id'), 'owner_id': owner.get('id')}).data
+                animal.save()
+
+                test_data = json.loads(client.get('/api/animals/?fields=id,name,hungry').data.decode('utf-8'))
+                assert test_data == [{'id': animal.id, 'name': 'pet', 'hungry': 42}]
+
+                test_data = json.loads(client.get('/api/animals/{}?fields=name,species.name,owner.user.nick'.format(
+                    animal.id)).data.decode('utf-8'))
+                assert test_data == {'name': 'pet', 'species': {'name': species.get('name')},
+                                     'owner': {'user': {'nick': 'testuser'}}}
+
+                # a whole nested field
+                test_data = json.loads(client.get('/api/animals/{}?fields=species'.format(animal.id)).data.decode('utf-8'))
+                # (without the species members counter, see CachedSpecies)
+                assert test_data == {'species': {k: v for k, v in species.items() if k != 'member_count'}}
+
+                for fields in ('id,weight', 'name.first', 'owner.pets'):
+                    res = client.get('/api/animals/?fields={}'.format(fields))
+                    assert res.status_code == 400
+                    assert json.loads(res.data.decode('utf-8')).get('fields')
+
+                animal.delete()
+
+
+def test_api_animals_filters():
+    """Test API filters animals by owner, species and stats"""
+
+    # binds the app to the current context
+    with clean_app_test_client(config_name="testing") as client:
+
+        with dummy_owner() as owner:
+
+            with dummy_species() as species:
+
+                other = models.Species(name='other', happy_rate=0, hunger_rate=0)
+                other.save()
+                for i, species_id in enumerate([species.get('id'), other.id] * 3):
+                    models.Animal(name='pet{}'.format(i), happy=i, hungry=10 * i, species_id=species_id,
+                                  owner_id=owner.get('id') if i % 3 else None).save()
+
+                def names(query):
+                    res = client.get('/api/animals/?fields=name&' + query)
+                    assert res.status_code == 200
+                    return [a.get('name') for a in json.loads(res.data.decode('utf-8'))]
+
+                assert names('species_id={}'.format(other.id)) == ['pet1', 'pet3', 'pet5']
+                assert names('species_id={}&hungry__gt=20'.format(species.get('id'))) == ['pet4']
+                assert names('owner_id={}&happy__lt=3'.format(owner.get('id'))) == ['pet1', 'pet2']
+                assert names('hungry__in=0,50&hungry__ne=0') == ['pet5']
+                assert names('name=pet3&limit=1') == ['pet3']
+
+                for query in ('hungry__gt=much', 'hungry__near=1', 'weight__gt=1', 'owner_id=abc',
+                              'species_id__in=1,two'):
+                    res = client.get('/api/animals/?' + query)
+                    assert res.status_code == 400
+                    assert list(json.loads(res.data.decode('utf-8'))) == [query.split('=')[0]]
+
+                for a in models.Animal.all():
+                    a.delete()
+                other.delete()
+
+
+def test_api_animals_top():
+    """Test API ranks the hungriest and unhappiest animals, from stored or derived stats"""
+
+    # binds the app to the current context
+    with clean_app_test_client(config_name="testing") as client:
+
+        with dummy_owner() as owner:
+
+            with dummy_species(happy_rate=1, hunger_rate=100) as species:
+
+                now = datetime.datetime.utcnow()
+                for i, (happy, hungry) in enumerate([(5, 10), (1, 30), (3, 30), (2, 20), (4, None)]):
+                    models.Animal(name='pet{}'.format(i), happy=happy, hungry=hungry, species_id=species.get('id'),
+                                  owner_id=owner.get('id') if i % 2 else None,
+                                  stats_updated_at=now - datetime.timedelta(hours=i)).save()
+
+                def names(query):
+                    res = client.get('/api/animals/top?fields=name&' + query)
+                    assert res.status_code == 200
+                    return [a.get('name') for a in json.loads(res.data.decode('utf-8'))]
+
+                assert names('k=3') == ['pet1', 'pet2', 'pet3']
+                assert names('by=happy&k=2') == ['pet1', 'pet3']
+                assert names('owner_id={}'.format(owner.get('id'))) == ['pet1', 'pet3']
+
+                # derived hungry : 10, 130, 230, 320, 400
+                client.application.config['LAZY_STATS'] = True
+                client.application.config['STREAM_CHUNK_SIZE'] = 2
+                assert names('k=3') == ['pet4', 'pet3', 'pet2']
+                assert names('owner_id={}&k=1'.format(owner.get('id'))) == ['pet3']
+                # derived happy : 5, 0, 1, -1, 0
+                assert names('by=happy') == ['pet3', 'pet1', 'pet4', 'pet2', 'pet0']
+
+                for query in ('by=weight', 'k=0', 'k=many', 'happy__gt=1'):
+                    assert client.get('/api/animals/top?' + query).status_code == 400
+
+                for a in models.Animal.all():
+                    a.delete()
+
+
+# BROWSE streamed
+@settings(deadline=None)
+@given(names=st.lists(st.text()), stream=st.sampled_from(['json', 'ndjson']))
+def test_api_can_stream_animals(names, stream):
+    """Test API can stream all animals (GET request)."""
+
+    # binds the app to the current context
+    with clean_app_test_client(config_name="testing") as client:
+
+        with dummy_owner() as owner:
+
+            with dummy_species() as species:
+
+                animal_list = []
+                for name in names:
+                    animal = animal_schema.load({'name': name, 'happy': 4, 'hungry': 42,
+                                                 'species_id': species.get('id'), 'owner_id': owner.get('id')}).data
+                    animal.save()
+                    animal_list.append(animal)
+
+                # small chunks to go through the chunking
+                client.application.config['STREAM_CHUNK_SIZE'] = 3
+
+                result = client.get('/api/animals/?stream={}&embed=species,owner.user'.format(stream))
+                assert result.status_code == 200
+                assert result.is_streamed
+                body = result.data.decode('utf-8')
+                if stream == 'json':
+                    test_data = json.loads(body)
+                else:
+                    test_data = [json.loads(line) for line in body.split('\n')[:-1]]
+
+                # same as a usual dump, in id order
+                assert test_data == animal_schema.dump(animal_list, many=True).data
+
+                for a in animal_list:
+                    # deleting animal before dropping species
+                    a.delete()
+
+
+def test_api_animals_bad_stream():
+    """Test API refuses unknown stream formats."""
+    with clean_app_test_client(config_name="testing") as client:
+        assert client.get('/api/animals/?stream=xml').status_code == 400
+
+
 # READ
 @given(name=st.text(), data=st.data())
 def test_api_can_get_animal_by_id(name, data):
@@ -106,6 +479,48 @@ def test_api_can_get_animal_by_id(name, data):
 
                 # deleting from db before dropping required species
                 animal.delete()
+
+
+def test_api_animal_conditional_get():
+    """Test API answers 304 Not Modified to an animal conditional GET, until it changes"""
+    # binds the app to the current context
+    with clean_app_test_client(config_name="testing") as client:
+
+        with dummy_owner() as owner:
+
+            with dummy_species() as species:
+
+                animal = animal_schema.load({'name': 'pet', 'happy': 4, 'hungry': 42,
+                                             'species_id': species.get('id'), 'owner_id': owner.get('id')}).data
+                animal.save()
+                animal.date_modified = datetime.datetime(2018, 3, 8, 18, 53, 52)
+                animal.save()
+
+                result = client.get('/api/animals/{}'.format(animal.id))
+                assert result.status_code == 200
+                etag, last_modified = result.headers.get('ETag'), result.headers.get('Last-Modified')
+                assert etag.startswith('W/"')
+
+                result = client.get('/api/animals/{}'.format(animal.id), headers={'If-None-Match': etag})
+                assert result.status_code == 304
+                assert not result.data
+                assert result.headers.get('ETag') == etag
+                result = client.get('/api/animals/{}'.format(animal.id), headers={'If-Modified-Since': last_modified})
+                assert result.status_code == 304
+                result = client.get('/api/animals/{}'.format(animal.id), headers={'If-None-Match': 'W/"other"'})
+                assert result.status_code == 200
+
+                # any change sends the new body
+                client.patch('/api/animals/', headers={'Content-Type': 'application/json'},
+                             data=json.dumps([{'id': animal.id, 'changes': {'name': 'renamed'}}]))
+                result = client.get('/api/animals/{}'.format(animal.id), headers={'If-None-Match': etag})
+                assert result.status_code == 200
+                assert json.loads(result.data.decode('utf-8')).get('name') == 'renamed'
+                assert result.headers.get('ETag') != etag
+
+                assert client.get('/api/animals/{}'.format(animal.id + 1)).status_code == 404
+
+                animal.delete()
 #
 #
 # # EDIT
@@ -176,6 +591,374 @@ def test_animal_creation(name, happy, hungry):
                 animal.delete()
 
 
+# ADD many
+@settings(deadline=None)
+@given(names=st.lists(st.text(), min_size=1), invalid=st.lists(st.integers(min_value=0), max_size=3), partial=st.booleans())
+def test_animal_bulk_creation(names, invalid, partial):
+    """Test API can create many animals at once (POST request with a list)"""
+    # binds the app to the current context
+    with clean_app_test_client(config_name="testing") as client:
+
+        with dummy_owner() as owner:
+
+            with dummy_species() as species:
+
+                items = [{'name': name, 'happy': 4, 'hungry': 42, 'species_id': species.get('id'), 'owner_id': owner.get('id')}
+                         for name in names]
+                invalid = {i % len(items) for i in invalid}
+                for i in invalid:
+                    if i % 2:
+                        items[i]['happy'] = 'not a number'  # refused by the schema
+                    else:
+                        items[i].pop('species_id')  # refused by the database
+
+                res = client.post(
+                    '/api/animals/{}'.format('?partial=true' if partial else ''),
+                    headers={'Content-Type': 'application/json'},
+                    data=json.dumps(items))
+                result = json.loads(res.data.decode('utf-8'))
+                assert {int(i) for i in result.get('errors')} == invalid
+
+                if invalid and (not partial or len(invalid) == len(items)):
+                    assert res.status_code == 400
+                    assert models.Animal.query.count() == 0
+                else:
+                    assert res.status_code == 201
+                    ids = result.get('ids')
+                    assert len(ids) == len(items)
+                    assert [i for i, id in enumerate(ids) if id is None] == sorted(invalid)
+                    assert models.Animal.query.count() == len(items) - len(invalid)
+
+                    for item, id in zip(items, ids):
+                        if id is not None:
+                            # consecutive request with id
+                            test_data = json.loads(client.get('/api/animals/{}'.format(id)).data.decode('utf-8'))
+                            assert test_data.get('name') == item.get('name')
+
+                # deleting animals from db before dropping species
+                for animal in models.Animal.all():
+                    animal.delete()
+
+
+def test_animal_bulk_creation_executemany():
+    """Test a bulk creation inserts the animals with one executemany INSERT, and returns their ids in order"""
+    # binds the app to the current context
+    with clean_app_test_client(config_name="testing") as client:
+
+        with dummy_species() as species:
+
+            inserts = []
+
+            def count_inserts(conn, cursor, statement, parameters, context, executemany):
+                if statement.startswith('INSERT INTO animals '):
+                    inserts.append(executemany)
+
+            engine = models.db.engine
+            sqlalchemy.event.listen(engine, 'before_cursor_execute', count_inserts)
+            try:
+                items = [{'name': 'pet{}'.format(i), 'species_id': species.get('id')} for i in range(50)]
+                res = client.post('/api/animals/', headers={'Content-Type': 'application/json'},
+                                  data=json.dumps(items))
+            finally:
+                sqlalchemy.event.remove(engine, 'before_cursor_execute', count_inserts)
+            assert res.status_code == 201
+            assert inserts == [True]
+
+            ids = json.loads(res.data.decode('utf-8')).get('ids')
+            assert [models.Animal.query.get(id).name for id in ids] == [item['name'] for item in items]
+
+            # other databases (concurrent inserts interleave) : one INSERT per row, getting its own id
+            inserts[:] = []
+            dialect = engine.dialect
+            name, dialect.name = dialect.name, 'mysql'
+            sqlalchemy.event.listen(engine, 'before_cursor_execute', count_inserts)
+            try:
+                rows = [{'name': 'row{}'.format(i), 'species_id': species.get('id')} for i in range(3)]
+                ids = bulk.insert_many(models.db.session, models.Animal.__table__, rows)
+                models.db.session.commit()
+            finally:
+                sqlalchemy.event.remove(engine, 'before_cursor_execute', count_inserts)
+                dialect.name = name
+            assert inserts == [False] * 3
+            assert [models.Animal.query.get(id).name for id in ids] == [row['name'] for row in rows]
+
+            for animal in models.Animal.all():
+                animal.delete()
+
+
+# EDIT many
+@settings(deadline=None)
+@given(stats=st.lists(st.tuples(st.integers(min_value=-2147483648, max_value=2147483647),
+                                st.none() | st.integers(min_value=-2147483648, max_value=2147483647)), min_size=1))
+def test_animal_bulk_edition(stats):
+    """Test API can edit many animals at once (PATCH request with a list)"""
+    # binds the app to the current context
+    with clean_app_test_client(config_name="testing") as client:
+
+        with dummy_owner() as owner:
+
+            with dummy_species() as species:
+
+                animals = [animal_schema.load({'name': 'pet{}'.format(i), 'happy': 4, 'hungry': 42,
+                                               'species_id': species.get('id'), 'owner_id': owner.get('id')}).data
+                           for i in range(len(stats))]
+                for a in animals:
+                    a.save()
+                ids = [a.id for a in animals]
+
+                # some change only happy, others both happy and hungry
+                changes = [{'id': id, 'changes': dict({'happy': happy}, **({'hungry': hungry} if hungry is not None else {}))}
+                           for id, (happy, hungry) in zip(ids, stats)]
+                changes.append({'id': max(ids) + 1, 'changes': {'name': 'ghost'}})
+
+                res = client.patch('/api/animals/', headers={'Content-Type': 'application/json'}, data=json.dumps(changes))
+                assert res.status_code == 200
+                result = json.loads(res.data.decode('utf-8'))
+                assert result.get('updated') == sorted(ids)
+                assert result.get('not_found') == [max(ids) + 1]
+
+                for id, (happy, hungry) in zip(ids, stats):
+                    test_data = json.loads(client.get('/api/animals/{}'.format(id)).data.decode('utf-8'))
+                    assert test_data.get('happy') == happy
+                    assert test_data.get('hungry') == (42 if hungry is None else hungry)
+
+                # invalid changes reject everything
+                res = client.patch('/api/animals/', headers={'Content-Type': 'application/json'},
+                                   data=json.dumps([{'id': ids[0], 'changes': {'happy': 'very'}},
+                                                    {'id': ids[0], 'changes': {'species': {}}}]))
+                assert res.status_code == 400
+                assert set(json.loads(res.data.decode('utf-8')).get('errors')) == {'0', '1'}
+
+                for a in models.Animal.all():
+                    a.delete()
+
+
+def test_animal_lazy_stats():
+    """Test animals stats are derived when read in lazy stats mode, and written only on user actions"""
+    # binds the app to the current context
+    with clean_app_test_client(config_name="testing") as client:
+
+        with dummy_owner() as owner:
+
+            with dummy_species(happy_rate=5, hunger_rate=23) as species:
+
+                animal = animal_schema.load({'name': 'pet', 'happy': 4, 'hungry': 42,
+                                             'species_id': species.get('id'), 'owner_id': owner.get('id')}).data
+                animal.save()
+                animal.stats_updated_at = datetime.datetime.utcnow() - datetime.timedelta(hours=2)
+                animal.save()
+                baseline = animal.stats_updated_at
+
+                client.application.config['LAZY_STATS'] = True
+
+                test_data = json.loads(client.get('/api/animals/{}'.format(animal.id)).data.decode('utf-8'))
+                assert (test_data.get('happy'), test_data.get('hungry')) == (-6, 88)
+                test_data = json.loads(client.get('/api/animals/').data.decode('utf-8'))
+                assert [(a.get('happy'), a.get('hungry')) for a in test_data] == [(-6, 88)]
+
+                # reading does not write anything
+                models.db.session.expire_all()
+                assert (animal.happy, animal.hungry, animal.stats_updated_at) == (4, 42, baseline)
+
+                # a write moves the baseline, without changing the current stats
+                res = client.patch('/api/animals/', headers={'Content-Type': 'application/json'},
+                                   data=json.dumps([{'id': animal.id, 'changes': {'name': 'renamed'}}]))
+                assert res.status_code == 200
+                models.db.session.expire_all()
+                assert (animal.happy, animal.hungry) == (-6, 88)
+                assert animal.stats_updated_at > baseline
+
+                res = client.patch('/api/animals/', headers={'Content-Type': 'application/json'},
+                                   data=json.dumps([{'id': animal.id, 'changes': {'happy': 100}}]))
+                assert res.status_code == 200
+                test_data = json.loads(client.get('/api/animals/{}'.format(animal.id)).data.decode('utf-8'))
+                assert (test_data.get('happy'), test_data.get('hungry')) == (100, 88)
+
+                # same through the unit of work
+                models.db.session.expire_all()
+                animal.stats_updated_at = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+                animal.save()
+                animal.name = 'pet'
+                animal.save()
+                assert (animal.happy, animal.hungry) == (95, 111)
+
+                for a in models.Animal.all():
+                    a.delete()
+
+
+def test_animal_actions():
+    """Test API feeds and plays with an animal, changing its stats relatively"""
+    # binds the app to the current context
+    with clean_app_test_client(config_name="testing") as client:
+
+        with dummy_owner() as owner:
+
+            with dummy_species() as species:
+
+                animal = animal_schema.load({'name': 'pet', 'happy': 4, 'hungry': 42,
+                                             'species_id': species.get('id'), 'owner_id': owner.get('id')}).data
+                animal.save()
+
+                res = client.post('/api/animals/{}/feed'.format(animal.id))
+                assert res.status_code == 200
+                test_data = json.loads(res.data.decode('utf-8'))
+                assert (test_data.get('happy'), test_data.get('hungry')) == (4, 32)
+
+                res = client.post('/api/animals/{}/play?fields=id,happy'.format(animal.id),
+                                  headers={'Content-Type': 'application/json'}, data=json.dumps({'amount': 3}))
+                assert json.loads(res.data.decode('utf-8')) == {'id': animal.id, 'happy': 7}
+
+                # the species statistics follow
+                stats = models.db.session.query(models.SpeciesStats).get(species.get('id'))
+                models.db.session.refresh(stats)
+                assert (stats.happy_sum, stats.hungry_sum) == (7, 32)
+
+                for amount in (0, -1, 'a', True, 1001):
+                    res = client.post('/api/animals/{}/feed'.format(animal.id),
+                                      headers={'Content-Type': 'application/json'}, data=json.dumps({'amount': amount}))
+                    assert res.status_code == 400
+                    assert json.loads(res.data.decode('utf-8')).get('amount')
+                assert client.post('/api/animals/424242/play').status_code == 404
+
+                # write-behind : actions are summed, and written at the end of the window
+                client.application.config['ACTIONS_FLUSH_WINDOW'] = 60
+                for _ in range(3):
+                    res = client.post('/api/animals/{}/feed'.format(animal.id))
+                    assert res.status_code == 202
+                    assert json.loads(res.data.decode('utf-8')) == {'id': animal.id, 'hungry': -10}
+                client.post('/api/animals/{}/play'.format(animal.id))
+                models.db.session.expire_all()
+                assert (animal.happy, animal.hungry) == (7, 32)
+
+                client.application.extensions['actions_buffer'].flush()
+                models.db.session.expire_all()
+                assert (animal.happy, animal.hungry) == (17, 2)
+
+                animal.delete()
+
+
+def test_action_buffer_flush_errors():
+    """Test failed flushes keep the deltas, raise only when called directly, and buffers are flushed at exit"""
+    applied = []
+    failures = [2]
+
+    def apply(deltas):
+        if failures[0]:
+            failures[0] -= 1
+            raise RuntimeError('database is down')
+        applied.append(deltas)
+
+    buffer = actions.WriteBehindBuffer(window=60, apply=apply)
+    buffer.add(1, 'hungry', -10)
+    with pytest.raises(RuntimeError):
+        buffer.flush()
+    buffer.add(1, 'hungry', -10)
+    buffer.flush(raise_errors=False)  # as the timer does
+    assert len(buffer) == 1 and not applied
+    buffer.flush()
+    assert applied == [{1: {'hungry': -20}}]
+
+    # one exit handler for every app
+    with clean_app_test_client(config_name="testing") as client:
+        client.application.config['ACTIONS_FLUSH_WINDOW'] = 60
+        with client.application.app_context():
+            buffer = actions.action_buffer()
+        assert buffer in actions._buffers
+        failures[0], applied[:] = 1, []
+        buffer._apply = apply
+        buffer.add(1, 'happy', 5)
+        actions._flush_buffers()  # logged only
+        assert len(buffer) == 1
+        actions._flush_buffers()
+        assert applied == [{1: {'happy': 5}}] and not len(buffer)
+
+
+def test_animal_actions_journal():
+    """Test actions are journaled, folded into the animals by compaction, and purged once folded"""
+    # binds the app to the current context
+    with clean_app_test_client(config_name="testing") as client:
+
+        with dummy_owner() as owner:
+
+            with dummy_species() as species:
+
+                animal = animal_schema.load({'name': 'pet', 'happy': 4, 'hungry': 42,
+                                             'species_id': species.get('id'), 'owner_id': owner.get('id')}).data
+                animal.save()
+                client.post('/api/animals/{}/feed'.format(animal.id))
+
+                # only recorded, with ACTIONS_JOURNAL
+                client.application.config['ACTIONS_JOURNAL'] = True
+                for action in ('feed', 'play', 'play'):
+                    res = client.post('/api/animals/{}/{}'.format(animal.id, action))
+                    assert res.status_code == 202
+                models.db.session.expire_all()
+                assert (animal.happy, animal.hungry) == (4, 32)
+                events = models.AnimalEvent.query.order_by(models.AnimalEvent.id).all()
+                assert [(e.action, e.happy, e.hungry, e.applied) for e in events] == [
+                    ('create', 4, 42, True), ('feed', 0, -10, True),
+                    ('feed', 0, -10, False), ('play', 10, 0, False), ('play', 10, 0, False)]
+                assert models.journal.rebuild(animal.id) == (24, 22)
+
+                result = models.journal.compact(chunk_size=2)
+                assert result == (5, True)
+                models.db.session.expire_all()
+                assert (animal.happy, animal.hungry) == (24, 22)
+                stats = models.db.session.query(models.SpeciesStats).get(species.get('id'))
+                assert (stats.happy_sum, stats.hungry_sum) == (24, 22)
+                assert all(e.folded and e.applied for e in models.AnimalEvent.query.all())
+                assert models.journal.compact() == (0, True)
+
+                # an action committed after later events were folded (a long transaction) is folded all the same
+                models.db.session.add(models.AnimalEvent(id=0, animal_id=animal.id, action='feed', happy=0, hungry=-2,
+                                                         applied=False))
+                models.db.session.commit()
+                assert models.journal.rebuild(animal.id) == (24, 20)
+                assert models.journal.compact() == (1, True)
+                models.db.session.expire_all()
+                assert (animal.happy, animal.hungry) == (24, 20)
+                assert models.journal.rebuild(animal.id) == (24, 20)
+
+                # ORM writes are journaled too, and rebuilt from the checkpoint
+                animal.hungry = 100
+                animal.save()
+                assert models.journal.rebuild(animal.id) == (24, 100)
+
+                assert models.journal.purge(datetime.datetime.utcnow() + datetime.timedelta(days=1), chunk_size=2) == 6
+                assert [e.action for e in models.AnimalEvent.query.all()] == ['edit']
+                assert models.journal.rebuild(animal.id) == (24, 100)
+
+                # bulk creations skip the ORM events, and journal their own
+                res = client.post('/api/animals/', headers={'Content-Type': 'application/json'},
+                                  data=json.dumps([{'name': 'bulk', 'hungry': 10, 'species_id': species.get('id')},
+                                                   {'name': 'bulk', 'happy': 3, 'species_id': species.get('id')}]))
+                assert res.status_code == 201
+                ids = json.loads(res.data.decode('utf-8'))['ids']
+                assert [models.journal.rebuild(id) for id in ids] == [(0, 10), (3, 0)]
+
+                # bulk edits and simulation ticks too : the journal keeps following the stored stats
+                res = client.patch('/api/animals/', headers={'Content-Type': 'application/json'},
+                                   data=json.dumps([{'id': animal.id, 'changes': {'hungry': 50}},
+                                                    {'id': ids[0], 'changes': {'name': 'renamed'}}]))
+                assert res.status_code == 200
+                assert models.journal.rebuild(animal.id) == (24, 50)
+                models.db.session.execute(models.Animal.__table__.update().values(
+                    stats_updated_at=datetime.datetime.utcnow() - datetime.timedelta(hours=2)))
+                models.db.session.commit()
+                simulation.tick()
+                models.db.session.expire_all()
+                for a in models.Animal.all():
+                    assert models.journal.rebuild(a.id) == (a.happy, a.hungry)
+                assert (animal.happy, animal.hungry) != (24, 50)
+                animal.hungry = 7
+                animal.save()
+                assert models.journal.compact().complete
+                assert models.journal.rebuild(animal.id) == (animal.happy, 7)
+
+                for a in models.Animal.all():
+                    a.delete()
+
+
 # DELETE
 @given(name=st.text(), happy=st.integers(min_value=-2147483648, max_value=2147483647), hungry=st.integers(min_value=-2147483648, max_value=2147483647))
 def test_animal_deletion(name, happy, hungry):
@@ -0,0 +1,79 @@
+import json
+
+try:
+    from .utils import clean_app_test_client, dummy_owner
+except SystemError:
+    from utils import clean_app_test_client, dummy_owner
+
+
+def post_batch(client, subrequests):
+    return client.post('/api/batch', data=json.dumps(subrequests), content_type='application/json')
+
+
+def test_batch_dispatches_in_one_transaction():
+    """Test API runs a batch of calls in order, and commits them together"""
+
+    with clean_app_test_client(config_name="testing") as client:
+
+        with dummy_owner() as owner:
+
+            res = post_batch(client, [
+                {'method': 'POST', 'path': '/api/species/', 'body': {'name': 'cat', 'happy_rate': 5, 'hunger_rate': 3}},
+                {'method': 'GET', 'path': '/api/owners/{}?embed=user'.format(owner.get('id'))},
+                {'path': '/api/species/?fields=name'},
+            ])
+            assert res.status_code == 200
+            results = json.loads(res.data.decode('utf-8'))
+            assert [r['status'] for r in results] == [201, 200, 200]
+            species_id = results[0]['body']['id']
+            assert results[1]['body']['user']['nick'] == 'testuser' and results[1]['headers'].get('ETag')
+            assert results[2]['body'] == [{'name': 'cat'}]
+
+            res = client.get('/api/species/{}'.format(species_id))
+            assert json.loads(res.data.decode('utf-8')).get('name') == 'cat'
+
+            client.delete('/api/species/{}'.format(species_id))
+
+
+def test_batch_rolls_back_on_error():
+    """Test API rolls back the whole batch when one call fails, caches included"""
+
+    with clean_app_test_client(config_name="testing") as client:
+
+        assert json.loads(client.get('/api/species/').data.decode('utf-8')) == []
+
+        res = post_batch(client, [
+            {'method': 'POST', 'path': '/api/species/', 'body': {'name': 'dog', 'happy_rate': 5, 'hunger_rate': 3}},
+            {'method': 'GET', 'path': '/api/species/'},
+            {'method': 'GET', 'path': '/api/species/424242'},
+            {'method': 'GET', 'path': '/api/species/'},
+        ])
+        assert res.status_code == 404
+        results = json.loads(res.data.decode('utf-8'))
+        assert [r['status'] for r in results] == [201, 200, 404]
+        assert [s['name'] for s in results[1]['body']] == ['dog']
+
+        # the list cached during the batch is not served anymore
+        assert json.loads(client.get('/api/species/').data.decode('utf-8')) == []
+
+
+def test_batch_bad_requests():
+    """Test API refuses invalid batches"""
+
+    with clean_app_test_client(config_name="testing") as client:
+
+        assert post_batch(client, {'path': '/api/species/'}).status_code == 400
+
+        res = post_batch(client, [{'path': '/api/species/'}, {'method': 'GET', 'path': '/api/batch'},
+                                  {'method': 'TRACE', 'path': 'http://example.com/'}])
+        assert res.status_code == 400
+        assert json.loads(res.data.decode('utf-8')) == {
+            '1': {'path': ['Not a valid API path.']},
+            '2': {'method': ['Must be one of: GET, POST, PUT, PATCH, DELETE.'], 'path': ['Not a valid API path.']}}
+
+        res = post_batch(client, [{'path': '/api/animals/stream'}])
+        assert json.loads(res.data.decode('utf-8')) == {'0': {'path': ['Not a valid API path.']}}
+
+        client.application.config['BATCH_MAX'] = 1
+        res = post_batch(client, [{'path': '/api/species/'}, {'path': '/api/owners/'}])
+        assert res.status_code == 400
@@ -0,0 +1,57 @@
+import os
+
+from flask_migrate import Migrate, downgrade, upgrade
+
+from app import create_app, models
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+
+
+def test_migrations_backfill_existing_animals(tmp_path):
+    """Test the migrations adding animals state fill it for the existing animals, and can be reverted"""
+    app = create_app(config_name="testing")
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///{}'.format(tmp_path / 'migrated.db')
+    Migrate(app, models.db)
+
+    with app.app_context():
+        # before the counters and the journal
+        upgrade(directory=MIGRATIONS, revision='c3d8e1f04a56')
+        session = models.db.session
+        session.execute("INSERT INTO users (id, nick) VALUES (1, 'user')")
+        session.execute("INSERT INTO owners (id, user_id) VALUES (1, 1)")
+        session.execute("INSERT INTO species (id, name, happy_rate, hunger_rate) "
+                        "VALUES (1, 'cat', 1, 1), (2, 'dog', 1, 1)")
+        session.execute("INSERT INTO animals (id, name, happy, hungry, owner_id, species_id, date_modified) "
+                        "VALUES (1, 'pet', 4, 10, 1, 1, '2018-03-08 18:53:52'), (2, 'other', NULL, 7, NULL, 1, NULL)")
+        session.commit()
+
+        upgrade(directory=MIGRATIONS, revision='a6d4c2e8b317')
+        # counted, chunk by chunk
+        assert [tuple(row) for row in session.execute('SELECT id, pet_count FROM owners')] == [(1, 1)]
+        assert [tuple(row) for row in session.execute('SELECT id, member_count FROM species ORDER BY id')] == [
+            (1, 2), (2, 0)]
+        # the journal starts from the stats of the animals
+        assert [tuple(row) for row in session.execute(
+            'SELECT animal_id, event_id, happy, hungry FROM animal_checkpoints ORDER BY animal_id')] == [
+            (1, 0, 4, 10), (2, 0, 0, 7)]
+        # events up to the checkpoint of their animal were folded
+        session.execute("INSERT INTO animal_events (id, animal_id, action, happy, hungry, applied, date_created) "
+                        "VALUES (1, 1, 'feed', 0, -2, 0, '2018-03-08 18:53:52'), "
+                        "(2, 2, 'feed', 0, -1, 1, '2018-03-08 18:53:52'), "
+                        "(3, 1, 'play', 1, 0, 0, '2018-03-08 18:53:52')")
+        session.execute('UPDATE animal_checkpoints SET event_id = 2, hungry = 8 WHERE animal_id = 1')
+        session.commit()
+
+        upgrade(directory=MIGRATIONS)
+        assert [tuple(row) for row in session.execute(
+            'SELECT id, applied, folded FROM animal_events ORDER BY id')] == [(1, 1, 1), (2, 1, 0), (3, 0, 0)]
+        assert [models.journal.rebuild(id) for id in (1, 2)] == [(5, 8), (0, 6)]
+        # the stats clock starts at the last modification
+        assert [tuple(row) for row in session.execute(
+            'SELECT id, stats_updated_at FROM animals ORDER BY id')] == [(1, '2018-03-08 18:53:52'), (2, None)]
+        session.commit()
+
+        downgrade(directory=MIGRATIONS, revision='c3d8e1f04a56')
+        assert [tuple(row) for row in session.execute('SELECT id, happy, hungry FROM animals ORDER BY id')] == [
+            (1, 4, 10), (2, None, 7)]
+        session.remove()
@@ -0,0 +1,139 @@
+import io
+import json
+
+import pytest
+
+try:
+    from .utils import clean_app_test_client, dummy_owner, dummy_species
+except SystemError:
+    from utils import clean_app_test_client, dummy_owner, dummy_species
+
+from flask_api.mediatypes import MediaType
+
+from app import negotiation
+
+
+def post_animal(client, body, content_type):
+    return client.post('/api/animals/', data=body, content_type=content_type, headers={'Accept': 'application/json'})
+
+
+def test_json_renderer_and_parser():
+    """Test API renders and parses JSON with the fast codec, and the json module for indented responses"""
+
+    with clean_app_test_client(config_name="testing") as client:
+
+        with dummy_owner() as owner:
+
+            with dummy_species() as species:
+
+                animal = {'name': 'peté', 'happy': 4, 'hungry': 42, 'species_id': species.get('id'),
+                          'owner_id': owner.get('id')}
+                res = post_animal(client, json.dumps(animal), 'application/json')
+                assert res.status_code == 201
+                created = json.loads(res.data.decode('utf-8'))
+                assert created.get('name') == 'peté'
+
+                res = client.get('/api/animals/', headers={'Accept': 'application/json'})
+                assert res.mimetype == 'application/json'
+                assert json.loads(res.data.decode('utf-8')) == [created]
+                rendered = negotiation.JSONRenderer().render([created], MediaType('application/json'), indent=4)
+                assert json.loads(rendered) == [created] and '\n    ' in rendered
+
+                # errors keep their (integer) keys as strings
+                res = client.post('/api/batch', data=json.dumps([{'path': '/api/batch'}]),
+                                  content_type='application/json')
+                assert json.loads(res.data.decode('utf-8')) == {'0': {'path': ['Not a valid API path.']}}
+
+                assert post_animal(client, '{"name": ', 'application/json').status_code == 400
+                assert post_animal(client, json.dumps(animal), 'text/plain').status_code == 415
+
+                client.delete('/api/animals/{}'.format(created.get('id')))
+
+
+@pytest.mark.parametrize('name', ['msgpack', 'cbor'])
+def test_binary_renderer_and_parser(name):
+    """Test API renders and parses the binary formats, when their library is installed"""
+    codec = negotiation.CODECS[name]
+    if not codec.available:
+        pytest.skip('{} library not installed'.format(name))
+
+    with clean_app_test_client(config_name="testing") as client:
+
+        with dummy_owner() as owner:
+
+            with dummy_species() as species:
+
+                animal = {'name': 'pet', 'happy': 4, 'hungry': 42, 'species_id': species.get('id'),
+                          'owner_id': owner.get('id')}
+                res = client.post('/api/animals/', data=codec.dumps(animal), content_type=codec.media_type,
+                                  headers={'Accept': codec.media_type})
+                assert res.status_code == 201 and res.mimetype == codec.media_type
+                created = codec.loads(res.data)
+                assert created.get('name') == 'pet'
+
+                res = client.get('/api/animals/{}'.format(created.get('id')), headers={'Accept': codec.media_type})
+                assert codec.loads(res.data) == created
+
+                res = client.post('/api/animals/', data=b'\xc1', content_type=codec.media_type)
+                assert res.status_code == 400
+
+                client.delete('/api/animals/{}'.format(created.get('id')))
+
+
+def test_form_parsers():
+    """Test API still parses the form bodies (browsable API, form clients)"""
+
+    with clean_app_test_client(config_name="testing") as client:
+
+        for name, content_type in (('cat', 'application/x-www-form-urlencoded'), ('dog', 'multipart/form-data')):
+            res = client.post('/api/species/', data={'name': name, 'happy_rate': '3'}, content_type=content_type)
+            assert res.status_code == 201
+            assert json.loads(res.data.decode('utf-8')).get('happy_rate') == 3
+            client.delete('/api/species/{}'.format(json.loads(res.data.decode('utf-8')).get('id')))
+
+
+def test_chunked_bodies():
+    """Test API parses the chunked bodies, sent without Content-Length"""
+
+    def post_chunked(client, url, body):
+        return client.post(url, input_stream=io.BytesIO(body), content_type='application/json',
+                           headers={'Transfer-Encoding': 'chunked'}, environ_overrides={'wsgi.input_terminated': True})
+
+    with clean_app_test_client(config_name="testing") as client:
+
+        with dummy_owner() as owner:
+
+            with dummy_species() as species:
+
+                animal = {'name': 'chunk', 'happy': 4, 'hungry': 42, 'species_id': species.get('id'),
+                          'owner_id': owner.get('id')}
+                res = post_chunked(client, '/api/animals/', json.dumps(animal).encode('utf-8'))
+                assert res.status_code == 201
+                created = json.loads(res.data.decode('utf-8'))
+                assert created.get('hungry') == 42
+
+                res = post_chunked(client, '/api/animals/{}/feed'.format(created.get('id')), b'{"amount": 2}')
+                assert res.status_code == 200
+                assert json.loads(res.data.decode('utf-8')).get('hungry') == 40
+
+                # an empty chunked body is no body
+                res = post_chunked(client, '/api/animals/{}/feed'.format(created.get('id')), b'')
+                assert res.status_code == 200
+                assert post_chunked(client, '/api/animals/', b'{"name": ').status_code == 400
+
+                client.delete('/api/animals/{}'.format(created.get('id')))
+
+
+def test_register_leaves_out_missing_libraries():
+    """Test the renderers and parsers whose library is missing are not registered"""
+
+    with clean_app_test_client(config_name="testing") as client:
+
+        config = client.application.config
+        assert negotiation.JSONRenderer in config['DEFAULT_RENDERERS']
+        assert (negotiation.MsgPackRenderer in config['DEFAULT_RENDERERS']) == negotiation.CODECS['msgpack'].available
+        assert (negotiation.CBORParser in config['DEFAULT_PARSERS']) == negotiation.CODECS['cbor'].available
+
+        config['RENDERERS'] = ('json', 'yaml')
+        with pytest.raises(ValueError):
+            negotiation.register(client.application)
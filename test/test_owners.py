@@ -1,9 +1,10 @@
 import unittest
 import os
 import json
+import datetime
 
-
-from hypothesis import given
+import sqlalchemy
+from hypothesis import given, settings
 import hypothesis.strategies as st
 
 try:
@@ -25,6 +26,7 @@ def zip_strat(draw, st1, st2):
     return zip(list1, list2)
 
 
+@settings(deadline=None)
 @given(nicks_emails=zip_strat(st.lists(st.text(), unique=True), st.lists(st.text(), unique=True)))
 def test_api_can_get_owners(nicks_emails):
     """Test API can get a user (GET request)."""
@@ -47,7 +49,7 @@ def test_api_can_get_owners(nicks_emails):
 
                 own_list.append(owner)
 
-            result = client.get('/api/owners/')
+            result = client.get('/api/owners/?embed=user')
             assert result.status_code == 200
             test_data = json.loads(result.data.decode('utf-8'))
 
@@ -83,16 +85,223 @@ def test_api_can_get_owner_by_id(nick, email):
             result = client.get('/api/owners/{}'.format(owner.id))
             assert result.status_code == 200
             test_data = json.loads(result.data.decode('utf-8'))
+            # relationships are not embedded by default
+            assert test_data == {'id': owner.id, 'user_id': user.get('id'), 'pet_count': 0}
+
+            result = client.get('/api/owners/{}?embed=user,pets'.format(owner.id))
+            assert result.status_code == 200
+            test_data = json.loads(result.data.decode('utf-8'))
             # checking populated user data
             assert test_data.get('user') == user
             # checking populated pets data
-            assert test_data.get('pets') == None  #or [] ??
+            assert test_data.get('pets') == []
 
             # deleting owner before dropping user
             owner.delete()
 
             #print(test_data)
 
+def test_owner_conditional_get_with_embedded_pets():
+    """Test an owner embedding its pets is not modified only as long as its pets are not"""
+    # binds the app to the current context
+    with clean_app_test_client(config_name="testing") as client:
+
+        with dummy_user(nick='testuser', email='tester@comp.any') as user:
+
+            owner = owner_schema.load({'user_id': user.get('id')}).data
+            owner.save()
+            cat = models.Species(name='cat', happy_rate=0, hunger_rate=60)
+            cat.save()
+            pet = models.Animal(name='pet', happy=0, hungry=2, owner_id=owner.id, species_id=cat.id)
+            pet.save()
+            # dates have a one second precision
+            an_hour_ago = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+            models.db.session.execute(models.Animal.__table__.update().values(date_modified=an_hour_ago,
+                                                                              stats_updated_at=an_hour_ago))
+            models.db.session.commit()
+
+            def read(query, etag):
+                return client.get('/api/owners/{}?{}'.format(owner.id, query), headers={'If-None-Match': etag})
+
+            etags = {query: client.get('/api/owners/{}?{}'.format(owner.id, query)).headers.get('ETag')
+                     for query in ('embed=pets', 'fields=id')}
+            assert read('embed=pets', etags['embed=pets']).status_code == 304
+
+            res = client.post('/api/animals/{}/feed'.format(pet.id))
+            assert res.status_code == 200
+            res = read('embed=pets', etags['embed=pets'])
+            assert res.status_code == 200
+            assert json.loads(res.data.decode('utf-8'))['pets'][0]['hungry'] == -8
+            assert read('fields=id', etags['fields=id']).status_code == 304  # without the pets
+
+            # lazy stats change without any write
+            client.application.config['LAZY_STATS'] = True
+            etag = client.get('/api/owners/{}?embed=pets'.format(owner.id)).headers.get('ETag')
+            models.db.session.execute(models.Animal.__table__.update().values(
+                stats_updated_at=an_hour_ago - datetime.timedelta(hours=1)))  # as if an hour had passed
+            models.db.session.commit()
+            res = read('embed=pets', etag)
+            assert res.status_code == 200
+            assert 'Last-Modified' not in res.headers
+
+            pet.delete()
+            owner.delete()
+            cat.delete()
+
+
+def test_owners_cached_with_embedded_pets():
+    """Test cached owners pages embedding their pets follow the writes of the pets"""
+    # binds the app to the current context
+    with clean_app_test_client(config_name="testing") as client:
+
+        with dummy_user(nick='testuser', email='tester@comp.any') as user:
+
+            owner = owner_schema.load({'user_id': user.get('id')}).data
+            owner.save()
+            cat = models.Species(name='cat', happy_rate=0, hunger_rate=60)
+            cat.save()
+            pet = models.Animal(name='pet', happy=0, hungry=2, owner_id=owner.id, species_id=cat.id)
+            pet.save()
+
+            def pets():
+                res = client.get('/api/owners/?embed=pets')
+                assert res.status_code == 200
+                return json.loads(res.data.decode('utf-8'))[0]['pets'][0]
+
+            assert pets()['hungry'] == 2
+            assert client.post('/api/animals/{}/feed'.format(pet.id)).status_code == 200
+            assert pets()['hungry'] == -8
+            res = client.patch('/api/animals/', headers={'Content-Type': 'application/json'},
+                               data=json.dumps([{'id': pet.id, 'changes': {'name': 'other'}}]))
+            assert res.status_code == 200
+            assert pets()['name'] == 'other'
+
+            # lazy stats change without any write
+            client.application.config['LAZY_STATS'] = True
+            hungry = pets()['hungry']
+            models.db.session.execute(models.Animal.__table__.update().values(
+                stats_updated_at=datetime.datetime.utcnow() - datetime.timedelta(hours=1)))
+            models.db.session.commit()
+            assert pets()['hungry'] >= hungry + 59
+
+            pet.delete()
+            owner.delete()
+            cat.delete()
+
+
+def test_owner_and_species_counters():
+    """Test owners pet_count and species member_count follow animals ORM and bulk writes"""
+    # binds the app to the current context
+    with clean_app_test_client(config_name="testing") as client:
+
+        with dummy_user_list([('alice', 'alice@comp.any'), ('bob', 'bob@comp.any')]) as users:
+
+            alice, bob = [owner_schema.load({'user_id': u.get('id')}).data for u in users]
+            alice.save()
+            bob.save()
+            cat = models.Species(name='cat')
+            dog = models.Species(name='dog')
+            cat.save()
+            dog.save()
+
+            def counts():
+                return ([json.loads(client.get('/api/owners/{}'.format(o.id)).data.decode('utf-8')).get('pet_count')
+                         for o in (alice, bob)],
+                        [json.loads(client.get('/api/species/{}'.format(s.id)).data.decode('utf-8')).get('member_count')
+                         for s in (cat, dog)])
+
+            assert counts() == ([0, 0], [0, 0])
+            pets = [models.Animal(name='pet{}'.format(i), owner_id=alice.id, species_id=cat.id) for i in range(3)]
+            for pet in pets:
+                pet.save()
+            orphan = models.Animal(name='orphan', species_id=dog.id)
+            orphan.save()
+            assert counts() == ([3, 0], [3, 1])
+
+            pets[0].owner_id = bob.id  # reassignments
+            pets[0].species_id = dog.id
+            pets[0].save()
+            orphan.owner_id = bob.id
+            orphan.save()
+            pets[1].delete()
+            assert counts() == ([1, 2], [1, 2])
+
+            # bulk paths skip the ORM events
+            res = client.post('/api/animals/', headers={'Content-Type': 'application/json'},
+                              data=json.dumps([{'name': 'bulk', 'owner_id': alice.id, 'species_id': cat.id}] * 2))
+            assert res.status_code == 201
+            assert counts() == ([3, 2], [3, 2])
+            res = client.patch('/api/animals/', headers={'Content-Type': 'application/json'},
+                               data=json.dumps([{'id': id, 'changes': {'owner_id': bob.id, 'species_id': dog.id}}
+                                                for id in json.loads(res.data.decode('utf-8'))['ids']]))
+            assert res.status_code == 200
+            assert counts() == ([1, 4], [1, 4])
+
+            models.counters.rebuild()
+            assert counts() == ([1, 4], [1, 4])
+
+            for a in models.Animal.query.all():
+                a.delete()
+            assert counts() == ([0, 0], [0, 0])
+            for o in (alice, bob):
+                o.delete()
+            for s in (cat, dog):
+                s.delete()
+
+
+def test_owner_set_based_delete():
+    """Test API deletes owners with their pets orphaned, deleted or kept, in constant statements"""
+    # binds the app to the current context
+    with clean_app_test_client(config_name="testing") as client:
+
+        with dummy_user_list([('alice', 'alice@comp.any'), ('bob', 'bob@comp.any')]) as users:
+
+            cat = models.Species(name='cat')
+            cat.save()
+            statements = []
+
+            def count(*args):
+                statements.append(1)
+            sqlalchemy.event.listen(models.db.engine, 'before_cursor_execute', count)
+
+            def delete(pets, cascade):
+                owner = owner_schema.load({'user_id': users[0].get('id')}).data
+                owner.save()
+                for i in range(pets):
+                    models.Animal(name='pet', owner_id=owner.id, species_id=cat.id).save()
+                del statements[:]
+                res = client.delete('/api/owners/{}?cascade={}'.format(owner.id, cascade))
+                return res.status_code, len(statements), owner.id
+
+            def species_count():
+                return json.loads(client.get('/api/species/{}'.format(cat.id)).data.decode('utf-8')).get('member_count')
+
+            # same statements whatever the number of pets
+            assert delete(2, 'orphan')[:2] == delete(20, 'orphan')[:2]
+            assert species_count() == 22
+            assert models.Animal.query.filter(models.Animal.owner_id.isnot(None)).count() == 0
+
+            (status, few, _), (_, many, id) = delete(2, 'delete'), delete(20, 'delete')
+            assert status == 204 and few == many
+            assert species_count() == 22
+            assert models.SpeciesStats.query.get(cat.id).count == 22
+            assert json.loads(client.get('/api/owners/?modified_since=0').data.decode('utf-8')) == []
+            since = (datetime.datetime.utcnow() - datetime.timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M:%S')
+            res = client.get('/api/owners/?modified_since={}'.format(since))
+            assert {'id': id, 'deleted': True} in json.loads(res.data.decode('utf-8'))
+
+            status, _, id = delete(1, 'reject')
+            assert status == 409
+            assert client.delete('/api/owners/{}?cascade=bogus'.format(id)).status_code == 400
+            assert client.delete('/api/owners/{}'.format(id)).status_code == 204
+            assert client.delete('/api/owners/{}'.format(id)).status_code == 404
+
+            sqlalchemy.event.remove(models.db.engine, 'before_cursor_execute', count)
+            for a in models.Animal.query.all():
+                a.delete()
+            cat.delete()
+
+
 # # EDIT
 # @given(nick=st.text(), email=st.text(), new_email=st.text())
 # def test_owner_pets_can_be_edited(nick, email, new_email):
@@ -148,7 +357,7 @@ def test_owner_creation(nick, email):
             new_owner = json.loads(res.data.decode('utf-8'))
 
             # consecutive request with id
-            result = client.get('/api/owners/{}'.format(new_owner.get('id')))
+            result = client.get('/api/owners/{}?embed=user'.format(new_owner.get('id')))
             assert result.status_code == 200
             test_data = json.loads(result.data.decode('utf-8'))
             assert user == test_data.get('user')
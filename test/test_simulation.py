@@ -0,0 +1,182 @@
+import datetime
+
+from hypothesis import given, settings
+import hypothesis.strategies as st
+
+try:
+    from .utils import clean_app_test_client, dummy_species
+except SystemError:
+    from utils import clean_app_test_client, dummy_species
+
+from app import simulation
+from app.schemas.models.stats import advance_one
+from app.animals import models, animal_schema
+
+
+@settings(deadline=None)
+@given(stats=st.lists(st.tuples(st.integers(min_value=-1000, max_value=1000),
+                                st.integers(min_value=-1000, max_value=1000),
+                                st.integers(min_value=0, max_value=10 * 3600)), min_size=1),
+       chunk_size=st.integers(min_value=1, max_value=5))
+def test_tick_advances_stats(stats, chunk_size):
+    """Test a tick advances each animal by its own elapsed time, with its species rates"""
+
+    with clean_app_test_client(config_name="testing") as client:
+
+        with dummy_species(happy_rate=2, hunger_rate=4) as species:
+
+            now = datetime.datetime(2018, 3, 8, 18, 53, 52)
+            animals = []
+            for happy, hungry, elapsed in stats:
+                animal = animal_schema.load({'name': 'pet', 'happy': happy, 'hungry': hungry,
+                                             'species_id': species.get('id')}).data
+                animal.stats_updated_at = now - datetime.timedelta(seconds=elapsed)
+                animal.save()
+                animals.append(animal.id)
+
+            # a species without rates is skipped
+            still = models.Species(name='still', happy_rate=0, hunger_rate=0)
+            still.save()
+            still_animal = models.Animal(name='still', happy=1, hungry=1, species_id=still.id)
+            still_animal.save()
+
+            result = simulation.tick(chunk_size=chunk_size, now=now)
+            assert result == simulation.TickResult(len([s for s in stats if s[2] >= 1800]), None)
+
+            # whole half hours (one happy, two hungry), the rest carries over
+            for id, (happy, hungry, elapsed) in zip(animals, stats):
+                animal = models.Animal.query.get(id)
+                used = elapsed - elapsed % 1800
+                assert (animal.happy, animal.hungry) == advance_one(happy, hungry, 2, 4, used, 3600)
+                assert animal.stats_updated_at == now - datetime.timedelta(seconds=elapsed - used)
+
+            # nothing more to do at the same time
+            result = simulation.tick(chunk_size=chunk_size, now=now)
+            assert result.updated == 0
+            for id, (happy, hungry, elapsed) in zip(animals, stats):
+                animal = models.Animal.query.get(id)
+                used = elapsed - elapsed % 1800
+                assert (animal.happy, animal.hungry) == advance_one(happy, hungry, 2, 4, used, 3600)
+
+            assert (still_animal.happy, still_animal.hungry) == (1, 1)
+
+            for a in models.Animal.all():
+                a.delete()
+            still.delete()
+
+
+def test_tick_budget_resumes():
+    """Test a tick stops when its budget is exhausted, and can be resumed"""
+
+    with clean_app_test_client(config_name="testing") as client:
+
+        with dummy_species(happy_rate=1, hunger_rate=1) as species:
+
+            now = datetime.datetime(2018, 3, 8, 18, 53, 52)
+            for i in range(5):
+                models.Animal(name='pet', happy=0, hungry=0, species_id=species.get('id'),
+                              stats_updated_at=now - datetime.timedelta(hours=1)).save()
+
+            # no budget left : one chunk at a time
+            result = simulation.tick(chunk_size=2, budget=0, now=now)
+            assert result.updated == 2
+            updated = result.updated
+            while result.resume:
+                result = simulation.tick(chunk_size=2, budget=0, now=now, resume=result.resume)
+                updated += result.updated
+            assert updated == 5
+
+            assert [(a.happy, a.hungry) for a in models.Animal.all()] == [(-1, 1)] * 5
+
+            for a in models.Animal.all():
+                a.delete()
+
+
+def test_frequent_ticks_keep_decay():
+    """Test frequent ticks at a low rate carry the changes under a whole step over, instead of losing them"""
+
+    with clean_app_test_client(config_name="testing") as client:
+
+        with dummy_species(happy_rate=5, hunger_rate=5) as species:
+
+            start = datetime.datetime(2018, 3, 8, 18, 0, 0)
+            animal = models.Animal(name='pet', happy=100, hungry=0, species_id=species.get('id'),
+                                   stats_updated_at=start)
+            animal.save()
+
+            for minute in range(1, 121):  # a tick a minute, for two hours
+                simulation.tick(now=start + datetime.timedelta(minutes=minute))
+            models.db.session.expire_all()
+            assert (animal.happy, animal.hungry) == (90, 10)
+            assert animal.stats_updated_at == start + datetime.timedelta(hours=2)
+
+            animal.delete()
+
+
+def test_tick_adds_to_concurrent_changes():
+    """Test a tick adds its changes to the stats, instead of overwriting the changes written since it read them"""
+
+    with clean_app_test_client(config_name="testing") as client:
+
+        with dummy_species(happy_rate=1, hunger_rate=1) as species:
+
+            now = datetime.datetime(2018, 3, 8, 18, 53, 52)
+            animal = models.Animal(name='pet', happy=0, hungry=10, species_id=species.get('id'),
+                                   stats_updated_at=now - datetime.timedelta(hours=2))
+            animal.save()
+
+            # a meal committed between the read of the chunk and its write
+            whole_changes = simulation.whole_changes
+
+            def fed_meanwhile(*args):
+                models.db.session.execute(models.Animal.__table__.update().values(
+                    hungry=models.Animal.__table__.c.hungry - 5))
+                return whole_changes(*args)
+
+            simulation.whole_changes = fed_meanwhile
+            try:
+                simulation.tick(now=now)
+            finally:
+                simulation.whole_changes = whole_changes
+            models.db.session.expire_all()
+            assert (animal.happy, animal.hungry) == (-2, 7)
+
+            animal.delete()
+
+
+def test_tick_keeps_decay_across_writes():
+    """Test the writes between two ticks (actions, edits) do not reset the time elapsed since the last one"""
+
+    with clean_app_test_client(config_name="testing") as client:
+
+        with dummy_species(happy_rate=0, hunger_rate=3600) as species:
+
+            an_hour_ago = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+            fed = models.Animal(name='fed', happy=0, hungry=0, species_id=species.get('id'),
+                                stats_updated_at=an_hour_ago)
+            renamed = models.Animal(name='renamed', happy=0, hungry=0, species_id=species.get('id'),
+                                    stats_updated_at=an_hour_ago)
+            fed.save()
+            renamed.save()
+
+            res = client.post('/api/animals/{}/feed'.format(fed.id), headers={'Content-Type': 'application/json'},
+                              data='{"amount": 1}')
+            assert res.status_code == 200
+            res = client.patch('/api/animals/', headers={'Content-Type': 'application/json'},
+                               data='[{"id": %d, "changes": {"name": "other"}}]' % renamed.id)
+            assert res.status_code == 200
+
+            simulation.tick()
+            models.db.session.expire_all()
+            assert 3598 <= fed.hungry <= 3601  # an hour of hunger, less the meal
+            assert 3599 <= renamed.hungry <= 3602
+
+            # setting a stat restarts the clock
+            renamed.hungry = 0
+            renamed.save()
+            simulation.tick()
+            models.db.session.expire_all()
+            assert 0 <= renamed.hungry <= 2
+
+            for a in models.Animal.all():
+                a.delete()
@@ -1,16 +1,19 @@
 import unittest
 import os
 import json
+import datetime
 
+import sqlalchemy
 from hypothesis import given
 import hypothesis.strategies as st
 
 try:
-    from .utils import clean_app_test_client
+    from .utils import clean_app_test_client, dummy_owner
 except SystemError:
-    from utils import clean_app_test_client
+    from utils import clean_app_test_client, dummy_owner
 
-from app.species import species_schema
+from app import caching, simulation
+from app.species import models, species_schema
 
 
 # BROWSE
@@ -51,6 +54,100 @@ def test_api_can_get_species(names, data):
         for d in dict_list:
             assert d in [{'name': t.get('name'), 'happy_rate': t.get('happy_rate'), 'hunger_rate': t.get('hunger_rate')} for t in test_data]
 
+# BROWSE by pages
+@given(names=st.lists(st.text(), unique=True), limit=st.integers(min_value=1, max_value=10))
+def test_api_can_browse_species_pages(names, limit):
+    """Test API can walk through all species, page by page, following the cursor."""
+
+    # binds the app to the current context
+    with clean_app_test_client(config_name="testing") as client:
+
+        for name in names:
+            species_schema.load({'name': name, 'happy_rate': 5, 'hunger_rate': 23}).data.save()
+
+        browsed = []
+        url = '/api/species/?limit={}'.format(limit)
+        while url:
+            result = client.get(url)
+            assert result.status_code == 200
+            test_data = json.loads(result.data.decode('utf-8'))
+            assert len(test_data) <= limit
+            browsed += [t.get('name') for t in test_data]
+
+            cursor = result.headers.get('X-Next-Cursor')
+            if cursor:
+                assert len(test_data) == limit
+                assert 'after={}'.format(cursor) in result.headers.get('Link')
+                url = '/api/species/?limit={}&after={}'.format(limit, cursor)
+            else:
+                url = None
+
+        # every species exactly once, in id order
+        assert browsed == names
+
+
+def test_api_species_pages_bad_arguments():
+    """Test API refuses invalid pagination arguments."""
+    with clean_app_test_client(config_name="testing") as client:
+        assert client.get('/api/species/?limit=0').status_code == 400
+        assert client.get('/api/species/?limit=many').status_code == 400
+        assert client.get('/api/species/?after=last').status_code == 400
+        assert client.get('/api/species/?limit=all').status_code == 200
+
+
+def test_species_set_based_delete():
+    """Test API refuses to delete species with members, unless asked to delete them too"""
+
+    # binds the app to the current context
+    with clean_app_test_client(config_name="testing") as client:
+
+        with dummy_owner() as owner:
+
+            cat = models.Species(name='cat')
+            cat.save()
+            for i in range(3):
+                models.Animal(name='pet', owner_id=owner.get('id'), species_id=cat.id).save()
+
+            assert client.delete('/api/species/{}'.format(cat.id)).status_code == 409
+            assert client.delete('/api/species/{}?cascade=orphan'.format(cat.id)).status_code == 400
+            assert models.Animal.query.count() == 3
+
+            assert client.delete('/api/species/{}?cascade=delete'.format(cat.id)).status_code == 204
+            assert models.Animal.query.count() == 0
+            assert models.SpeciesStats.query.count() == 0
+            res = client.get('/api/owners/{}'.format(owner.get('id')))
+            assert json.loads(res.data.decode('utf-8')).get('pet_count') == 0
+            assert client.get('/api/species/{}'.format(cat.id)).status_code == 404
+
+
+# READ many
+@given(names=st.lists(st.text(), unique=True, min_size=1, max_size=10), data=st.data())
+def test_api_can_get_species_by_ids(names, data):
+    """Test API can get species by id list, in request order, missing ones marked."""
+
+    # binds the app to the current context
+    with clean_app_test_client(config_name="testing") as client:
+
+        ids = []
+        for name in names:
+            species = species_schema.load({'name': name, 'happy_rate': 5, 'hunger_rate': 23}).data
+            species.save()
+            ids.append(species.id)
+
+        missing = max(ids) + 1
+        requested = data.draw(st.lists(st.sampled_from(ids + [missing])), label='requested')
+        result = client.get('/api/species/?ids={}'.format(','.join(str(id) for id in requested)))
+        assert result.status_code == 200
+        test_data = json.loads(result.data.decode('utf-8'))
+
+        assert [t.get('id') for t in test_data] == requested
+        for id, t in zip(requested, test_data):
+            if id == missing:
+                assert t == {'id': id, 'not_found': True}
+            else:
+                assert t.get('name') == names[ids.index(id)]
+
+
 # READ
 @given(
     name=st.text(),
@@ -119,6 +216,168 @@ def test_species_hunger_can_be_edited(name, happy_rate, hunger_rate, new_hunger_
 # TODO : More edits (check if allowed or not)
 
 
+def test_species_cache():
+    """Test animals nested species are dumped through the species cache, invalidated by species edits"""
+
+    # binds the app to the current context
+    with clean_app_test_client(config_name="testing") as client:
+
+        species = species_schema.load({'name': 'cached', 'happy_rate': 1, 'hunger_rate': 2}).data
+        species.save()
+        animal = models.Animal(name='pet', species_id=species.id)
+        animal.save()
+
+        for _ in range(3):
+            test_data = json.loads(client.get('/api/animals/{}?embed=species'.format(animal.id)).data.decode('utf-8'))
+            assert test_data.get('species') == {'id': species.id, 'name': 'cached', 'happy_rate': 1, 'hunger_rate': 2}
+
+        stats = json.loads(client.get('/api/species/cache').data.decode('utf-8'))
+        assert (stats.get('hits'), stats.get('misses'), stats.get('size')) == (2, 1, 2)
+
+        result = client.put('/api/species/{}'.format(species.id), headers={'Content-Type': 'application/json'},
+                            data=json.dumps({"name": 'renamed'}))
+        assert result.status_code == 200
+        test_data = json.loads(client.get('/api/animals/{}?embed=species'.format(animal.id)).data.decode('utf-8'))
+        assert test_data.get('species').get('name') == 'renamed'
+
+        animal.delete()
+        species.delete()
+
+
+def test_species_list_response_cache():
+    """Test species list responses are cached until a species is written"""
+
+    # binds the app to the current context
+    with clean_app_test_client(config_name="testing") as client:
+
+        species = species_schema.load({'name': 'cached', 'happy_rate': 1, 'hunger_rate': 2}).data
+        species.save()
+
+        first = client.get('/api/species/')
+        assert [s.get('name') for s in json.loads(first.data.decode('utf-8'))] == ['cached']
+        second = client.get('/api/species/')
+        assert second.data == first.data
+        assert second.headers.get('Content-Type') == first.headers.get('Content-Type')
+        assert caching.response_cache().stats().get('hits') == 1
+
+        # other parameters, other response
+        assert json.loads(client.get('/api/species/?limit=all').data.decode('utf-8'))[0].get('name') == 'cached'
+        assert caching.response_cache().stats().get('hits') == 1
+
+        client.post('/api/species/', headers={'Content-Type': 'application/json'},
+                    data=json.dumps([{'name': 'bulk', 'happy_rate': 1, 'hunger_rate': 2}]))
+        assert [s.get('name') for s in json.loads(client.get('/api/species/').data.decode('utf-8'))] == ['cached', 'bulk']
+
+        species.name = 'renamed'
+        species.save()
+        assert [s.get('name') for s in json.loads(client.get('/api/species/').data.decode('utf-8'))] == ['renamed', 'bulk']
+
+        for s in models.Species.query.all():
+            s.delete()
+
+
+def test_species_stats_concurrent_first_animals():
+    """Test the first animals of a species are aggregated when a concurrent transaction inserted its stats first"""
+
+    # binds the app to the current context
+    with clean_app_test_client(config_name="testing") as client:
+
+        cat = species_schema.load({'name': 'cat', 'happy_rate': 0, 'hunger_rate': 0}).data
+        cat.save()
+
+        # the other transaction commits its row once ours was not found, before ours is inserted
+        def concurrent(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith('SAVEPOINT') and not concurrent.done:
+                concurrent.done = True
+                cursor.execute('INSERT INTO species_stats (species_id, count, happy_count, happy_sum, happy_min, '
+                               'happy_max, hungry_count, hungry_sum, hungry_min, hungry_max) '
+                               'VALUES (?, 1, 1, 6, 6, 6, 1, 60, 60, 60)', (cat.id,))
+        concurrent.done = False
+
+        sqlalchemy.event.listen(models.db.engine, 'before_cursor_execute', concurrent)
+        try:
+            pet = models.Animal(name='pet', happy=2, hungry=10, species_id=cat.id)
+            pet.save()
+        finally:
+            sqlalchemy.event.remove(models.db.engine, 'before_cursor_execute', concurrent)
+        assert concurrent.done
+
+        stats = models.SpeciesStats.query.get(cat.id)
+        assert (stats.count, stats.happy_sum, stats.happy_min, stats.happy_max, stats.hungry_sum) == (2, 8, 2, 6, 70)
+
+        pet.delete()
+        cat.delete()
+
+
+def test_species_stats_rollup():
+    """Test species stats follow animals ORM, bulk and simulation writes, and match a rebuild"""
+
+    # binds the app to the current context
+    with clean_app_test_client(config_name="testing") as client:
+
+        first = species_schema.load({'name': 'first', 'happy_rate': 0, 'hunger_rate': 10}).data
+        first.save()
+        second = species_schema.load({'name': 'second', 'happy_rate': 0, 'hunger_rate': 0}).data
+        second.save()
+
+        def stats(id):
+            res = client.get('/api/species/{}/stats'.format(id))
+            assert res.status_code == 200
+            data = json.loads(res.data.decode('utf-8'))
+            return (data['count'], data['happy_avg'], data['happy_min'], data['happy_max'],
+                    data['hungry_avg'], data['hungry_min'], data['hungry_max'])
+
+        assert stats(first.id) == (0, None, None, None, None, None, None)
+
+        pets = [models.Animal(name='pet{}'.format(i), happy=happy, hungry=hungry, species_id=first.id)
+                for i, (happy, hungry) in enumerate([(2, 10), (4, 20), (9, 30)])]
+        for pet in pets:
+            pet.save()
+        assert stats(first.id) == (3, 5.0, 2, 9, 20.0, 10, 30)
+
+        pets[2].happy = 3  # the max goes away
+        pets[2].save()
+        pets[0].species_id = second.id
+        pets[0].save()
+        assert stats(first.id) == (2, 3.5, 3, 4, 25.0, 20, 30)
+        assert stats(second.id) == (1, 2.0, 2, 2, 10.0, 10, 10)
+
+        pets[1].delete()
+        assert stats(first.id) == (1, 3.0, 3, 3, 30.0, 30, 30)
+
+        # bulk paths skip the ORM events
+        res = client.post('/api/animals/', headers={'Content-Type': 'application/json'},
+                          data=json.dumps([{'name': 'bulk{}'.format(i), 'happy': i, 'hungry': 1, 'species_id': first.id}
+                                           for i in range(4)]))
+        assert res.status_code == 201
+        assert stats(first.id) == (5, 1.8, 0, 3, 6.8, 1, 30)
+        ids = json.loads(res.data.decode('utf-8'))['ids']
+        res = client.patch('/api/animals/', headers={'Content-Type': 'application/json'},
+                           data=json.dumps([{'id': ids[0], 'changes': {'species_id': second.id}},
+                                            {'id': pets[2].id, 'changes': {'hungry': 0}}]))
+        assert res.status_code == 200
+        assert stats(first.id) == (4, 2.25, 1, 3, 0.75, 0, 1)
+        assert stats(second.id) == (2, 1.0, 0, 2, 5.5, 1, 10)
+
+        simulation.tick(period=3600, now=datetime.datetime.utcnow() + datetime.timedelta(hours=1))
+        assert stats(first.id)[4:] == (10.75, 10, 11)
+
+        res = client.get('/api/species/stats')
+        assert res.status_code == 200
+        before = json.loads(res.data.decode('utf-8'))
+        assert [s['species_id'] for s in before] == [first.id, second.id]
+        assert models.species_stats.rebuild() == 2
+        assert json.loads(client.get('/api/species/stats').data.decode('utf-8')) == before
+
+        assert client.get('/api/species/{}/stats'.format(second.id + 1)).status_code == 404
+
+        for a in models.Animal.all():
+            a.delete()
+        assert stats(first.id)[0] == 0
+        for s in models.Species.all():
+            s.delete()
+
+
 # ADD
 @given(name=st.text(),
        happy_rate=st.integers(min_value=-2147483648, max_value=2147483647),
@@ -1,7 +1,7 @@
 import unittest
 import json
 
-from hypothesis import given
+from hypothesis import given, settings
 import hypothesis.strategies as st
 
 try:
@@ -57,6 +57,7 @@ def test_api_can_get_users(nicks_emails):
 
 
 # READ
+@settings(deadline=None)
 @given(nick=st.text(), email=st.text())
 def test_api_can_get_user_by_id(nick, email):
     """Test API can get a single user by using it's id."""